@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "pdf_processing.replicas.ReplicaPinningMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -76,13 +78,109 @@ WSGI_APPLICATION = "invoice_processor.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+#
+# DATABASE_PROFILE selects the database:
+#   "sqlite"   - SQLite in WAL mode, tuned for several concurrent workers
+#   "postgres" - PostgreSQL with persistent (or pooled) connections
+
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite")
+
+if DATABASE_PROFILE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "invoice_processor"),
+            "USER": os.environ.get("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            # Reuse connections across requests/tasks, checking them first
+            "CONN_MAX_AGE": 60,
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+    if os.environ.get("POSTGRES_POOL"):
+        # psycopg connection pool (requires psycopg[pool]); replaces CONN_MAX_AGE
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"] = {
+            "pool": {"min_size": 2, "max_size": int(os.environ["POSTGRES_POOL"])},
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                # WAL lets readers run alongside the single writer; writers
+                # queue behind each other for up to "timeout" seconds, and
+                # IMMEDIATE takes the write lock when a transaction starts
+                # so two workers never deadlock upgrading read locks
+                "timeout": 30,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                ),
+            },
+        }
+    }
+
+
+# Read replicas - reads in views marked @read_only go to one of the
+# DATABASE_REPLICAS aliases, so they don't queue behind workers writing
+# extracted text to the primary. After a request writes, a cookie pins the
+# client to the primary for DATABASE_REPLICA_PIN_SECONDS, which should
+# exceed replication lag, so clients always read their own writes. Documents
+# uploaded or deleted are pinned in CACHES as well, for clients that drop
+# cookies, so the cache must be shared by every web process.
+#   postgres: POSTGRES_REPLICA_HOSTS=host1,host2 adds streaming replicas
+#   sqlite:   SQLITE_READ_REPLICA=1 adds a read-only connection to the same
+#             file, to try the routing locally (a misrouted write fails)
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_PIN_SECONDS = 15
+DATABASE_PIN_COOKIE = "db_pin"
+
+if DATABASE_PROFILE == "postgres":
+    replica_hosts = os.environ.get("POSTGRES_REPLICA_HOSTS", "")
+    for number, host in enumerate(filter(None, replica_hosts.split(",")), 1):
+        DATABASES[f"replica{number}"] = {
+            **DATABASES["default"],
+            "HOST": host.strip(),
+            "TEST": {"MIRROR": "default"},
+        }
+        DATABASE_REPLICAS.append(f"replica{number}")
+elif os.environ.get("SQLITE_READ_REPLICA"):
+    DATABASES["replica"] = {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": f"file:{DATABASES['default']['NAME']}?mode=ro",
+        "OPTIONS": {"timeout": 30},
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append("replica")
+
+DATABASE_ROUTERS = ["pdf_processing.replicas.ReplicaRouter"]
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared between the web and worker processes on a host, so fragments that
+# workers invalidate on state changes are dropped for every web process too.
+# Use a memcached or Redis backend when running on several hosts.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
     }
 }
 
+# Rendered HTML fragments for completed documents
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Documents per page on the home page and the document list API, which
+# accepts ?limit= up to DOCUMENT_LIST_MAX_PAGE_SIZE
+DOCUMENT_LIST_PAGE_SIZE = 50
+DOCUMENT_LIST_MAX_PAGE_SIZE = 200
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -135,12 +233,195 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
-# Task routing - send PDF processing tasks to pdf_processing queue
+# Task routing - send PDF processing tasks to pdf_processing queue,
+# and OCR of scanned pages to its own queue so it can't starve text PDFs
 CELERY_TASK_ROUTES = {
+    "pdf_processing.tasks.ocr_pdf_pages": {"queue": "pdf_ocr"},
+    "pdf_processing.tasks.dispatch_deferred_documents": {"queue": "pdf_dispatch"},
+    "pdf_processing.tasks.deliver_webhooks": {"queue": "pdf_dispatch"},
+    "pdf_processing.tasks.dispatch_document_batches": {"queue": "pdf_dispatch"},
     "pdf_processing.tasks.*": {"queue": "pdf_processing"},
 }
+# Extraction time limits and retries. Extracted pages are checkpointed every
+# PDF_CHECKPOINT_INTERVAL pages so a retried task resumes where it stopped.
+PDF_TASK_SOFT_TIME_LIMIT = 300  # seconds, raises inside the task
+PDF_TASK_TIME_LIMIT = 360  # seconds, kills the worker process
+PDF_TASK_MAX_RETRIES = 3
+PDF_TASK_RETRY_BACKOFF = 10  # seconds, doubled on every retry
+PDF_TASK_RETRY_BACKOFF_MAX = 600
+PDF_CHECKPOINT_INTERVAL = 10
+
+# Resident memory an extraction task may grow by, in MiB (0 disables). Past
+# it, the rest of the document is extracted with PyPDF2, which keeps far
+# less in memory than pdfplumber; PyPDF2 going over it too fails the attempt.
+# A worker child that ends a task above the budget (in KiB below) is
+# replaced before it takes the next one, so every task starts well under it.
+PDF_TASK_RSS_BUDGET_MB = 1024
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = PDF_TASK_RSS_BUDGET_MB * 1024
+
+# Worker autoscaling - workers started with --autoscale=max,min size their
+# pool from their share of the depth of the queues they consume and of the
+# cluster's throughput (both divided by the workers consuming those queues),
+# how long their tasks take lately and the CPU and memory left on the host. The pool grows to finish
+# the backlog within AUTOSCALE_TARGET_WAIT_SECONDS, at most once per
+# AUTOSCALE_SCALE_UP_COOLDOWN seconds, and shrinks by at most
+# AUTOSCALE_MAX_SHRINK_STEP processes once it has been stable for
+# AUTOSCALE_SCALE_DOWN_COOLDOWN seconds. Replay a recorded arrival trace
+# against these with `manage.py simulate_autoscaling`.
+CELERY_WORKER_AUTOSCALER = "pdf_processing.autoscaling:QueueAwareAutoscaler"
+AUTOSCALE_SAMPLE_INTERVAL = 5  # seconds between scaling decisions
+AUTOSCALE_SAMPLE_WINDOW = 300  # seconds of finished tasks used for durations
+AUTOSCALE_TARGET_WAIT_SECONDS = 60
+AUTOSCALE_SCALE_UP_COOLDOWN = 10
+AUTOSCALE_SCALE_DOWN_COOLDOWN = 120
+AUTOSCALE_MAX_SHRINK_STEP = 2
+AUTOSCALE_MIN_CPU_IDLE = 0.1  # fraction of host CPU kept free when growing
+AUTOSCALE_PROCESS_MEMORY_MB = PDF_TASK_RSS_BUDGET_MB  # room needed per process
+AUTOSCALE_DEFAULT_TASK_SECONDS = 5  # until tasks have finished to measure
+# Tasks whose durations size the pool of a worker consuming each queue
+AUTOSCALE_QUEUE_TASKS = {
+    "pdf_processing": ["process_pdf_document", "process_pdf_batch"],
+    "pdf_processing_large": ["process_pdf_document"],
+    "pdf_ocr": ["ocr_pdf_pages"],
+}
+
+# Documents whose page count (probed at upload) exceeds this are sent to a
+# separate queue so they don't delay the small invoices behind them
+PDF_LARGE_DOCUMENT_PAGES = 50
+PDF_LARGE_DOCUMENT_QUEUE = "pdf_processing_large"
+# The probe takes the page count the PDF declares up to this; beyond it, or
+# beyond what the file size allows, it counts the pages in the page tree
+PDF_PROBE_MAX_TRUSTED_PAGES = 5000
+
+# Micro-batching - uploads of at most PDF_BATCH_MAX_PAGES pages (probed at
+# upload) wait in "batched" status; every PDF_BATCH_DISPATCH_INTERVAL seconds
+# they are grouped into process_pdf_batch tasks of up to PDF_BATCH_SIZE
+# documents, which write their results with a few bulk queries
+PDF_BATCH_ENABLED = True
+PDF_BATCH_MAX_PAGES = 1
+PDF_BATCH_SIZE = 50
+PDF_BATCH_DISPATCH_INTERVAL = 2.0
+PDF_BATCH_MAX_DOCUMENTS_PER_RUN = 5000
+
+# Documents matching a VendorTemplate (by producer/creator metadata and an
+# anchor text on page 1) only have the template's field regions extracted
+VENDOR_TEMPLATES_ENABLED = True
+
+# Near-duplicate detection: MinHash over word shingles, split into
+# SIMILARITY_BANDS bands for LSH. With 16 bands of 8 rows, documents about
+# 70% similar or more are likely to share a bucket. Run
+# `manage.py rebuild_similarity_index` after changing any of these.
+SIMILARITY_SHINGLE_SIZE = 3
+SIMILARITY_NUM_PERM = 128
+SIMILARITY_BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+
+# Distributed tracing with OpenTelemetry (needs opentelemetry-sdk, plus
+# opentelemetry-exporter-otlp-proto-http for "otlp"). Trace context travels
+# in Celery message headers, linking an upload to its processing task.
+# TRACING_EXPORTER is "otlp", "file" (JSON lines) or "console".
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "") == "1"
+TRACING_SERVICE_NAME = "invoice-processor"
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "otlp")
+TRACING_OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+TRACING_FILE_PATH = BASE_DIR / "traces.jsonl"
+
+# Store each page's words with bounding boxes (PDFPage.words) during
+# extraction, so source positions can be looked up without re-parsing
+PDF_EXTRACT_WORD_LAYER = False
+
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-deferred-documents": {
+        "task": "pdf_processing.tasks.dispatch_deferred_documents",
+        "schedule": 10.0,
+    },
+    "dispatch-document-batches": {
+        "task": "pdf_processing.tasks.dispatch_document_batches",
+        "schedule": PDF_BATCH_DISPATCH_INTERVAL,
+    },
+    "deliver-webhooks": {
+        "task": "pdf_processing.tasks.deliver_webhooks",
+        "schedule": 5.0,
+    },
+}
+
+# Webhooks - completion and failure events are queued in the database and
+# delivered every few seconds, batched per subscription and HMAC-signed.
+# Events still failing after WEBHOOK_MAX_ATTEMPTS are marked dead.
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_MAX_EVENTS_PER_RUN = 5000
+WEBHOOK_TIMEOUT = 10  # seconds per request
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BACKOFF = 30  # seconds, doubled on every attempt
+WEBHOOK_RETRY_BACKOFF_MAX = 3600
+WEBHOOK_DISPATCH_LOCK_TIMEOUT = 300
+# Seconds after which a run starts no new batch; with one more request of
+# WEBHOOK_TIMEOUT it still ends well before the lock expires
+WEBHOOK_DISPATCH_TIME_BUDGET = 120
+
+# Admission control - uploads are deferred once ADMISSION_QUEUES hold more
+# than ADMISSION_DEFER_QUEUE_DEPTH messages and rejected with 503 once the
+# backlog (queued + deferred) reaches ADMISSION_REJECT_QUEUE_DEPTH
+ADMISSION_CONTROL_ENABLED = True
+ADMISSION_QUEUES = ["pdf_processing", PDF_LARGE_DOCUMENT_QUEUE]
+ADMISSION_BROKER_TIMEOUT = 1  # seconds to connect before admitting unsampled
+ADMISSION_DEFER_QUEUE_DEPTH = 10_000
+ADMISSION_REJECT_QUEUE_DEPTH = 100_000
+ADMISSION_SAMPLE_TTL = 5  # seconds between broker samples
+ADMISSION_THROUGHPUT_WINDOW = 300  # seconds of completions used for throughput
+ADMISSION_MIN_RETRY_AFTER = 30
+ADMISSION_MAX_RETRY_AFTER = 3600
+DEFERRED_DISPATCH_BATCH_SIZE = 500
 
 # File upload settings
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Uploaded PDFs are stored content-addressed and sharded by hash prefix
+# (pdfs/ab/cd/<sha256>.pdf); identical uploads share one stored file.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+    "pdfs": {
+        "BACKEND": "pdf_processing.storage.ShardedFileSystemStorage",
+    },
+}
+
+# S3-compatible storage for PDFs (AWS S3, MinIO, ...), requires django-storages[s3]
+# STORAGES["pdfs"] = {
+#     "BACKEND": "pdf_processing.s3_storage.ShardedS3Storage",
+#     "OPTIONS": {
+#         "bucket_name": "invoices",
+#         "endpoint_url": "http://localhost:9000",
+#         "access_key": "minioadmin",
+#         "secret_key": "minioadmin",
+#     },
+# }
+
+# Page previews - thumbnails are rendered on demand with pypdfium2 and cached
+# on disk; least recently used ones are evicted beyond PREVIEW_CACHE_MAX_BYTES
+PREVIEW_CACHE_DIR = BASE_DIR / "previews"
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+PREVIEW_CACHE_TRIM_INTERVAL = 60  # seconds between cache size checks
+PREVIEW_WIDTHS = [160, 320, 640, 1024]  # requested widths snap to these
+PREVIEW_DEFAULT_WIDTH = 320
+PREVIEW_DETAIL_WIDTH = 640  # page 1 on the document page; workers pre-render it
+PREVIEW_PRERENDER_FIRST_PAGE = True
+# Thumbnail URLs carrying the file's version (?v=) are cached for a year;
+# unversioned ones only for this many seconds
+PREVIEW_UNVERSIONED_MAX_AGE = 300
+
+# OCR settings for scanned pages without a text layer
+OCR_ENABLED = True
+OCR_BACKEND = "pdf_processing.ocr.TesseractBackend"
+OCR_LANGUAGE = "eng"
+OCR_RENDER_DPI = 300
+# A page is treated as a scan when it has fewer than OCR_MIN_CHARS characters
+# and images cover at least OCR_MIN_IMAGE_COVERAGE of its area
+OCR_MIN_CHARS = 20
+OCR_MIN_IMAGE_COVERAGE = 0.5
@@ -1,4 +1,31 @@
 from django.contrib import admin
+from django.utils import timezone
 
-# Register your models here.
+from .models import VendorTemplate, WebhookEvent, WebhookSubscription
 
+
+@admin.register(VendorTemplate)
+class VendorTemplateAdmin(admin.ModelAdmin):
+    list_display = ['name', 'producer', 'creator', 'anchor_text', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'producer', 'creator', 'anchor_text']
+
+
+@admin.register(WebhookSubscription)
+class WebhookSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['url', 'events', 'is_active', 'created_at']
+    list_filter = ['is_active']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_type', 'subscription', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'event_type']
+    actions = ['redeliver']
+    
+    @admin.action(description='Redeliver selected events')
+    def redeliver(self, request, queryset):
+        count = queryset.exclude(status='delivered').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f'{count} events queued for redelivery')
@@ -0,0 +1,157 @@
+import logging
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import PDFDocument, ProcessingTask
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH_CACHE_KEY = "admission:queue_depth"
+THROUGHPUT_CACHE_KEY = "admission:throughput"
+# Cached in place of a depth while the broker can't be reached
+BROKER_UNAVAILABLE = "unavailable"
+
+Admission = namedtuple(
+    "Admission", ["action", "queue_depth", "estimated_wait_seconds", "retry_after"]
+)
+
+
+def sample_queue_depth(use_cache=True):
+    """
+    Return the number of messages waiting in ADMISSION_QUEUES, or None if
+    the broker can't be reached. Samples, including failed ones, are cached
+    for ADMISSION_SAMPLE_TTL seconds so uploads don't each hit the broker,
+    or each wait for a connection timeout while it is down.
+    """
+    if use_cache:
+        depth = cache.get(QUEUE_DEPTH_CACHE_KEY)
+        if depth == BROKER_UNAVAILABLE:
+            return None
+        if depth is not None:
+            return depth
+
+    try:
+        with current_app.connection_for_read(
+            connect_timeout=settings.ADMISSION_BROKER_TIMEOUT
+        ) as connection:
+            # Give up after one attempt instead of retrying with backoff
+            connection.ensure_connection(max_retries=0)
+            channel = connection.default_channel
+            depth = sum(
+                channel.queue_declare(queue=queue, passive=True).message_count
+                for queue in settings.ADMISSION_QUEUES
+            )
+    except Exception as e:
+        logger.warning(f"Could not sample queue depth: {str(e)}")
+        depth = None
+
+    cache.set(
+        QUEUE_DEPTH_CACHE_KEY,
+        BROKER_UNAVAILABLE if depth is None else depth,
+        settings.ADMISSION_SAMPLE_TTL,
+    )
+    return depth
+
+
+def sample_throughput():
+    """
+    Return documents finished per second over the last
+    ADMISSION_THROUGHPUT_WINDOW seconds
+    """
+    throughput = cache.get(THROUGHPUT_CACHE_KEY)
+    if throughput is not None:
+        return throughput
+
+    window = settings.ADMISSION_THROUGHPUT_WINDOW
+    # Batches record one task per document, so this counts documents
+    finished = ProcessingTask.objects.filter(
+        task_name__in=["process_pdf_document", "process_pdf_batch"],
+        status__in=["SUCCESS", "FAILURE"],
+        updated_at__gte=timezone.now() - timedelta(seconds=window),
+    ).count()
+    throughput = finished / window
+
+    cache.set(THROUGHPUT_CACHE_KEY, throughput, settings.ADMISSION_SAMPLE_TTL)
+    return throughput
+
+
+def estimate_wait_seconds(backlog, throughput):
+    """
+    Estimate how long a backlog of documents takes to drain, or None if
+    nothing has finished recently to base an estimate on
+    """
+    if not backlog:
+        return 0
+    if not throughput:
+        return None
+    return math.ceil(backlog / throughput)
+
+
+def admission_decision():
+    """
+    Decide what to do with a new upload based on queue depth:
+
+    - "accept": enqueue processing right away
+    - "defer": store the upload but leave it for the throttled dispatcher
+    - "reject": refuse the upload; retry_after says when to try again
+    """
+    if not settings.ADMISSION_CONTROL_ENABLED:
+        return Admission("accept", None, None, None)
+
+    depth = sample_queue_depth()
+    if depth is None:
+        return Admission("accept", None, None, None)
+
+    waiting = dict(
+        PDFDocument.objects.filter(
+            processing_status__in=["pending", "deferred", "batched"]
+        )
+        .order_by()
+        .values_list("processing_status")
+        .annotate(Count("id"))
+    )
+    deferred = waiting.get("deferred", 0)
+    # One queued batch message holds many documents, so count documents;
+    # the queue may also hold messages for documents in no such status
+    queued = max(depth, waiting.get("pending", 0))
+    backlog = queued + deferred + waiting.get("batched", 0)
+    throughput = sample_throughput()
+    wait = estimate_wait_seconds(backlog, throughput)
+
+    if backlog >= settings.ADMISSION_REJECT_QUEUE_DEPTH:
+        # Ask clients to come back once the backlog is down to the defer level
+        excess = backlog - settings.ADMISSION_DEFER_QUEUE_DEPTH
+        retry_after = estimate_wait_seconds(excess, throughput)
+        retry_after = min(
+            max(
+                retry_after or settings.ADMISSION_MAX_RETRY_AFTER,
+                settings.ADMISSION_MIN_RETRY_AFTER,
+            ),
+            settings.ADMISSION_MAX_RETRY_AFTER,
+        )
+        return Admission("reject", backlog, wait, retry_after)
+
+    if depth >= settings.ADMISSION_DEFER_QUEUE_DEPTH or deferred:
+        # Keep FIFO order: once anything is deferred, new uploads queue behind it
+        return Admission("defer", backlog, wait, None)
+
+    return Admission("accept", backlog, wait, None)
+
+
+def dispatch_capacity():
+    """
+    Return how many deferred documents may be enqueued now without pushing
+    the queue past ADMISSION_DEFER_QUEUE_DEPTH
+    """
+    depth = sample_queue_depth(use_cache=False)
+    if depth is None:
+        return 0
+    capacity = settings.ADMISSION_DEFER_QUEUE_DEPTH - depth
+    return max(0, min(capacity, settings.DEFERRED_DISPATCH_BATCH_SIZE))
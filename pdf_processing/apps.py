@@ -5,3 +5,5 @@ class PdfProcessingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pdf_processing"
 
+    def ready(self):
+        from . import signals, tracing  # noqa: F401
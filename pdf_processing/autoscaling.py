@@ -0,0 +1,387 @@
+import logging
+import math
+import os
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from time import monotonic
+
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ProcessingTask
+
+logger = logging.getLogger(__name__)
+
+
+class ScalingPolicy:
+    """
+    Decides how many pool processes a worker should run. It sizes the pool
+    to keep up with the rate tasks finish at (Little's law: throughput x
+    average duration processes are busy on average) plus enough extra to
+    drain the backlog within target_wait_seconds, then limits growth to the
+    CPU and memory the host has left.
+
+    Scaling up and down each have a cooldown: growing can react quickly to
+    a burst, while shrinking waits until the pool has been stable a while,
+    so a lull between bursts doesn't throw away warm processes.
+
+    The policy does no I/O; callers pass in the current time and
+    measurements, so the same policy drives the worker and the simulator.
+    """
+
+    def __init__(
+        self,
+        min_processes,
+        max_processes,
+        target_wait_seconds=60,
+        scale_up_cooldown=10,
+        scale_down_cooldown=120,
+        max_shrink_step=2,
+        min_cpu_idle=0.1,
+        process_memory_bytes=0,
+    ):
+        self.min_processes = min_processes
+        self.max_processes = max_processes
+        self.target_wait_seconds = target_wait_seconds
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.max_shrink_step = max_shrink_step
+        self.min_cpu_idle = min_cpu_idle
+        self.process_memory_bytes = process_memory_bytes
+        self.last_scale_up = None
+        self.last_scale_down = None
+
+    @classmethod
+    def from_settings(cls, min_processes, max_processes):
+        return cls(
+            min_processes,
+            max_processes,
+            target_wait_seconds=settings.AUTOSCALE_TARGET_WAIT_SECONDS,
+            scale_up_cooldown=settings.AUTOSCALE_SCALE_UP_COOLDOWN,
+            scale_down_cooldown=settings.AUTOSCALE_SCALE_DOWN_COOLDOWN,
+            max_shrink_step=settings.AUTOSCALE_MAX_SHRINK_STEP,
+            min_cpu_idle=settings.AUTOSCALE_MIN_CPU_IDLE,
+            process_memory_bytes=settings.AUTOSCALE_PROCESS_MEMORY_MB * 2**20,
+        )
+
+    def target(self, backlog, busy, throughput, avg_task_seconds):
+        """
+        Return the pool size wanted for the load, before bounds and headroom
+        """
+        wanted = throughput * avg_task_seconds
+        wanted += backlog * avg_task_seconds / self.target_wait_seconds
+        # Processes running a task can't be taken away anyway
+        return max(math.ceil(wanted), busy)
+
+    def growth_limit(self, cpu_idle, cpu_count, available_memory_bytes):
+        """
+        Return how many processes the host has room to add: one per CPU
+        (or part of one) idle beyond the min_cpu_idle kept free
+        """
+        limit = math.ceil((cpu_idle - self.min_cpu_idle) * cpu_count)
+        if self.process_memory_bytes and available_memory_bytes is not None:
+            limit = min(limit, available_memory_bytes // self.process_memory_bytes)
+        return max(0, limit)
+
+    def decide(
+        self,
+        now,
+        processes,
+        backlog,
+        busy,
+        throughput,
+        avg_task_seconds,
+        cpu_idle=1.0,
+        cpu_count=1,
+        available_memory_bytes=None,
+    ):
+        """
+        Return the pool size to run now, given the current size, tasks
+        waiting (backlog), tasks running (busy), recent completions per
+        second, the average task duration and the host's CPU idle fraction
+        and available memory
+        """
+        desired = self.target(backlog, busy, throughput, avg_task_seconds)
+        desired = min(max(desired, self.min_processes), self.max_processes)
+
+        # Bounds changed (e.g. through remote control): move to them at once
+        if processes < self.min_processes or processes > self.max_processes:
+            return self._scaled(now, processes, desired)
+
+        if desired > processes:
+            if self._cooling(now, self.last_scale_up, self.scale_up_cooldown):
+                return processes
+            room = self.growth_limit(cpu_idle, cpu_count, available_memory_bytes)
+            return self._scaled(now, processes, min(desired, processes + room))
+
+        if desired < processes:
+            last_change = max(
+                self.last_scale_up or -math.inf, self.last_scale_down or -math.inf
+            )
+            if self._cooling(now, last_change, self.scale_down_cooldown):
+                return processes
+            desired = max(desired, processes - self.max_shrink_step)
+            return self._scaled(now, processes, desired)
+
+        return processes
+
+    def _scaled(self, now, processes, desired):
+        if desired > processes:
+            self.last_scale_up = now
+        elif desired < processes:
+            self.last_scale_down = now
+        return desired
+
+    @staticmethod
+    def _cooling(now, last, cooldown):
+        return last is not None and now - last < cooldown
+
+
+def sample_queue_shares(queues):
+    """
+    Return (messages waiting for this worker, workers consuming) for the
+    given queues, or None if the broker can't be reached. Every worker
+    consuming a queue sees its whole depth, so each takes its share: a
+    queue's messages divided by its consumers, summed over the queues.
+    Workers is the most consumers any of the queues has, at least 1.
+    """
+    from celery import current_app
+
+    try:
+        with current_app.connection_for_read() as connection:
+            declared = [
+                connection.default_channel.queue_declare(queue=queue, passive=True)
+                for queue in queues
+            ]
+    except Exception as e:
+        logger.warning(f"Could not sample queue depth: {str(e)}")
+        return None
+
+    share = sum(
+        queue.message_count / max(1, queue.consumer_count) for queue in declared
+    )
+    workers = max([queue.consumer_count for queue in declared], default=0)
+    return share, max(1, workers)
+
+
+def sample_task_durations(task_names):
+    """
+    Return (task messages finished per second, their average duration in
+    seconds) for the given tasks over the last AUTOSCALE_SAMPLE_WINDOW
+    seconds. A batch writes one record per document, with task ids
+    "<message id>:<document id>", and counts as one message lasting from
+    its first document's start to its last one's end, as queue depth counts
+    a batch as one message too.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.AUTOSCALE_SAMPLE_WINDOW)
+    finished = ProcessingTask.objects.filter(
+        task_name__in=task_names,
+        status__in=["SUCCESS", "FAILURE"],
+        started_at__isnull=False,
+        finished_at__gte=cutoff,
+        updated_at__gte=cutoff,  # always later than finished_at; indexed
+    ).values_list("task_id", "started_at", "finished_at")
+
+    messages = {}
+    for task_id, started, finished_at in finished:
+        message_id = task_id.split(":")[0]
+        first, last = messages.get(message_id, (started, finished_at))
+        messages[message_id] = (min(first, started), max(last, finished_at))
+    if not messages:
+        return 0.0, None
+    durations = [(last - first).total_seconds() for first, last in messages.values()]
+    return len(durations) / settings.AUTOSCALE_SAMPLE_WINDOW, sum(durations) / len(
+        durations
+    )
+
+
+def available_memory_bytes():
+    """
+    Return the memory available to new processes on this host, or None
+    where /proc/meminfo doesn't exist
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class CpuIdleSampler:
+    """
+    Measures the host's idle CPU fraction between calls from /proc/stat,
+    falling back to the load average where there's no procfs
+    """
+
+    def __init__(self):
+        self.previous = self._read()
+
+    @staticmethod
+    def _read():
+        try:
+            with open("/proc/stat") as stat:
+                values = [int(value) for value in stat.readline().split()[1:]]
+        except OSError:
+            return None
+        # idle + iowait, total
+        return values[3] + values[4], sum(values)
+
+    def sample(self):
+        current = self._read()
+        if current is None or self.previous is None:
+            load = os.getloadavg()[0]
+            return max(0.0, 1 - load / (os.cpu_count() or 1))
+        idle = current[0] - self.previous[0]
+        total = current[1] - self.previous[1]
+        self.previous = current
+        return idle / total if total else 1.0
+
+
+# queue_depth and throughput are this worker's share of the cluster's
+LoadSample = namedtuple(
+    "LoadSample",
+    [
+        "sampled_at",
+        "queue_depth",
+        "throughput",
+        "avg_task_seconds",
+        "cpu_idle",
+        "available_memory_bytes",
+    ],
+)
+
+
+class LoadSampler(threading.Thread):
+    """
+    Measures the load of a worker's queues and host every
+    AUTOSCALE_SAMPLE_INTERVAL seconds on its own thread, keeping the latest
+    LoadSample in .latest, so the autoscaler never waits on the broker or
+    the database in the worker's consumer thread
+    """
+
+    def __init__(self, queues, task_names):
+        super().__init__(name="AutoscaleLoadSampler", daemon=True)
+        self.queues = queues
+        self.task_names = task_names
+        self.cpu = CpuIdleSampler()
+        self.latest = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.latest = self.sample()
+            except Exception as e:
+                logger.warning(f"Could not sample load for autoscaling: {str(e)}")
+            finally:
+                close_old_connections()
+            self._stopped.wait(settings.AUTOSCALE_SAMPLE_INTERVAL)
+
+    def sample(self):
+        shares = sample_queue_shares(self.queues)
+        if shares is None:
+            return None
+        depth, workers = shares
+        # Completions are recorded for the whole cluster
+        throughput, avg_task_seconds = sample_task_durations(self.task_names)
+        return LoadSample(
+            monotonic(),
+            depth,
+            throughput / workers,
+            avg_task_seconds,
+            self.cpu.sample(),
+            available_memory_bytes(),
+        )
+
+    def stop(self):
+        self._stopped.set()
+
+
+class QueueAwareAutoscaler(Autoscaler):
+    """
+    Celery autoscaler sizing the pool with ScalingPolicy, from this worker's
+    share of the depth of the queues it consumes and of the tasks finishing
+    on them, the tasks it has reserved, their recent duration and the
+    host's CPU and memory.
+    Enable with CELERY_WORKER_AUTOSCALER and `worker --autoscale=max,min`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.policy = ScalingPolicy.from_settings(
+            self.min_concurrency, self.max_concurrency
+        )
+        self.sampler = None
+        self._decided_at = None
+
+    def consumed_queues(self):
+        app = self.worker.app
+        queues = app.amqp.queues.consume_from or app.amqp.queues
+        return sorted(queues)
+
+    def start_sampler(self):
+        queues = self.consumed_queues()
+        task_names = {
+            name
+            for queue in queues
+            for name in settings.AUTOSCALE_QUEUE_TASKS.get(queue, [])
+        }
+        self.sampler = LoadSampler(queues, task_names)
+        self.sampler.start()
+
+    def _maybe_scale(self, req=None):
+        # Runs in the consumer thread (and for every task message), so it
+        # only reads the sampler's latest measurements, deciding once each
+        if self.sampler is None:
+            self.start_sampler()
+        sample = self.sampler.latest
+        if sample is None or sample.sampled_at == self._decided_at:
+            return False
+        self._decided_at = sample.sampled_at
+
+        busy = len(state.active_requests)
+        # Reserved (prefetched) tasks have already left the broker queue
+        backlog = sample.queue_depth + max(0, self.qty - busy)
+        processes = self.processes
+        self.policy.min_processes = self.min_concurrency
+        self.policy.max_processes = self.max_concurrency
+        desired = self.policy.decide(
+            monotonic(),
+            processes,
+            backlog,
+            busy,
+            sample.throughput,
+            sample.avg_task_seconds or settings.AUTOSCALE_DEFAULT_TASK_SECONDS,
+            cpu_idle=sample.cpu_idle,
+            cpu_count=os.cpu_count() or 1,
+            available_memory_bytes=sample.available_memory_bytes,
+        )
+
+        if desired > processes:
+            self.scale_up(desired - processes)
+            return True
+        if desired < processes:
+            self._shrink(processes - desired)
+            return True
+        return False
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        super().stop()
+
+    def info(self):
+        info = super().info()
+        info["policy"] = {
+            "target_wait_seconds": self.policy.target_wait_seconds,
+            "scale_up_cooldown": self.policy.scale_up_cooldown,
+            "scale_down_cooldown": self.policy.scale_down_cooldown,
+        }
+        return info
@@ -0,0 +1,161 @@
+import base64
+import csv
+import json
+import uuid
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import PDFDocument
+
+EXPORT_FIELDS = [
+    "id",
+    "title",
+    "processing_status",
+    "upload_date",
+    "processing_completed_at",
+    "file_size",
+    "page_count",
+    "metadata",
+    "extracted_text",
+    "vendor_template",
+    "extracted_fields",
+]
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+class ExportError(ValueError):
+    """Raised for invalid export filters or cursors"""
+
+
+def encode_cursor(upload_date, document_id):
+    """
+    Encode the position of an exported row as an opaque, URL-safe cursor
+    """
+    raw = f"{upload_date.isoformat()}|{document_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor into (upload_date, document_id)
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        upload_date, document_id = (
+            base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        )
+        return datetime.fromisoformat(upload_date), uuid.UUID(document_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ExportError(f"Invalid cursor: {cursor}")
+
+
+def parse_boundary(value, end_of_day=False):
+    """
+    Parse an ISO date or datetime filter value into an aware datetime
+    """
+    try:
+        # parse_datetime also accepts a bare date, as midnight
+        day = parse_date(value)
+        parsed = None if day else parse_datetime(value)
+    except ValueError:
+        raise ExportError(f"Invalid date: {value}")
+    if day:
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    elif parsed is None:
+        raise ExportError(f"Invalid date: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(statuses=None, since=None, until=None, cursor=None):
+    """
+    Build the keyset-ordered queryset for an export.
+
+    Rows are ordered by (upload_date, id) so that a cursor taken from any
+    exported row resumes the export right after that row.
+    """
+    queryset = PDFDocument.objects.order_by("upload_date", "id")
+
+    if statuses:
+        queryset = queryset.filter(processing_status__in=statuses)
+    if since:
+        queryset = queryset.filter(upload_date__gte=parse_boundary(since))
+    if until:
+        queryset = queryset.filter(
+            upload_date__lte=parse_boundary(until, end_of_day=True)
+        )
+    if cursor:
+        upload_date, document_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(upload_date__gt=upload_date)
+            | Q(upload_date=upload_date, id__gt=document_id)
+        )
+
+    # The vendor template by name, as the content API gives it
+    return queryset.values(
+        *[field for field in EXPORT_FIELDS if field != "vendor_template"],
+        vendor_template_name=F("vendor_template__name"),
+    )
+
+
+def iter_export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield export rows with a resume cursor, fetching chunk_size rows at a time
+    """
+    for row in queryset.iterator(chunk_size=chunk_size):
+        row["cursor"] = encode_cursor(row["upload_date"], row["id"])
+        row["document_id"] = str(row.pop("id"))
+        row["vendor_template"] = row.pop("vendor_template_name")
+        yield row
+
+
+def ndjson_lines(rows):
+    """
+    Serialize rows as newline-delimited JSON
+    """
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+class _Echo:
+    """Pseudo-buffer that hands written CSV lines straight back"""
+
+    def write(self, value):
+        return value
+
+
+CSV_COLUMNS = ["document_id"] + EXPORT_FIELDS[1:] + ["cursor"]
+
+
+def csv_lines(rows):
+    """
+    Serialize rows as CSV with a header line; metadata and extracted fields
+    are JSON encoded
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        for column in ["metadata", "extracted_fields"]:
+            row[column] = json.dumps(row[column], cls=DjangoJSONEncoder)
+        yield writer.writerow(
+            [
+                (
+                    row[column].isoformat()
+                    if isinstance(row[column], datetime)
+                    else row[column]
+                )
+                for column in CSV_COLUMNS
+            ]
+        )
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
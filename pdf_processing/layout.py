@@ -0,0 +1,87 @@
+import struct
+import sys
+from array import array
+
+# Word layer encoding, all little-endian:
+#   header        magic, word count, string table size in bytes
+#   string table  distinct words, UTF-8, separated by NUL bytes
+#   indices       uint32 per word, index into the string table
+#   boxes         4 x float32 per word: x0, top, x1, bottom
+MAGIC = b"WL1"
+HEADER = struct.Struct("<3sII")
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_words(words):
+    """
+    Pack pdfplumber words (dicts with text, x0, top, x1, bottom) into the
+    compact binary word layer
+    """
+    strings = {}
+    indices = array("I")
+    boxes = array("f")
+    for word in words:
+        text = word["text"].replace("\0", "")
+        indices.append(strings.setdefault(text, len(strings)))
+        boxes.extend((word["x0"], word["top"], word["x1"], word["bottom"]))
+
+    table = "\0".join(strings).encode("utf-8")
+    return (
+        HEADER.pack(MAGIC, len(indices), len(table))
+        + table
+        + _to_little_endian(indices).tobytes()
+        + _to_little_endian(boxes).tobytes()
+    )
+
+
+def decode_words(blob):
+    """
+    Unpack a word layer into a list of word dicts
+    """
+    magic, count, table_size = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not a word layer")
+
+    offset = HEADER.size
+    strings = blob[offset : offset + table_size].decode("utf-8").split("\0")
+    offset += table_size
+
+    indices = array("I")
+    indices.frombytes(blob[offset : offset + count * indices.itemsize])
+    offset += count * indices.itemsize
+
+    boxes = array("f")
+    boxes.frombytes(blob[offset : offset + count * 4 * boxes.itemsize])
+
+    _to_little_endian(indices)
+    _to_little_endian(boxes)
+    # float32 keeps ~7 significant digits; round off the noise
+    return [
+        {
+            "text": strings[indices[i]],
+            "x0": round(boxes[4 * i], 2),
+            "top": round(boxes[4 * i + 1], 2),
+            "x1": round(boxes[4 * i + 2], 2),
+            "bottom": round(boxes[4 * i + 3], 2),
+        }
+        for i in range(count)
+    ]
+
+
+def words_in_region(blob, x0, top, x1, bottom):
+    """
+    Return the words of a word layer whose boxes overlap the given region
+    """
+    return [
+        word
+        for word in decode_words(blob)
+        if word["x0"] < x1
+        and word["x1"] > x0
+        and word["top"] < bottom
+        and word["bottom"] > top
+    ]
@@ -0,0 +1,88 @@
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from pdf_processing.models import PDFDocument
+from pdf_processing.samples import build_sample_pdf
+from pdf_processing.tasks import process_pdf_batch, process_pdf_document
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of process_pdf_batch against one "
+        "process_pdf_document task per document on single-page invoices"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the generated documents"
+        )
+
+    def create_documents(self, label):
+        document_ids = []
+        for index in range(self.options["documents"]):
+            content = build_sample_pdf(
+                [f"Invoice {label}-{index} total {index * 7 % 1000}.00 " + "x" * 300]
+            )
+            document = PDFDocument.objects.create(
+                title=f"Batching benchmark {label} {index}",
+                file=ContentFile(content, name=f"bench-{label}-{index}.pdf"),
+                file_size=len(content),
+                page_count=1,
+            )
+            document_ids.append(str(document.id))
+        return document_ids
+
+    def run(self, label, document_ids, process):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.monotonic()
+            process(document_ids)
+            elapsed = time.monotonic() - started
+        completed = PDFDocument.objects.filter(
+            id__in=document_ids, processing_status="completed"
+        ).count()
+        self.stdout.write(
+            f"{label}: {len(document_ids) / elapsed:.1f} documents/s, "
+            f"{len(queries) / len(document_ids):.1f} queries/document, "
+            f"{completed}/{len(document_ids)} completed"
+        )
+        return elapsed
+
+    def handle(self, *args, **options):
+        self.options = options
+        size = options["batch_size"]
+        single_ids = self.create_documents("single")
+        batch_ids = self.create_documents("batch")
+
+        def one_by_one(document_ids):
+            for document_id in document_ids:
+                process_pdf_document.apply(args=[document_id])
+
+        def batched(document_ids):
+            for start in range(0, len(document_ids), size):
+                process_pdf_batch.apply(args=[document_ids[start : start + size]])
+
+        # Thumbnails are only pre-rendered by process_pdf_document; leave them
+        # out so both sides do the same work
+        with override_settings(PREVIEW_PRERENDER_FIRST_PAGE=False):
+            single = self.run("process_pdf_document", single_ids, one_by_one)
+            batch = self.run(f"process_pdf_batch ({size})", batch_ids, batched)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Batching is {single / batch:.1f}x faster")
+        )
+        self.stdout.write(
+            "Tasks run in-process; the broker round trip saved per document "
+            "comes on top of this"
+        )
+
+        if not options["keep"]:
+            for document in PDFDocument.objects.filter(
+                id__in=single_ids + batch_ids
+            ):
+                document.delete_with_file()
@@ -0,0 +1,161 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+HEAVY_MODULES = ["pdfplumber", "pdfminer", "PyPDF2", "pypdfium2", "PIL"]
+
+# Each script runs in a fresh interpreter and prints a JSON measurement:
+# the startup body, then the first request's work, timed separately
+PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - started
+{request}
+request_seconds = time.perf_counter() - started - elapsed
+try:
+    with open("/proc/self/statm") as statm:
+        rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({{
+    "seconds": elapsed,
+    "request_seconds": request_seconds,
+    "rss_bytes": rss,
+    "modules": len(sys.modules),
+    "heavy": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def sample_pdf():
+    """
+    Build a one-page PDF with a line of text, for the upload and thumbnail
+    requests
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length 43 >>\nstream\nBT /F1 24 Tf 72 720 Td (Invoice 1001) Tj ET\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return pdf
+
+
+SAMPLE_PDF = sample_pdf()
+
+WEB_STARTUP = """
+from django.core.wsgi import get_wsgi_application
+from django.urls import resolve
+get_wsgi_application()
+resolve("/")
+"""
+
+# (startup, first request) per target. The upload and thumbnail targets
+# run the PDF work those requests do in the web process, without the
+# database, storage or broker round trips around it
+TARGETS = {
+    # What a WSGI server (or runserver) does before serving the first request
+    "web": (WEB_STARTUP, ""),
+    # The metadata probe an upload runs to route the document
+    "web-upload": (
+        WEB_STARTUP,
+        f"""
+from io import BytesIO
+from pdf_processing.probe import probe_pdf_metadata
+assert probe_pdf_metadata(BytesIO({SAMPLE_PDF!r}))["page_count"] == 1
+""",
+    ),
+    # Rendering a page thumbnail that isn't cached yet
+    "web-thumbnail": (
+        WEB_STARTUP,
+        f"""
+import tempfile
+from pathlib import Path
+from pdf_processing.previews import render_thumbnail
+with tempfile.TemporaryDirectory() as directory:
+    pdf = Path(directory) / "sample.pdf"
+    pdf.write_bytes({SAMPLE_PDF!r})
+    render_thumbnail(str(pdf), 1, 320, Path(directory) / "thumbnail.jpg")
+""",
+    ),
+    # What `celery worker` does before its pool starts taking tasks
+    "worker": (
+        """
+import django
+from celery.signals import worker_init
+from invoice_processor.celery import app
+django.setup()
+app.loader.import_default_modules()
+worker_init.send(sender=None)
+""",
+        "",
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure import time and resident memory of web and worker startup, "
+        "and of the first upload and thumbnail in the web process, each in a "
+        "fresh interpreter"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--target", choices=sorted(TARGETS), action="append")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        for target in options["target"] or sorted(TARGETS):
+            body, request = TARGETS[target]
+            script = PROBE.format(body=body, request=request, heavy=HEAVY_MODULES)
+            runs = []
+            for _ in range(options["runs"]):
+                started = time.perf_counter()
+                output = subprocess.run(
+                    [sys.executable, "-c", script],
+                    env=env,
+                    cwd=settings.BASE_DIR,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                measurement = json.loads(output.strip().splitlines()[-1])
+                measurement["wall_seconds"] = time.perf_counter() - started
+                runs.append(measurement)
+
+            self.stdout.write(
+                f"{target}: imports {statistics.median(r['seconds'] for r in runs) * 1000:.0f}ms, "
+                f"process {statistics.median(r['wall_seconds'] for r in runs) * 1000:.0f}ms, "
+                f"RSS {statistics.median(r['rss_bytes'] for r in runs) / 2**20:.1f}MiB, "
+                f"{runs[-1]['modules']} modules (median of {len(runs)} runs)"
+            )
+            if request:
+                self.stdout.write(
+                    f"  first request {statistics.median(r['request_seconds'] for r in runs) * 1000:.0f}ms"
+                )
+            self.stdout.write(
+                f"  extraction libraries loaded: {', '.join(runs[-1]['heavy']) or 'none'}"
+            )
@@ -0,0 +1,55 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pdf_processing.exports import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    ExportError,
+    export_queryset,
+    iter_export_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Stream extracted documents as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=sorted(EXPORT_FORMATS), default="ndjson"
+        )
+        parser.add_argument(
+            "--status",
+            action="append",
+            default=[],
+            help="Only export documents with this status (repeatable)",
+        )
+        parser.add_argument("--since", help="Uploaded on or after this date")
+        parser.add_argument("--until", help="Uploaded on or before this date")
+        parser.add_argument(
+            "--cursor", help="Resume after the row that carried this cursor"
+        )
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            "--output", help="Write to this file instead of standard output"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            queryset = export_queryset(
+                statuses=options["status"],
+                since=options["since"],
+                until=options["until"],
+                cursor=options["cursor"],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        serialize, _ = EXPORT_FORMATS[options["format"]]
+        rows = iter_export_rows(queryset, chunk_size=options["chunk_size"])
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(serialize(rows))
+        else:
+            sys.stdout.writelines(serialize(rows))
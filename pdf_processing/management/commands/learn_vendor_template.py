@@ -0,0 +1,113 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pdf_processing.models import PDFDocument, VendorTemplate
+from pdf_processing.storage import local_file_path
+
+
+def find_region(pdf, value, padding, grow):
+    """
+    Locate the first occurrence of value and return its page number and a
+    padded region around it, or None if it isn't in the document
+    """
+    for page in pdf.pages:
+        matches = page.search(value, regex=False)
+        if matches:
+            match = matches[0]
+            region = [
+                max(match["x0"] - padding, 0),
+                max(match["top"] - padding, 0),
+                min(match["x1"] + padding + grow, float(page.width)),
+                min(match["bottom"] + padding, float(page.height)),
+            ]
+            return page.page_number, [round(value, 2) for value in region]
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update a vendor template from a sample document, by "
+        "locating known field values and the anchor text in it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("document_id")
+        parser.add_argument("--name", required=True, help="Template name")
+        parser.add_argument(
+            "--anchor", required=True, help="Text that identifies the vendor on page 1"
+        )
+        parser.add_argument(
+            "--field",
+            action="append",
+            required=True,
+            metavar="NAME=VALUE",
+            help="A field and its value in the sample document; repeatable",
+        )
+        parser.add_argument(
+            "--padding", type=float, default=2, help="Points added around values"
+        )
+        parser.add_argument(
+            "--grow",
+            type=float,
+            default=40,
+            help="Extra points on the right, for values longer than the sample's",
+        )
+
+    def handle(self, *args, **options):
+        import pdfplumber
+
+        try:
+            document = PDFDocument.objects.get(id=options["document_id"])
+        except (PDFDocument.DoesNotExist, ValueError):
+            raise CommandError(f"Document {options['document_id']} not found")
+
+        values = {}
+        for field in options["field"]:
+            name, separator, value = field.partition("=")
+            if not separator or not name or not value:
+                raise CommandError(f"Expected NAME=VALUE, got {field!r}")
+            values[name] = value
+
+        with local_file_path(document.file) as file_path:
+            with pdfplumber.open(file_path) as pdf:
+                anchor = find_region(pdf, options["anchor"], options["padding"], 0)
+                if anchor is None or anchor[0] != 1:
+                    raise CommandError("Anchor text not found on page 1")
+
+                fields = {}
+                for name, value in values.items():
+                    found = find_region(pdf, value, options["padding"], options["grow"])
+                    if found is None:
+                        raise CommandError(f"Value {value!r} of {name} not found")
+                    fields[name] = {"page": found[0], "region": found[1]}
+
+        # Validate before saving, so an invalid template is never stored
+        with transaction.atomic():
+            template = (
+                VendorTemplate.objects.select_for_update()
+                .filter(name=options["name"])
+                .first()
+            )
+            created = template is None
+            if created:
+                template = VendorTemplate(name=options["name"])
+            template.producer = document.metadata.get("producer", "")
+            template.creator = document.metadata.get("creator", "")
+            template.anchor_text = options["anchor"]
+            template.anchor_region = anchor[1]
+            template.fields = fields
+            try:
+                template.full_clean()
+            except ValidationError as e:
+                raise CommandError(f"Invalid template: {e}")
+            template.save()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Created' if created else 'Updated'} template {template.name} "
+                f"with fields {', '.join(fields)}"
+            )
+        )
+        for name, field in fields.items():
+            self.stdout.write(f"  {name}: page {field['page']} {field['region']}")
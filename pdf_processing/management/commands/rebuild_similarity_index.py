@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pdf_processing.models import PDFDocument
+from pdf_processing.similarity import minhash_signature, save_lsh_buckets
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute MinHash signatures and LSH buckets of completed documents, "
+        "e.g. after changing the SIMILARITY_* settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--missing-only",
+            action="store_true",
+            help="Only index documents without a signature",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        documents = PDFDocument.objects.filter(processing_status="completed").only(
+            "id", "extracted_text", "minhash"
+        )
+        if options["missing_only"]:
+            documents = documents.filter(minhash__isnull=True)
+
+        count = 0
+        for document in documents.iterator(chunk_size=options["chunk_size"]):
+            document.minhash = minhash_signature(document.extracted_text)
+            with transaction.atomic():
+                document.save(update_fields=["minhash"])
+                save_lsh_buckets(document)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents"))
@@ -0,0 +1,264 @@
+import csv
+import math
+import random
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from pdf_processing.autoscaling import ScalingPolicy
+from pdf_processing.models import ProcessingTask
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay an arrival trace against the worker autoscaling policy in "
+        "simulated time and compare it with a fixed-size pool"
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument(
+            "--trace",
+            help="CSV of arrival_seconds[,duration_seconds] rows to replay",
+        )
+        source.add_argument(
+            "--record",
+            metavar="PATH",
+            help="Write a trace of recently processed documents to PATH and exit",
+        )
+        source.add_argument(
+            "--synthetic",
+            action="store_true",
+            help="Generate a steady trickle of uploads with a month-end burst",
+        )
+        parser.add_argument(
+            "--since", type=float, default=24, help="Hours of history to --record"
+        )
+        parser.add_argument("--min", type=int, default=2, help="Minimum processes")
+        parser.add_argument("--max", type=int, default=12, help="Maximum processes")
+        parser.add_argument(
+            "--fixed", type=int, default=4, help="Size of the fixed pool to compare"
+        )
+        parser.add_argument("--cpus", type=int, default=8, help="Simulated host CPUs")
+        parser.add_argument(
+            "--memory-mb", type=int, default=16384, help="Simulated host memory"
+        )
+        parser.add_argument(
+            "--spawn-seconds",
+            type=float,
+            default=2,
+            help="Time for a new pool process to start taking tasks",
+        )
+        parser.add_argument(
+            "--task-seconds",
+            type=float,
+            default=3,
+            help="Duration of tasks the trace has none for",
+        )
+        parser.add_argument(
+            "--timeline", help="Write the autoscaled run's pool and backlog to CSV"
+        )
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options["record"]:
+            count = self.record_trace(options["record"], options["since"])
+            self.stdout.write(f"Wrote {count} arrivals to {options['record']}")
+            return
+
+        if options["synthetic"]:
+            arrivals = self.synthetic_trace(random.Random(options["seed"]))
+        else:
+            arrivals = self.read_trace(options["trace"])
+        if not arrivals:
+            raise CommandError("The trace has no arrivals")
+        self.stdout.write(
+            f"{len(arrivals)} arrivals over {arrivals[-1][0] / 60:.0f} minutes, "
+            f"{options['cpus']} CPUs"
+        )
+
+        runs = [
+            (
+                f"autoscaled {options['min']}-{options['max']}",
+                ScalingPolicy.from_settings(options["min"], options["max"]),
+                options["timeline"],
+            ),
+            (
+                f"fixed {options['fixed']}",
+                ScalingPolicy(options["fixed"], options["fixed"]),
+                None,
+            ),
+        ]
+        for label, policy, timeline in runs:
+            self.report(label, self.simulate(arrivals, policy, timeline))
+
+    def record_trace(self, path, hours):
+        # Records from before start and finish times were kept span retries
+        tasks = (
+            ProcessingTask.objects.filter(
+                task_name__in=["process_pdf_document", "process_pdf_batch"],
+                status__in=["SUCCESS", "FAILURE"],
+                document__upload_date__gte=timezone.now() - timedelta(hours=hours),
+            )
+            .order_by("document__upload_date")
+            .values_list(
+                "document__upload_date",
+                Coalesce("started_at", "created_at"),
+                Coalesce("finished_at", "updated_at"),
+            )
+        )
+        start = None
+        count = 0
+        with open(path, "w", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["arrival_seconds", "duration_seconds"])
+            for uploaded, started, finished in tasks.iterator():
+                start = start or uploaded
+                writer.writerow(
+                    [
+                        round((uploaded - start).total_seconds(), 3),
+                        round((finished - started).total_seconds(), 3),
+                    ]
+                )
+                count += 1
+        return count
+
+    def read_trace(self, path):
+        arrivals = []
+        with open(path, newline="") as trace:
+            for row in csv.reader(trace):
+                try:
+                    arrival = float(row[0])
+                except (IndexError, ValueError):
+                    continue  # header or blank line
+                duration = float(row[1]) if len(row) > 1 and row[1] else None
+                arrivals.append((arrival, duration or self.options["task_seconds"]))
+        arrivals.sort()
+        return arrivals
+
+    def synthetic_trace(self, rng):
+        """
+        Two hours of uploads at one every 5s on average, plus 3,000 arriving
+        over ten minutes half an hour in, like an end-of-month batch
+        """
+        times = []
+        now = 0.0
+        while now < 7200:
+            now += rng.expovariate(0.2)
+            times.append(now)
+        times.extend(1800 + rng.uniform(0, 600) for _ in range(3000))
+        mean = self.options["task_seconds"]
+        return sorted(
+            (arrival, rng.lognormvariate(math.log(mean) - 0.125, 0.5))
+            for arrival in times
+        )
+
+    def simulate(self, arrivals, policy, timeline_path):
+        """
+        Run a pool driven by the policy through the trace in one-second steps.
+        Tasks are CPU bound: with more running than CPUs, each goes slower.
+        """
+        options = self.options
+        cpus = options["cpus"]
+        memory = options["memory_mb"] * 2**20
+        process_memory = settings.AUTOSCALE_PROCESS_MEMORY_MB * 2**20
+        interval = settings.AUTOSCALE_SAMPLE_INTERVAL
+        window = settings.AUTOSCALE_SAMPLE_WINDOW
+
+        pending = deque(arrivals)
+        queue = deque()
+        running = []  # [remaining work, started, arrival]
+        idle = policy.min_processes
+        starting = deque()  # times new processes become ready
+        finished = deque()  # (finished at, duration) within the sample window
+        waits = []
+        stats = {"max_backlog": 0, "process_seconds": 0, "peak": idle, "scalings": 0}
+        timeline = []
+        cpu_busy = 0  # CPU-seconds used since the last decision
+
+        now = 0.0
+        while pending or queue or running:
+            while pending and pending[0][0] <= now:
+                queue.append(pending.popleft())
+            while starting and starting[0] <= now:
+                starting.popleft()
+                idle += 1
+            while queue and idle:
+                arrival, duration = queue.popleft()
+                idle -= 1
+                waits.append(now - arrival)
+                running.append([duration, now, arrival])
+
+            speed = min(1.0, cpus / len(running)) if running else 1.0
+            cpu_busy += min(len(running), cpus)
+            still_running = []
+            for task in running:
+                task[0] -= speed
+                if task[0] > 0:
+                    still_running.append(task)
+                else:
+                    idle += 1
+                    finished.append((now + 1, now + 1 - task[1]))
+            running = still_running
+            while finished and finished[0][0] < now - window:
+                finished.popleft()
+
+            processes = idle + len(running) + len(starting)
+            stats["process_seconds"] += processes
+            stats["max_backlog"] = max(stats["max_backlog"], len(queue))
+            stats["peak"] = max(stats["peak"], processes)
+
+            if now % interval == 0:
+                durations = [duration for _, duration in finished]
+                desired = policy.decide(
+                    now,
+                    processes,
+                    len(queue),
+                    len(running),
+                    len(durations) / min(window, now + 1),
+                    (
+                        sum(durations) / len(durations)
+                        if durations
+                        else settings.AUTOSCALE_DEFAULT_TASK_SECONDS
+                    ),
+                    cpu_idle=1 - cpu_busy / (cpus * interval),
+                    cpu_count=cpus,
+                    available_memory_bytes=max(0, memory - processes * process_memory),
+                )
+                if desired > processes:
+                    starting.extend(
+                        [now + options["spawn_seconds"]] * (desired - processes)
+                    )
+                    stats["scalings"] += 1
+                elif desired < processes:
+                    # Like pool.shrink, only idle processes are stopped
+                    stopped = min(idle, processes - desired)
+                    idle -= stopped
+                    stats["scalings"] += bool(stopped)
+                timeline.append((now, processes, len(queue), len(running)))
+                cpu_busy = 0
+            now += 1
+
+        if timeline_path:
+            with open(timeline_path, "w", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["seconds", "processes", "backlog", "running"])
+                writer.writerows(timeline)
+        stats["waits"] = sorted(waits)
+        return stats
+
+    def report(self, label, stats):
+        waits = stats["waits"]
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+        self.stdout.write(
+            f"{label}: wait mean {sum(waits) / len(waits):.0f}s, p95 {p95:.0f}s, "
+            f"max {waits[-1]:.0f}s; backlog peak {stats['max_backlog']}; "
+            f"processes peak {stats['peak']}, "
+            f"{stats['process_seconds'] / 3600:.1f} process-hours; "
+            f"{stats['scalings']} scaling steps"
+        )
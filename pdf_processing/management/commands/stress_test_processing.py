@@ -0,0 +1,90 @@
+import multiprocessing
+import time
+from collections import Counter
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from pdf_processing.models import PDFDocument, ProcessingTask
+from pdf_processing.samples import build_sample_pdf
+from pdf_processing.tasks import process_pdf_document
+
+
+def _close_connections():
+    # Forked children must not share the parent's database connections
+    connections.close_all()
+
+
+def _process(document_id):
+    result = process_pdf_document.apply(args=[document_id]).result
+    return result["status"], result.get("message", "")
+
+
+class Command(BaseCommand):
+    help = (
+        "Run process_pdf_document on many documents from many processes at "
+        "once to check the database copes with concurrent writers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=8)
+        parser.add_argument("--documents", type=int, default=200)
+        parser.add_argument("--pages", type=int, default=20)
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the generated documents"
+        )
+
+    def handle(self, *args, **options):
+        document_ids = []
+        for index in range(options["documents"]):
+            content = build_sample_pdf(
+                [
+                    f"Stress test invoice {index} page {page} " + "x" * 500
+                    for page in range(1, options["pages"] + 1)
+                ]
+            )
+            document = PDFDocument.objects.create(
+                title=f"Stress test {index}",
+                file=ContentFile(content, name=f"stress-{index}.pdf"),
+                file_size=len(content),
+            )
+            document_ids.append(str(document.id))
+
+        _close_connections()
+        started = time.monotonic()
+        with multiprocessing.get_context("fork").Pool(
+            options["processes"], initializer=_close_connections
+        ) as pool:
+            results = pool.map(_process, document_ids, chunksize=1)
+        elapsed = time.monotonic() - started
+
+        statuses = Counter(status for status, _ in results)
+        errors = Counter(message for status, message in results if message)
+        retried = ProcessingTask.objects.filter(
+            document_id__in=document_ids, result__attempts__gt=1
+        ).count()
+        locked = ProcessingTask.objects.filter(
+            document_id__in=document_ids, error__icontains="database is locked"
+        ).count()
+
+        self.stdout.write(
+            f"Processed {len(document_ids)} documents with "
+            f"{options['processes']} processes in {elapsed:.1f}s "
+            f"({len(document_ids) / elapsed:.1f} documents/s)"
+        )
+        self.stdout.write(f"Results: {dict(statuses)}")
+        self.stdout.write(
+            f"Tasks retried: {retried}, hit 'database is locked': {locked}"
+        )
+        for message, count in errors.most_common(5):
+            self.stdout.write(f"  {count} x {message}")
+
+        if not options["keep"]:
+            for document in PDFDocument.objects.filter(id__in=document_ids):
+                document.delete_with_file()
+
+        if statuses.get("error"):
+            self.stderr.write(self.style.ERROR("Some documents failed"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All documents processed"))
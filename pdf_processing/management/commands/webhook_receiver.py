@@ -0,0 +1,78 @@
+import hmac
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from pdf_processing.webhooks import SIGNATURE_HEADER, TIMESTAMP_HEADER, sign_payload
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in webhook receiver that checks signatures and "
+        "prints the batches it receives"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--secret", help="Subscription secret to verify against")
+        parser.add_argument(
+            "--fail-rate",
+            type=float,
+            default=0,
+            help="Fraction of requests to answer with HTTP 500, to exercise retries",
+        )
+        parser.add_argument(
+            "--max-age", type=int, default=300, help="Reject older timestamps"
+        )
+
+    def handle(self, *args, **options):
+        command = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                timestamp = self.headers.get(TIMESTAMP_HEADER, "")
+
+                if options["secret"]:
+                    expected = "sha256=" + sign_payload(
+                        options["secret"], timestamp, body
+                    )
+                    signature = self.headers.get(SIGNATURE_HEADER, "")
+                    if not hmac.compare_digest(expected, signature):
+                        command.stderr.write("Rejected: bad signature")
+                        return self.reply(401)
+                    if abs(time.time() - int(timestamp or 0)) > options["max_age"]:
+                        command.stderr.write("Rejected: stale timestamp")
+                        return self.reply(401)
+
+                if random.random() < options["fail_rate"]:
+                    command.stdout.write("Simulated failure")
+                    return self.reply(500)
+
+                events = json.loads(body)["events"]
+                command.stdout.write(f"Received batch of {len(events)} events")
+                for event in events:
+                    data = event["data"]
+                    command.stdout.write(
+                        f"  {event['type']} {data['document_id']} {data['status']}"
+                    )
+                self.reply(204)
+
+            def reply(self, code):
+                self.send_response(code)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), Handler)
+        self.stdout.write(f"Listening on http://127.0.0.1:{options['port']}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
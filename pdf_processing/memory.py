@@ -0,0 +1,63 @@
+import os
+import resource
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a task's resident memory grows more than its budget"""
+
+
+def current_rss_bytes():
+    """
+    Return the resident set size of this process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No procfs (e.g. macOS): fall back to the peak, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryBudget:
+    """
+    Tracks how far a task's resident memory grows over what the process
+    used when the task started, sampled between pages, and whether that
+    growth has gone over a budget (0 means unlimited). The growth is
+    budgeted rather than the RSS, which also counts the libraries a worker
+    child has loaded and whatever earlier tasks left allocated.
+    """
+
+    def __init__(self, limit_bytes=0):
+        self.limit_bytes = limit_bytes
+        self.task_start = self.start = current_rss_bytes()
+        self.peak = self.start
+
+    @property
+    def peak_growth(self):
+        """
+        How far memory grew over the start of the task at most
+        """
+        return self.peak - self.task_start
+
+    def sample(self):
+        rss = current_rss_bytes()
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def rebase(self):
+        """
+        Budget growth from the memory in use now, for a fallback taking over
+        from a backend whose memory the allocator may not hand back
+        """
+        self.start = self.sample()
+
+    def check(self):
+        """
+        Sample memory and raise MemoryBudgetExceeded if over budget
+        """
+        growth = self.sample() - self.start
+        if self.limit_bytes and growth > self.limit_bytes:
+            raise MemoryBudgetExceeded(
+                f"Memory grew {growth / 2**20:.1f}MiB, over the budget of "
+                f"{self.limit_bytes / 2**20:.1f}MiB"
+            )
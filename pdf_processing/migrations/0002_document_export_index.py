@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pdfdocument",
+            index=models.Index(
+                fields=["upload_date", "id"], name="pdfdoc_upload_id_idx"
+            ),
+        ),
+    ]
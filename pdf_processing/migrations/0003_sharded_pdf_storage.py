@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:47
+
+import django.core.validators
+import pdf_processing.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0002_document_export_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pdfdocument",
+            name="file",
+            field=models.FileField(
+                db_index=True,
+                storage=pdf_processing.storage.pdf_storage,
+                upload_to="pdfs/",
+                validators=[
+                    django.core.validators.FileExtensionValidator(
+                        allowed_extensions=["pdf"]
+                    )
+                ],
+            ),
+        ),
+    ]
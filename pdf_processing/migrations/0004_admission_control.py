@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0003_sharded_pdf_storage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pdfdocument",
+            name="processing_status",
+            field=models.CharField(
+                choices=[
+                    ("deferred", "Deferred"),
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="processingtask",
+            index=models.Index(fields=["updated_at"], name="proctask_updated_idx"),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0004_admission_control"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PDFPage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("page_number", models.PositiveIntegerField()),
+                ("text", models.TextField(blank=True, default="")),
+                ("needs_ocr", models.BooleanField(default=False)),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pages",
+                        to="pdf_processing.pdfdocument",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["document", "page_number"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("document", "page_number"), name="unique_document_page"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0005_pdf_page_checkpoints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pdfpage",
+            name="height",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pdfpage",
+            name="width",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pdfpage",
+            name="words",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0006_page_word_layer"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VendorTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("producer", models.CharField(blank=True, max_length=255)),
+                ("creator", models.CharField(blank=True, max_length=255)),
+                ("anchor_text", models.CharField(max_length=255)),
+                (
+                    "anchor_region",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="[x0, top, x1, bottom] on page 1; empty searches the whole page",
+                    ),
+                ),
+                ("fields", models.JSONField(default=dict)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["name"],
+            },
+        ),
+        migrations.AddField(
+            model_name="pdfdocument",
+            name="extracted_fields",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="pdfdocument",
+            name="vendor_template",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="documents",
+                to="pdf_processing.vendortemplate",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0007_vendor_templates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pdfdocument",
+            name="minhash",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="LSHBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("band", models.PositiveSmallIntegerField()),
+                ("bucket", models.BigIntegerField()),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lsh_buckets",
+                        to="pdf_processing.pdfdocument",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["band", "bucket"], name="lsh_band_bucket_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("document", "band"), name="unique_document_band"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0009_webhooks"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pdfdocument",
+            name="processing_status",
+            field=models.CharField(
+                choices=[
+                    ("deferred", "Deferred"),
+                    ("batched", "Batched"),
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
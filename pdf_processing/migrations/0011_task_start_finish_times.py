@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pdf_processing", "0010_batched_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="processingtask",
+            name="finished_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="processingtask",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
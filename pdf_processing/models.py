@@ -1,12 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
+import secrets
 import uuid
 
+from .storage import pdf_storage
+
 
 class PDFDocument(models.Model):
     """Model to store PDF document metadata and processing status"""
     
     PROCESSING_STATUS_CHOICES = [
+        ('deferred', 'Deferred'),
+        ('batched', 'Batched'),
         ('pending', 'Pending'),
         ('processing', 'Processing'),
         ('completed', 'Completed'),
@@ -17,6 +24,8 @@ class PDFDocument(models.Model):
     title = models.CharField(max_length=255)
     file = models.FileField(
         upload_to='pdfs/',
+        storage=pdf_storage,
+        db_index=True,
         validators=[FileExtensionValidator(allowed_extensions=['pdf'])]
     )
     file_size = models.BigIntegerField(help_text="File size in bytes")
@@ -24,7 +33,8 @@ class PDFDocument(models.Model):
     processing_status = models.CharField(
         max_length=20,
         choices=PROCESSING_STATUS_CHOICES,
-        default='pending'
+        default='pending',
+        db_index=True
     )
     processing_started_at = models.DateTimeField(null=True, blank=True)
     processing_completed_at = models.DateTimeField(null=True, blank=True)
@@ -35,12 +45,64 @@ class PDFDocument(models.Model):
     page_count = models.IntegerField(null=True, blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     
+    # Set when a vendor template matched and only its fields were extracted
+    vendor_template = models.ForeignKey(
+        'VendorTemplate', on_delete=models.SET_NULL, null=True, blank=True, related_name='documents'
+    )
+    extracted_fields = models.JSONField(default=dict, blank=True)
+    
+    # MinHash signature of extracted_text for near-duplicate lookup, see
+    # similarity.py; indexed by LSHBucket
+    minhash = models.BinaryField(null=True, blank=True)
+    
     class Meta:
         ordering = ['-upload_date']
+        indexes = [
+            # Keyset order used by the streaming export
+            models.Index(fields=['upload_date', 'id'], name='pdfdoc_upload_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.processing_status})"
 
+    @classmethod
+    def create_with_file(cls, file, **fields):
+        """
+        Store an uploaded file and create a document referencing it.
+
+        Documents with the same content share one stored file. The rows
+        already sharing it stay locked until the new row is committed, so a
+        concurrent delete_with_file() either sees the new row or finishes
+        removing the file before it is checked for and written again.
+        """
+        field = cls._meta.get_field('file')
+        name = field.storage.content_name(field.generate_filename(None, file.name), file)
+        with transaction.atomic():
+            list(cls.objects.select_for_update().filter(file=name).order_by('pk').values_list('pk'))
+            name = field.storage.save_content(name, file, max_length=field.max_length)
+            return cls.objects.create(file=name, **fields)
+
+    def delete_with_file(self):
+        """
+        Delete the document, and its stored PDF unless another document
+        shares the content
+        """
+        with transaction.atomic():
+            if self.file:
+                # Lock every row sharing the file, then look again with a
+                # fresh query: a row committed while waiting for the lock
+                # is only visible to a new statement
+                list(
+                    PDFDocument.objects.select_for_update()
+                    .filter(file=self.file.name)
+                    .order_by('pk')
+                    .values_list('pk')
+                )
+                shared = PDFDocument.objects.filter(file=self.file.name).exclude(pk=self.pk).exists()
+                if not shared:
+                    self.file.storage.delete(self.file.name)
+            self.delete()
+
 
 class ProcessingTask(models.Model):
     """Model to track Celery task execution"""
@@ -51,13 +113,184 @@ class ProcessingTask(models.Model):
     status = models.CharField(max_length=50, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # When the last attempt ran; batch records are written after the whole
+    # batch, so these are the only times that say how long each one took
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
     result = models.JSONField(default=dict, blank=True)
     error = models.TextField(blank=True, null=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Recent completions, sampled by admission control for throughput
+            models.Index(fields=['updated_at'], name='proctask_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.task_name} - {self.document.title}"
 
 
+
+
+class PDFPage(models.Model):
+    """Model to store extracted text per page; doubles as extraction checkpoint"""
+    
+    document = models.ForeignKey(PDFDocument, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    text = models.TextField(blank=True, default='')
+    needs_ocr = models.BooleanField(default=False)
+    
+    # Optional word layer, see layout.py; coordinates are in PDF points
+    # from the top-left corner of a page of the given width and height
+    width = models.FloatField(null=True, blank=True)
+    height = models.FloatField(null=True, blank=True)
+    words = models.BinaryField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['document', 'page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_number'], name='unique_document_page'),
+        ]
+    
+    def __str__(self):
+        return f"{self.document.title} - page {self.page_number}"
+
+
+class LSHBucket(models.Model):
+    """Model to index MinHash signature bands, for near-duplicate lookup"""
+    
+    document = models.ForeignKey(PDFDocument, on_delete=models.CASCADE, related_name='lsh_buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket'], name='lsh_band_bucket_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'band'], name='unique_document_band'),
+        ]
+    
+    def __str__(self):
+        return f"{self.document_id} band {self.band}"
+
+
+def validate_region(region):
+    """
+    Check that a region is [x0, top, x1, bottom] in PDF points
+    """
+    if (
+        not isinstance(region, list)
+        or len(region) != 4
+        or not all(isinstance(value, (int, float)) for value in region)
+        or region[0] >= region[2]
+        or region[1] >= region[3]
+    ):
+        raise ValidationError(f'Invalid region {region!r}, expected [x0, top, x1, bottom]')
+
+
+class VendorTemplate(models.Model):
+    """Model to store the known layout of one vendor's documents"""
+    
+    name = models.CharField(max_length=255, unique=True)
+    
+    # A document matches when its producer and creator metadata equal these
+    # (blank matches anything) and the anchor text is found on page 1
+    producer = models.CharField(max_length=255, blank=True)
+    creator = models.CharField(max_length=255, blank=True)
+    anchor_text = models.CharField(max_length=255)
+    anchor_region = models.JSONField(
+        default=list, blank=True, help_text='[x0, top, x1, bottom] on page 1; empty searches the whole page'
+    )
+    
+    # {"field name": {"page": 1, "region": [x0, top, x1, bottom]}}
+    fields = models.JSONField(default=dict)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+    
+    def clean(self):
+        if self.anchor_region:
+            validate_region(self.anchor_region)
+        if not self.fields:
+            raise ValidationError('A template needs at least one field')
+        for name, field in self.fields.items():
+            if not isinstance(field, dict) or not isinstance(field.get('page'), int) or field['page'] < 1:
+                raise ValidationError(f'Field {name!r} needs a page number')
+            validate_region(field.get('region'))
+    
+    def matches_metadata(self, metadata):
+        """
+        Check the document's producer and creator against the template
+        """
+        return (
+            (not self.producer or metadata.get('producer', '') == self.producer)
+            and (not self.creator or metadata.get('creator', '') == self.creator)
+        )
+
+
+def generate_webhook_secret():
+    return secrets.token_hex(32)
+
+
+class WebhookSubscription(models.Model):
+    """Model to store an endpoint notified of document events"""
+    
+    EVENT_CHOICES = [
+        ('document.completed', 'Document completed'),
+        ('document.failed', 'Document failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, default=generate_webhook_secret)
+    events = models.JSONField(default=list, blank=True, help_text="Event types to deliver; empty means all")
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.url
+    
+    def wants(self, event_type):
+        return not self.events or event_type in self.events
+
+
+class WebhookEvent(models.Model):
+    """Model to queue webhook deliveries; dead events are the dead-letter store"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('delivered', 'Delivered'),
+        ('dead', 'Dead'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE, related_name='events_log')
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Due events, scanned by the webhook dispatcher
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} -> {self.subscription.url} ({self.status})"
@@ -0,0 +1,125 @@
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def page_needs_ocr(page):
+    """
+    Decide whether a pdfplumber page is a scan without a usable text layer.
+
+    A page qualifies when it has fewer than OCR_MIN_CHARS characters and
+    embedded images cover at least OCR_MIN_IMAGE_COVERAGE of its area.
+    Blank pages (no text, no images) are left alone.
+    """
+    if len(page.chars) >= settings.OCR_MIN_CHARS:
+        return False
+
+    page_area = float(page.width * page.height)
+    if not page_area:
+        return False
+
+    covered = 0.0
+    for image in page.images:
+        width = min(image["x1"], page.width) - max(image["x0"], 0)
+        height = min(image["bottom"], page.height) - max(image["top"], 0)
+        if width > 0 and height > 0:
+            covered += float(width * height)
+
+    return covered / page_area >= settings.OCR_MIN_IMAGE_COVERAGE
+
+
+def pypdf2_page_has_images(page):
+    """
+    Decide whether a PyPDF2 page draws images, for when pdfplumber can't
+    parse the file. Resources are often indirect objects, and a page without
+    its own uses those of the nearest page tree node that has them.
+    """
+    node, depth = page, 0
+    resources = None
+    while node is not None and resources is None and depth < 32:
+        resources = node.get("/Resources")
+        parent = node.get("/Parent")
+        node = parent.get_object() if parent is not None else None
+        depth += 1
+    if resources is None:
+        return False
+
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return False
+    return any(
+        xobject.get_object().get("/Subtype") == "/Image"
+        for xobject in xobjects.get_object().values()
+    )
+
+
+def render_pages(file_path, page_numbers, dpi=None):
+    """
+    Render 1-based pages of a PDF to PIL images using pypdfium2, yielding
+    (page_num, image) pairs
+    """
+    import pypdfium2 as pdfium
+
+    scale = (dpi or settings.OCR_RENDER_DPI) / 72
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        for page_num in page_numbers:
+            page = pdf[page_num - 1]
+            try:
+                yield page_num, page.render(scale=scale).to_pil()
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+
+class OCRBackend:
+    """Base class for OCR backends; subclasses turn a page image into text"""
+
+    def recognize(self, image):
+        raise NotImplementedError
+
+
+class TesseractBackend(OCRBackend):
+    """OCR backend using a local Tesseract install through pytesseract"""
+
+    def __init__(self):
+        try:
+            import pytesseract
+        except ImportError:
+            raise ImproperlyConfigured(
+                "TesseractBackend requires the pytesseract package and the "
+                "tesseract binary"
+            )
+        self.pytesseract = pytesseract
+
+    def recognize(self, image):
+        return self.pytesseract.image_to_string(image, lang=settings.OCR_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def get_ocr_backend():
+    """
+    Return the OCR backend configured by OCR_BACKEND, instantiated once
+    per process
+    """
+    return import_string(settings.OCR_BACKEND)()
+
+
+def ocr_pages(file_path, page_numbers):
+    """
+    Run OCR over the given 1-based pages and return {page_num: text}
+    """
+    backend = get_ocr_backend()
+    results = {}
+    for page_num, image in render_pages(file_path, page_numbers):
+        results[page_num] = backend.recognize(image).strip()
+        logger.info(
+            f"OCR extracted {len(results[page_num])} characters from page {page_num}"
+        )
+    return results
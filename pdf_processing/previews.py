@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .storage import local_file_path
+
+logger = logging.getLogger(__name__)
+
+TRIM_CACHE_KEY = "previews:trimmed"
+
+
+class PreviewError(Exception):
+    """Raised when a page can't be rendered, e.g. the PDF is damaged"""
+
+
+def snap_width(width):
+    """
+    Round a requested width to the nearest configured preview width, so
+    arbitrary sizes can't fill the cache
+    """
+    return min(settings.PREVIEW_WIDTHS, key=lambda allowed: abs(allowed - width))
+
+
+def thumbnail_cache_path(file_name, page_number, width):
+    """
+    Return where the thumbnail of a stored file's page is cached
+    """
+    key = hashlib.sha256(file_name.encode()).hexdigest()
+    return (
+        Path(settings.PREVIEW_CACHE_DIR) / key[:2] / key / f"{page_number}-{width}.jpg"
+    )
+
+
+def thumbnail_version(file_name):
+    """
+    Return a short version string for a stored file, for thumbnail URLs.
+    Stored files are named after their content, so it changes whenever the
+    document's content does.
+    """
+    return hashlib.sha256(file_name.encode()).hexdigest()[:16]
+
+
+def render_thumbnail(file_path, page_number, width, target):
+    """
+    Render a 1-based page at the given pixel width to a JPEG at target
+    """
+    import pypdfium2 as pdfium
+
+    try:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            if not 1 <= page_number <= len(pdf):
+                raise IndexError(f"Page {page_number} out of range")
+            page = pdf[page_number - 1]
+            try:
+                image = page.render(scale=width / page.get_width()).to_pil()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
+    except pdfium.PdfiumError as e:
+        raise PreviewError(str(e)) from e
+
+    # Write to a temporary file first so readers never see a partial image
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            image.convert("RGB").save(output, "JPEG", quality=80, optimize=True)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def get_thumbnail(field_file, page_number, width, file_path=None):
+    """
+    Return the path of a cached page thumbnail, rendering it on a miss.
+
+    Cache hits refresh the file's modification time, which the size cap
+    uses to evict the least recently used thumbnails first. Pass file_path
+    when the PDF is already available locally.
+    """
+    target = thumbnail_cache_path(field_file.name, page_number, width)
+    try:
+        os.utime(target)
+        return target
+    except FileNotFoundError:
+        pass
+
+    if file_path:
+        render_thumbnail(file_path, page_number, width, target)
+    else:
+        with local_file_path(field_file) as local_path:
+            render_thumbnail(local_path, page_number, width, target)
+
+    enforce_cache_limit()
+    return target
+
+
+def enforce_cache_limit():
+    """
+    Evict least recently used thumbnails until the cache is back under
+    90% of PREVIEW_CACHE_MAX_BYTES. Scanning the cache is not free, so this
+    runs at most once per PREVIEW_CACHE_TRIM_INTERVAL seconds.
+    """
+    if not cache.add(TRIM_CACHE_KEY, True, settings.PREVIEW_CACHE_TRIM_INTERVAL):
+        return
+
+    entries = []
+    total = 0
+    for path in Path(settings.PREVIEW_CACHE_DIR).glob("*/*/*.jpg"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    if total <= settings.PREVIEW_CACHE_MAX_BYTES:
+        return
+
+    target_size = settings.PREVIEW_CACHE_MAX_BYTES * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target_size:
+            break
+        try:
+            path.unlink()
+            total -= size
+        except FileNotFoundError:
+            pass
+    logger.info(f"Preview cache trimmed to {total} bytes")
@@ -0,0 +1,86 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Even in a compressed object stream, a page dictionary takes more than this
+MIN_BYTES_PER_PAGE = 10
+
+
+def pypdf2_metadata(pdf_reader):
+    """
+    Build the document metadata dict from a PyPDF2 reader's info dictionary
+    """
+    if not pdf_reader.metadata:
+        return {}
+    return {
+        "title": pdf_reader.metadata.get("/Title", ""),
+        "author": pdf_reader.metadata.get("/Author", ""),
+        "subject": pdf_reader.metadata.get("/Subject", ""),
+        "creator": pdf_reader.metadata.get("/Creator", ""),
+        "producer": pdf_reader.metadata.get("/Producer", ""),
+        "creation_date": str(pdf_reader.metadata.get("/CreationDate", "")),
+        "modification_date": str(pdf_reader.metadata.get("/ModDate", "")),
+    }
+
+
+def has_pdf_header(file):
+    """
+    Check that a file starts with the %PDF- header, which readers accept
+    anywhere in the first 1024 bytes. The file position is restored.
+    """
+    position = file.tell()
+    try:
+        return b"%PDF-" in file.read(1024)
+    finally:
+        file.seek(position)
+
+
+def page_tree_count(pdf_reader, file_size):
+    """
+    Return the page count declared by the page tree root (/Count), without
+    walking the tree. The tree is walked and its pages counted instead when
+    /Count is missing or malformed, or isn't plausible: fewer than the
+    root's own kids, more pages than the file has room for, or more than
+    PDF_PROBE_MAX_TRUSTED_PAGES.
+    """
+    try:
+        root = pdf_reader.trailer["/Root"]["/Pages"]
+        count = int(root["/Count"])
+        kids = len(root["/Kids"]) if "/Kids" in root else 0
+    except (KeyError, TypeError, ValueError):
+        count, kids = -1, 0
+    limit = min(file_size // MIN_BYTES_PER_PAGE, settings.PDF_PROBE_MAX_TRUSTED_PAGES)
+    if not kids <= count <= limit:
+        logger.info(f"Implausible page tree /Count {count}; counting pages")
+        count = len(pdf_reader.pages)
+    return count
+
+
+def probe_pdf_metadata(file):
+    """
+    Cheaply read the page count and info dictionary of a PDF.
+
+    Only the trailer, cross-reference table, info dictionary and the /Count
+    of the page tree root are read; the page tree is walked only if /Count
+    is missing or implausible, and no page content is parsed. Returns None
+    if the file can't be read this way. The file position is restored.
+    """
+    import PyPDF2
+
+    position = file.tell()
+    try:
+        file.seek(0, 2)
+        file_size = file.tell()
+        file.seek(position)
+        pdf_reader = PyPDF2.PdfReader(file, strict=False)
+        return {
+            "page_count": page_tree_count(pdf_reader, file_size),
+            "metadata": pypdf2_metadata(pdf_reader),
+        }
+    except Exception as e:
+        logger.warning(f"PDF metadata probe failed: {str(e)}")
+        return None
+    finally:
+        file.seek(position)
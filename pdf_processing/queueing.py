@@ -0,0 +1,40 @@
+from celery import current_app
+from django.conf import settings
+
+# Tasks are sent by name so the web tier never imports tasks.py, which pulls
+# in the PDF extraction libraries
+PROCESS_PDF_TASK = "pdf_processing.tasks.process_pdf_document"
+PROCESS_BATCH_TASK = "pdf_processing.tasks.process_pdf_batch"
+
+
+def should_batch(page_count):
+    """
+    Whether a document is small enough to be processed in a batch, by its
+    page count as probed at upload
+    """
+    return (
+        settings.PDF_BATCH_ENABLED
+        and page_count is not None
+        and page_count <= settings.PDF_BATCH_MAX_PAGES
+    )
+
+
+def enqueue_processing(document_id, page_count=None):
+    """
+    Enqueue process_pdf_document, sending documents whose probed page count
+    exceeds PDF_LARGE_DOCUMENT_PAGES to the large-document queue so they
+    can't hold up small invoices
+    """
+    options = {}
+    if page_count and page_count > settings.PDF_LARGE_DOCUMENT_PAGES:
+        options["queue"] = settings.PDF_LARGE_DOCUMENT_QUEUE
+    return current_app.send_task(PROCESS_PDF_TASK, args=[str(document_id)], **options)
+
+
+def enqueue_batch(document_ids):
+    """
+    Enqueue process_pdf_batch for a group of small documents
+    """
+    return current_app.send_task(
+        PROCESS_BATCH_TASK, args=[[str(document_id) for document_id in document_ids]]
+    )
@@ -0,0 +1,149 @@
+import functools
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Routing state of the current request; None outside of one (workers,
+# management commands), where everything uses the primary
+_routing = ContextVar("replica_routing", default=None)
+
+DOCUMENT_PIN_CACHE_KEY = "db_pin:document:{}"
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        # Reads may go to a replica (set by @read_only)
+        self.use_replica = False
+        # The client wrote recently, or this request has: read the primary
+        self.pinned = pinned
+        self.wrote = False
+
+
+def pin_document(document_id):
+    """
+    Send reads of the document to the primary for
+    DATABASE_REPLICA_PIN_SECONDS, for clients that don't keep the pin cookie
+    """
+    cache.set(
+        DOCUMENT_PIN_CACHE_KEY.format(document_id),
+        True,
+        settings.DATABASE_REPLICA_PIN_SECONDS,
+    )
+
+
+def document_pinned(document_id):
+    return bool(cache.get(DOCUMENT_PIN_CACHE_KEY.format(document_id)))
+
+
+def read_only(view):
+    """
+    Decorator letting a view's queries read from a replica in
+    DATABASE_REPLICAS. Only use it on views whose queries all run before
+    they return, not on streaming responses. Views taking a document_id read
+    the primary while that document is pinned.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        state = _routing.get()
+        token = None
+        if state is None:
+            state = RoutingState()
+            token = _routing.set(state)
+        previous = state.use_replica, state.pinned
+        state.use_replica = True
+        if settings.DATABASE_REPLICAS and not state.pinned and "document_id" in kwargs:
+            state.pinned = document_pinned(kwargs["document_id"])
+        try:
+            return view(*args, **kwargs)
+        finally:
+            state.use_replica, state.pinned = previous
+            if token is not None:
+                _routing.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads of @read_only views to a random replica, unless the client
+    is pinned to the primary after a write, and everything else to
+    "default"
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if (
+            settings.DATABASE_REPLICAS
+            and state is not None
+            and state.use_replica
+            and not (state.pinned or state.wrote)
+        ):
+            return random.choice(settings.DATABASE_REPLICAS)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+            instance = hints.get("instance")
+            if (
+                settings.DATABASE_REPLICAS
+                and model._meta.label == "pdf_processing.PDFDocument"
+                and instance is not None
+            ):
+                # Saving or deleting a document in a request (an upload, a
+                # delete): its reads must see that, cookie or not
+                pin_document(instance.pk)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {"default", *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Gives clients read-your-writes consistency: after a request writes to
+    the database, a cookie pins the client's reads to the primary for
+    DATABASE_REPLICA_PIN_SECONDS, longer than replicas are expected to lag.
+    API clients that drop cookies still read the documents they uploaded or
+    deleted from the primary, as the router pins those documents too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(settings.DATABASE_PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        state = RoutingState(pinned=pinned_until > time.time())
+
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+        if state.wrote:
+            response.set_cookie(
+                settings.DATABASE_PIN_COOKIE,
+                str(time.time() + settings.DATABASE_REPLICA_PIN_SECONDS),
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,10 @@
+from storages.backends.s3 import S3Storage
+
+from .storage import ContentAddressedStorageMixin
+
+
+class ShardedS3Storage(ContentAddressedStorageMixin, S3Storage):
+    """
+    Content-addressed, hash-sharded storage on S3 or an S3-compatible
+    service such as MinIO. Requires django-storages[s3].
+    """
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PDFDocument, ProcessingTask, VendorTemplate
+from .vendor_templates import invalidate_vendor_templates
+
+# Template fragments cached per document, see home.html and document_detail.html
+DOCUMENT_FRAGMENTS = ["document_card", "document_info"]
+
+
+def invalidate_document_fragments(document_id):
+    """
+    Drop every cached template fragment rendered for a document
+    """
+    cache.delete_many(
+        [make_template_fragment_key(name, [document_id]) for name in DOCUMENT_FRAGMENTS]
+    )
+
+
+@receiver([post_save, post_delete], sender=PDFDocument)
+def document_changed(sender, instance, **kwargs):
+    invalidate_document_fragments(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ProcessingTask)
+def task_changed(sender, instance, **kwargs):
+    invalidate_document_fragments(instance.document_id)
+
+
+@receiver([post_save, post_delete], sender=VendorTemplate)
+def vendor_template_changed(sender, instance, **kwargs):
+    invalidate_vendor_templates()
@@ -0,0 +1,157 @@
+import hashlib
+import random
+import re
+import sys
+from array import array
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import LSHBucket, PDFDocument
+from .text import PAGE_MARKER
+
+# MinHash over word shingles, banded for locality-sensitive hashing: two
+# documents with Jaccard similarity s share at least one of b bands of r
+# rows with probability 1 - (1 - s^r)^b, so similar documents collide in
+# some bucket while unrelated ones almost never do.
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SEED = 1
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm):
+    # Fixed seed: signatures must stay comparable across processes and runs
+    rng = random.Random(SEED)
+    return [
+        (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+        for _ in range(num_perm)
+    ]
+
+
+def shingles(text, size):
+    """
+    Return the set of hashed word shingles of a text, ignoring case, page
+    markers and whitespace differences
+    """
+    words = re.findall(r"\w+", PAGE_MARKER.sub(" ", text).lower())
+    if len(words) < size:
+        return {_hash64(" ".join(words).encode())} if words else set()
+    return {
+        _hash64(" ".join(words[index : index + size]).encode())
+        for index in range(len(words) - size + 1)
+    }
+
+
+def minhash_signature(text):
+    """
+    Compute the MinHash signature of a text as packed little-endian uint32s,
+    or None when the text has no words
+    """
+    hashes = shingles(text or "", settings.SIMILARITY_SHINGLE_SIZE)
+    if not hashes:
+        return None
+    signature = array(
+        "I",
+        (
+            min((a * value + b) % MERSENNE_PRIME for value in hashes) & MAX_HASH
+            for a, b in _permutations(settings.SIMILARITY_NUM_PERM)
+        ),
+    )
+    if sys.byteorder == "big":
+        signature.byteswap()
+    return signature.tobytes()
+
+
+def decode_signature(blob):
+    """
+    Unpack a stored signature into an array of uint32s
+    """
+    signature = array("I")
+    signature.frombytes(bytes(blob))
+    if sys.byteorder == "big":
+        signature.byteswap()
+    return signature
+
+
+def estimate_similarity(signature, other):
+    """
+    Estimate the Jaccard similarity of two documents from their signatures
+    """
+    if not signature or len(signature) != len(other):
+        return 0.0
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+
+def band_buckets(signature):
+    """
+    Split a signature into SIMILARITY_BANDS bands and hash each to a bucket
+    """
+    rows = len(signature) // settings.SIMILARITY_BANDS
+    return [
+        (
+            band,
+            _hash64(
+                band.to_bytes(2, "little")
+                + signature[band * rows : (band + 1) * rows].tobytes()
+            )
+            - (1 << 63),  # fit a signed 64-bit column
+        )
+        for band in range(settings.SIMILARITY_BANDS)
+    ]
+
+
+def lsh_buckets(document):
+    """
+    Build (unsaved) LSH buckets for a document's current signature
+    """
+    if not document.minhash:
+        return []
+    return [
+        LSHBucket(document=document, band=band, bucket=bucket)
+        for band, bucket in band_buckets(decode_signature(document.minhash))
+    ]
+
+
+def save_lsh_buckets(document):
+    """
+    Replace a document's LSH buckets with those of its current signature
+    """
+    LSHBucket.objects.filter(document=document).delete()
+    LSHBucket.objects.bulk_create(lsh_buckets(document))
+
+
+def find_similar_documents(document, threshold, limit):
+    """
+    Return (document, estimated similarity) pairs for documents sharing an
+    LSH bucket with this one and at least threshold similar, most similar
+    first
+    """
+    if not document.minhash:
+        return []
+    signature = decode_signature(document.minhash)
+
+    query = Q()
+    for band, bucket in band_buckets(signature):
+        query |= Q(band=band, bucket=bucket)
+    candidate_ids = (
+        LSHBucket.objects.filter(query)
+        .exclude(document_id=document.id)
+        .values("document_id")
+    )
+    candidates = PDFDocument.objects.filter(id__in=candidate_ids).only(
+        "id", "title", "upload_date", "minhash"
+    )
+
+    similar = []
+    for candidate in candidates:
+        similarity = estimate_similarity(signature, decode_signature(candidate.minhash))
+        if similarity >= threshold:
+            similar.append((candidate, similarity))
+    similar.sort(key=lambda pair: pair[1], reverse=True)
+    return similar[:limit]
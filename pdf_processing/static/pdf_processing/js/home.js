@@ -7,7 +7,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeUploadForm();
     initializeDragAndDrop();
     initializeFileDisplay();
-    loadDocuments();
+    initializeDocuments();
     setupRefreshButton();
 });
 
@@ -171,10 +171,8 @@ function initializeUploadForm() {
                     }
                 }
                 
-                // Reload documents after a short delay
+                // Redirect to document detail page after a short delay
                 setTimeout(() => {
-                    loadDocuments();
-                    // Redirect to document detail page
                     window.location.href = `/document/${data.document_id}/`;
                 }, 1000);
             } else {
@@ -212,7 +210,21 @@ function showUploadMessage(message, type) {
 }
 
 /**
- * Load documents list
+ * Use the server-rendered documents list if present, otherwise fetch it
+ */
+function initializeDocuments() {
+    const container = document.getElementById('documents-container');
+    if (!container) return;
+    
+    if (container.dataset.rendered) {
+        bindDocumentCards(container);
+    } else {
+        loadDocuments();
+    }
+}
+
+/**
+ * Load the first page of the documents list, as rendered by the server
  */
 async function loadDocuments() {
     const container = document.getElementById('documents-container');
@@ -248,7 +260,13 @@ function displayDocuments(documents) {
     }
     
     container.innerHTML = documents.map(doc => createDocumentCard(doc)).join('');
-    
+    bindDocumentCards(container);
+}
+
+/**
+ * Attach navigation and delete handlers to document cards
+ */
+function bindDocumentCards(container) {
     // Add click handlers for document cards
     container.querySelectorAll('.document-card').forEach(card => {
         card.addEventListener('click', function(e) {
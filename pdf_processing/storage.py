@@ -0,0 +1,86 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage, storages
+
+
+class ContentAddressedStorageMixin:
+    """
+    Storage mixin that names files after the SHA-256 of their content.
+
+    Files are sharded into nested directories by hash prefix, e.g.
+    pdfs/ab/cd/abcd...ef.pdf, so no single directory grows unbounded.
+    Saving content that is already stored returns the existing name
+    instead of writing a second copy; callers that share files between
+    records lock those records around the save, see
+    PDFDocument.create_with_file().
+    """
+
+    shard_depth = 2
+    shard_width = 2
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        hexdigest = digest.hexdigest()
+        shards = [
+            hexdigest[i * self.shard_width : (i + 1) * self.shard_width]
+            for i in range(self.shard_depth)
+        ]
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), *shards, hexdigest + extension)
+
+    def save(self, name, content, max_length=None):
+        name = self.content_name(name or content.name, content)
+        return self.save_content(name, content, max_length=max_length)
+
+    def save_content(self, name, content, max_length=None):
+        """
+        Store content under a name already returned by content_name()
+        """
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+class ShardedFileSystemStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    """Content-addressed, hash-sharded storage on the local filesystem"""
+
+
+def pdf_storage():
+    """
+    Storage used for uploaded PDFs, configured by STORAGES["pdfs"]
+    """
+    return storages["pdfs"]
+
+
+@contextmanager
+def local_file_path(field_file):
+    """
+    Yield a local filesystem path for a stored file.
+
+    Files on local storage are used in place; files on remote storage
+    (e.g. S3) are streamed in chunks to a temporary file that is removed
+    afterwards, so the extractor never holds the whole PDF in memory.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+
+    if path is not None:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as local_copy:
+        with field_file.storage.open(field_file.name, "rb") as remote:
+            for chunk in remote.chunks():
+                local_copy.write(chunk)
+        local_copy.flush()
+        yield local_copy.name
@@ -1,21 +1,79 @@
 import os
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from celery import shared_task
+from celery.signals import worker_init
+from celery.exceptions import SoftTimeLimitExceeded
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
 from django.utils import timezone
-from .models import PDFDocument, ProcessingTask
-import PyPDF2
-import pdfplumber
+from .models import (
+    LSHBucket,
+    PDFDocument,
+    PDFPage,
+    ProcessingTask,
+    WebhookEvent,
+    WebhookSubscription,
+)
+from .admission import dispatch_capacity
+from .layout import encode_words
+from .memory import MemoryBudget
+from .ocr import ocr_pages, page_needs_ocr, pypdf2_page_has_images
+from .previews import get_thumbnail
+from .probe import pypdf2_metadata
+from .queueing import enqueue_batch, enqueue_processing, should_batch
+from .signals import invalidate_document_fragments
+from .similarity import (
+    find_similar_documents,
+    lsh_buckets,
+    minhash_signature,
+    save_lsh_buckets,
+)
+from .storage import local_file_path
+from .text import join_pages
+from .tracing import span
+from .vendor_templates import match_vendor_template
+from .webhooks import deliver_due_events, document_events, record_document_event
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
+BATCH_DISPATCH_LOCK_KEY = "batches:dispatching"
 
-@shared_task(bind=True)
+
+class TooManyAttempts(Exception):
+    """Raised when a document has used up its processing attempts"""
+
+
+@worker_init.connect
+def preload_extraction_libraries(**kwargs):
+    """
+    Import the extraction libraries in the worker's main process, before the
+    pool forks, so its child processes share them rather than each importing
+    them on their first task
+    """
+    import pdfplumber  # noqa: F401
+    import PyPDF2  # noqa: F401
+
+
+@shared_task(
+    bind=True,
+    soft_time_limit=settings.PDF_TASK_SOFT_TIME_LIMIT,
+    time_limit=settings.PDF_TASK_TIME_LIMIT,
+    max_retries=settings.PDF_TASK_MAX_RETRIES,
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
 def process_pdf_document(self, document_id):
     """
-    Celery task to process a PDF document and extract text and metadata
+    Celery task to process a PDF document and extract text and metadata.
+
+    Extracted pages are checkpointed to PDFPage as extraction goes, so a
+    retry (after an error, a soft time limit or a lost worker) resumes
+    after the last saved page instead of starting over. A new task for the
+    document starts from the first page.
     """
     try:
         # Get the document
@@ -23,46 +81,108 @@ def process_pdf_document(self, document_id):
 
         # Update document status to processing
         document.processing_status = "processing"
-        document.processing_started_at = timezone.now()
+        if document.processing_started_at is None or not self.request.retries:
+            document.processing_started_at = timezone.now()
         document.save()
 
-        # Create task tracking record
-        task_record = ProcessingTask.objects.create(
-            document=document,
+        # Create or reuse the task tracking record; retries share the task id
+        task_record, first_attempt = ProcessingTask.objects.get_or_create(
             task_id=self.request.id,
-            task_name="process_pdf_document",
-            status="PROCESSING",
+            defaults={"document": document, "task_name": "process_pdf_document"},
         )
+        attempts = task_record.result.get("attempts", 0) + 1
+        task_record.status = "PROCESSING"
+        task_record.result = {"attempts": attempts}
+        task_record.started_at = timezone.now()
+        task_record.finished_at = None
+        task_record.save()
 
-        # Get file path
-        file_path = document.file.path
+        # A message redelivered after its worker died doesn't count as a retry,
+        # so cap attempts here to stop a PDF that kills workers from looping
+        if attempts > self.max_retries + 1:
+            raise TooManyAttempts(f"Gave up after {attempts - 1} attempts")
+
+        # Checkpoints belong to a task: retries and redeliveries of this one
+        # resume after its last saved page, while a new task (a reprocess)
+        # starts over rather than reuse pages of an earlier run
+        if first_attempt:
+            document.pages.all().delete()
+        last_page = document.pages.aggregate(last=Max("page_number"))["last"] or 0
+        checkpoint = PageCheckpoint(
+            start_page=last_page + 1,
+            save=lambda pages: save_page_checkpoint(document, pages),
+        )
+        resumed_from_page = checkpoint.next_page
+        memory = MemoryBudget(settings.PDF_TASK_RSS_BUDGET_MB * 2**20)
 
         # Extract text and metadata
-        extracted_data = extract_pdf_content(file_path)
+        with local_file_path(document.file) as file_path:
+            extracted_data = extract_document(document, file_path, checkpoint, memory)
+
+            if settings.PREVIEW_PRERENDER_FIRST_PAGE:
+                prerender_first_page(document, file_path)
+        memory.sample()
+
+        # Assemble the full text from all checkpointed pages, including
+        # those extracted by earlier attempts
+        pages = list(document.pages.values_list("page_number", "text", "needs_ocr"))
+        extracted_text = join_pages({number: text for number, text, _ in pages})
+        ocr_page_numbers = [number for number, _, needs_ocr in pages if needs_ocr]
+
+        # Scanned pages are handed to the OCR queue, which completes the document
+        needs_ocr = settings.OCR_ENABLED and bool(ocr_page_numbers)
 
         # Update document with extracted data
-        document.extracted_text = extracted_data["text"]
+        document.extracted_text = extracted_text
         document.page_count = extracted_data["page_count"]
         document.metadata = extracted_data["metadata"]
-        document.processing_status = "completed"
-        document.processing_completed_at = timezone.now()
-        document.save()
+        document.vendor_template = extracted_data.get("template")
+        document.extracted_fields = extracted_data.get("fields", {})
+        document.minhash = minhash_signature(extracted_text)
+        if not needs_ocr:
+            document.processing_status = "completed"
+            document.processing_completed_at = timezone.now()
 
-        # Update task record
         task_record.status = "SUCCESS"
+        task_record.error = None
+        task_record.finished_at = timezone.now()
         task_record.result = {
+            "attempts": attempts,
             "page_count": extracted_data["page_count"],
-            "text_length": len(extracted_data["text"]),
+            "text_length": len(extracted_text),
+            "ocr_pages": ocr_page_numbers,
+            "resumed_from_page": resumed_from_page,
+            "extraction_backend": extracted_data["backend"],
+            "peak_memory_growth_bytes": memory.peak_growth,
+            "vendor_template": getattr(extracted_data.get("template"), "name", None),
+            "near_duplicates": [
+                {"document_id": str(similar.id), "similarity": similarity}
+                for similar, similarity in find_similar_documents(
+                    document, settings.SIMILARITY_THRESHOLD, limit=5
+                )
+            ],
             "processing_time": str(timezone.now() - document.processing_started_at),
         }
-        task_record.save()
+
+        # Write the document, its similarity index entries and the task
+        # record in one short write transaction
+        with span("save document"), transaction.atomic():
+            document.save()
+            save_lsh_buckets(document)
+            task_record.save()
+            if not needs_ocr:
+                record_document_event(document, "document.completed", self.request.id)
+
+        if needs_ocr:
+            ocr_pdf_pages.delay(str(document.id), ocr_page_numbers)
 
         logger.info(f"Successfully processed PDF document: {document.title}")
         return {
             "status": "success",
             "document_id": str(document_id),
             "page_count": extracted_data["page_count"],
-            "text_length": len(extracted_data["text"]),
+            "text_length": len(extracted_text),
+            "ocr_pages": ocr_page_numbers,
         }
 
     except PDFDocument.DoesNotExist:
@@ -72,6 +192,21 @@ def process_pdf_document(self, document_id):
 
     except Exception as e:
         error_msg = f"Error processing PDF document: {str(e)}"
+
+        # Retry with exponential backoff; checkpointed pages are kept
+        if self.request.retries < self.max_retries and not isinstance(
+            e, TooManyAttempts
+        ):
+            countdown = min(
+                settings.PDF_TASK_RETRY_BACKOFF * 2**self.request.retries,
+                settings.PDF_TASK_RETRY_BACKOFF_MAX,
+            )
+            logger.warning(f"{error_msg}; retrying in {countdown}s")
+            ProcessingTask.objects.filter(task_id=self.request.id).update(
+                status="RETRY", error=error_msg
+            )
+            raise self.retry(exc=e, countdown=countdown)
+
         logger.error(error_msg)
 
         # Update document status to failed
@@ -79,12 +214,15 @@ def process_pdf_document(self, document_id):
             document = PDFDocument.objects.get(id=document_id)
             document.processing_status = "failed"
             document.error_message = error_msg
-            document.save()
+            with transaction.atomic():
+                document.save()
+                record_document_event(document, "document.failed", self.request.id)
 
             # Update task record
             task_record = ProcessingTask.objects.get(task_id=self.request.id)
             task_record.status = "FAILURE"
             task_record.error = error_msg
+            task_record.finished_at = timezone.now()
             task_record.save()
         except:
             pass
@@ -92,25 +230,395 @@ def process_pdf_document(self, document_id):
         return {"status": "error", "message": error_msg}
 
 
-def extract_pdf_content(file_path):
+BATCH_DOCUMENT_FIELDS = [
+    "processing_status",
+    "processing_completed_at",
+    "extracted_text",
+    "page_count",
+    "metadata",
+    "vendor_template",
+    "extracted_fields",
+    "minhash",
+]
+
+
+@shared_task(
+    bind=True,
+    soft_time_limit=settings.PDF_TASK_SOFT_TIME_LIMIT,
+    time_limit=settings.PDF_TASK_TIME_LIMIT,
+    acks_late=True,
+)
+def process_pdf_batch(self, document_ids):
     """
-    Extract text, page count, and metadata from PDF file
+    Celery task to process a batch of small documents.
+
+    Saves the per-document overhead of process_pdf_document on one-page
+    invoices: the documents are extracted in a loop and all results are
+    written with a handful of bulk queries in one transaction. A document
+    that can't be extracted is handed to process_pdf_document, which
+    retries it on its own.
     """
-    extracted_data = {"text": "", "page_count": 0, "metadata": {}}
+    claimed = claim_documents(document_ids, "pending", "processing")
+    documents = list(PDFDocument.objects.filter(id__in=claimed))
+    try:
+        done, failed, ocr_jobs = process_batch_documents(self, documents)
+    except BaseException as e:
+        # Nothing of the batch was saved (e.g. the time limit hit during
+        # the write): hand every claimed document back
+        logger.warning(f"Batch failed, processing it one by one: {str(e)}")
+        requeue_documents(claimed)
+        if isinstance(e, SoftTimeLimitExceeded):
+            return {"status": "error", "processed": 0, "requeued": claimed}
+        raise
+
+    # Bulk writes skip the model signals that drop cached fragments
+    for document in done:
+        invalidate_document_fragments(document.id)
+    for document_id, page_numbers in ocr_jobs:
+        ocr_pdf_pages.delay(str(document_id), page_numbers)
+    requeue_documents(failed)
+
+    logger.info(
+        f"Processed batch of {len(done)} documents, {len(failed)} sent back "
+        f"for individual processing"
+    )
+    return {
+        "status": "success",
+        "processed": len(done),
+        "requeued": [str(document_id) for document_id in failed],
+    }
+
+
+def claim_documents(document_ids, from_status, to_status):
+    """
+    Move each document from one status to another with a conditional
+    update, returning the ids this caller moved. Of several callers
+    claiming the same document, only one gets it.
+    """
+    claimed = []
+    fields = {"processing_status": to_status}
+    if to_status == "processing":
+        fields["processing_started_at"] = timezone.now()
+    with transaction.atomic():
+        for document_id in document_ids:
+            if PDFDocument.objects.filter(
+                id=document_id, processing_status=from_status
+            ).update(**fields):
+                claimed.append(document_id)
+    return claimed
+
+
+def requeue_documents(document_ids):
+    """
+    Hand documents a batch claimed but didn't save to process_pdf_document
+    """
+    PDFDocument.objects.filter(
+        id__in=document_ids, processing_status="processing"
+    ).update(processing_status="pending")
+    for document_id in document_ids:
+        enqueue_processing(document_id)
+
+
+def process_batch_documents(task, documents):
+    """
+    Extract a batch of claimed documents and save the results in one
+    transaction. Returns the saved documents, the ids of those that failed
+    and the (document id, page numbers) of scanned pages to OCR.
+    """
+    subscriptions = list(WebhookSubscription.objects.filter(is_active=True))
+
+    done, pages, buckets, task_records, events = [], [], [], [], []
+    ocr_jobs, failed = [], []
+    for index, document in enumerate(documents):
+        started = timezone.now()
+        task_id = f"{task.request.id}:{document.id}"
+        document_pages = []
+        checkpoint = PageCheckpoint(save=document_pages.extend)
+        try:
+            with local_file_path(document.file) as file_path:
+                extracted_data = extract_document(
+                    document,
+                    file_path,
+                    checkpoint,
+                    MemoryBudget(settings.PDF_TASK_RSS_BUDGET_MB * 2**20),
+                )
+        except SoftTimeLimitExceeded:
+            logger.warning("Batch ran out of time; processing the rest one by one")
+            failed.extend(document.id for document in documents[index:])
+            break
+        except Exception as e:
+            logger.warning(f"Batch extraction of {document.id} failed: {str(e)}")
+            failed.append(document.id)
+            continue
+
+        extracted_text = join_pages(checkpoint.pages)
+        needs_ocr = settings.OCR_ENABLED and bool(checkpoint.ocr_pages)
+        document.extracted_text = extracted_text
+        document.page_count = extracted_data["page_count"]
+        document.metadata = extracted_data["metadata"] or document.metadata
+        document.vendor_template = extracted_data.get("template")
+        document.extracted_fields = extracted_data.get("fields", {})
+        document.minhash = minhash_signature(extracted_text)
+        if needs_ocr:
+            ocr_jobs.append((document.id, checkpoint.ocr_pages))
+        else:
+            document.processing_status = "completed"
+            document.processing_completed_at = timezone.now()
+            events.extend(
+                document_events(document, "document.completed", task_id, subscriptions)
+            )
+
+        done.append(document)
+        pages.extend(PDFPage(document=document, **page) for page in document_pages)
+        buckets.extend(lsh_buckets(document))
+        task_records.append(
+            ProcessingTask(
+                document=document,
+                task_id=task_id,
+                task_name="process_pdf_batch",
+                status="SUCCESS",
+                started_at=started,
+                finished_at=timezone.now(),
+                result={
+                    "attempts": 1,
+                    "batch_size": len(documents),
+                    "page_count": extracted_data["page_count"],
+                    "text_length": len(extracted_text),
+                    "ocr_pages": checkpoint.ocr_pages,
+                    "extraction_backend": extracted_data["backend"],
+                    "processing_time": str(timezone.now() - started),
+                },
+            )
+        )
+
+    # Write every result of the batch in one short transaction
+    with span("save batch", batch_size=len(done)), transaction.atomic():
+        PDFDocument.objects.bulk_update(done, BATCH_DOCUMENT_FIELDS)
+        PDFPage.objects.filter(document__in=done).delete()
+        PDFPage.objects.bulk_create(pages)
+        LSHBucket.objects.filter(document__in=done).delete()
+        LSHBucket.objects.bulk_create(buckets)
+        ProcessingTask.objects.bulk_create(task_records)
+        WebhookEvent.objects.bulk_create(events)
+
+    return done, failed, ocr_jobs
+
+
+@shared_task(bind=True)
+def ocr_pdf_pages(self, document_id, page_numbers):
+    """
+    Celery task to OCR scanned pages of a document and merge the results
+    into its extracted text. Routed to the dedicated OCR queue.
+    """
+    try:
+        document = PDFDocument.objects.get(id=document_id)
+
+        task_record = ProcessingTask.objects.create(
+            document=document,
+            task_id=self.request.id,
+            task_name="ocr_pdf_pages",
+            status="PROCESSING",
+            started_at=timezone.now(),
+        )
+
+        with local_file_path(document.file) as file_path:
+            ocr_results = ocr_pages(file_path, page_numbers)
+
+        # Merge OCR text with the pages that had a text layer
+        for page_number, text in ocr_results.items():
+            document.pages.filter(page_number=page_number).update(
+                text=text, needs_ocr=False
+            )
+        document.extracted_text = join_pages(
+            dict(document.pages.values_list("page_number", "text"))
+        )
+        document.minhash = minhash_signature(document.extracted_text)
+        document.processing_status = "completed"
+        document.processing_completed_at = timezone.now()
+        with span("save document"), transaction.atomic():
+            document.save()
+            save_lsh_buckets(document)
+            record_document_event(document, "document.completed", self.request.id)
+
+        task_record.status = "SUCCESS"
+        task_record.finished_at = timezone.now()
+        task_record.result = {
+            "ocr_pages": page_numbers,
+            "ocr_text_length": sum(len(text) for text in ocr_results.values()),
+        }
+        task_record.save()
+
+        logger.info(f"Successfully OCR processed PDF document: {document.title}")
+        return {
+            "status": "success",
+            "document_id": str(document_id),
+            "ocr_pages": page_numbers,
+        }
+
+    except PDFDocument.DoesNotExist:
+        error_msg = f"PDF document with id {document_id} not found"
+        logger.error(error_msg)
+        return {"status": "error", "message": error_msg}
+
+    except Exception as e:
+        error_msg = f"Error running OCR on PDF document: {str(e)}"
+        logger.error(error_msg)
+
+        try:
+            document = PDFDocument.objects.get(id=document_id)
+            document.processing_status = "failed"
+            document.error_message = error_msg
+            with transaction.atomic():
+                document.save()
+                record_document_event(document, "document.failed", self.request.id)
+
+            task_record = ProcessingTask.objects.get(task_id=self.request.id)
+            task_record.status = "FAILURE"
+            task_record.error = error_msg
+            task_record.finished_at = timezone.now()
+            task_record.save()
+        except:
+            pass
+
+        return {"status": "error", "message": error_msg}
+
+
+def prerender_first_page(document, file_path):
+    """
+    Render page 1 at the size the document page shows it, so its first
+    view is a cache hit. Failures are logged, never fatal.
+    """
+    try:
+        get_thumbnail(
+            document.file, 1, settings.PREVIEW_DETAIL_WIDTH, file_path=file_path
+        )
+    except Exception as e:
+        logger.warning(f"Could not pre-render preview for {document.id}: {str(e)}")
+
+
+class PageCheckpoint:
+    """
+    Collects extracted pages and hands them to save() every
+    PDF_CHECKPOINT_INTERVAL pages, tracking the next page to extract
+    """
+
+    def __init__(self, start_page=1, save=None):
+        self.next_page = start_page
+        self.save = save
+        self.pages = {}
+        self.ocr_pages = []
+        self.pending = []
+
+    def add(self, page_num, text, needs_ocr=False, **layout):
+        self.pages[page_num] = text
+        if needs_ocr:
+            self.ocr_pages.append(page_num)
+        self.pending.append(
+            dict(page_number=page_num, text=text, needs_ocr=needs_ocr, **layout)
+        )
+        self.next_page = page_num + 1
+        if len(self.pending) >= settings.PDF_CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.pending and self.save:
+            self.save(self.pending)
+        self.pending = []
+
+
+def save_page_checkpoint(document, pages):
+    """
+    Persist a batch of extracted pages (PDFPage field dicts) for a document
+    """
+    with span("save pages", page_count=len(pages)):
+        PDFPage.objects.bulk_create(
+            [PDFPage(document=document, **page) for page in pages],
+            ignore_conflicts=True,
+        )
+
+
+def extract_document(document, file_path, checkpoint, memory):
+    """
+    Extract the full text and metadata, plus the fields of the vendor
+    template the document matches, if any
+    """
+    extracted_data = extract_pdf_content(
+        file_path, checkpoint=checkpoint, memory=memory
+    )
+    if settings.VENDOR_TEMPLATES_ENABLED:
+        try:
+            with span("vendor template match"):
+                match = match_vendor_template(file_path, document.metadata)
+        except SoftTimeLimitExceeded:
+            raise
+        except Exception as e:
+            # The text was extracted (perhaps by PyPDF2); keep it, fields or not
+            logger.warning(f"Vendor template matching failed: {str(e)}")
+            match = None
+        if match:
+            extracted_data["template"], extracted_data["fields"] = match
+    return extracted_data
+
+
+def extract_pdf_content(file_path, checkpoint=None, memory=None):
+    """
+    Extract text, page count, and metadata from PDF file.
+
+    Pages that look like scans without a text layer are not run through
+    text extraction; their numbers are returned in "ocr_pages" instead.
+    When a PageCheckpoint is given, extraction starts at its next_page and
+    reports pages to it as they are extracted. With PDF_EXTRACT_WORD_LAYER
+    each page's words and their bounding boxes are captured as well.
+
+    Each page's parsed objects are released once it has been extracted. If
+    memory grows more than the MemoryBudget, the remaining pages are
+    extracted with the lighter PyPDF2 instead of pdfplumber.
+    """
+    # Imported here rather than at module level so that only workers load
+    # the extraction libraries
+    import pdfplumber
+    import PyPDF2
+
+    extracted_data = {
+        "text": "",
+        "page_count": 0,
+        "metadata": {},
+        "ocr_pages": [],
+        "backend": "pdfplumber",
+    }
+    checkpoint = checkpoint or PageCheckpoint()
+    memory = memory or MemoryBudget()
 
     try:
         # Method 1: Using pdfplumber (better for text extraction)
         with pdfplumber.open(file_path) as pdf:
             extracted_data["page_count"] = len(pdf.pages)
 
-            # Extract text from all pages
-            text_parts = []
-            for page_num, page in enumerate(pdf.pages, 1):
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(f"--- Page {page_num} ---\n{page_text}")
-
-            extracted_data["text"] = "\n\n".join(text_parts)
+            # Extract text from the remaining pages, saving what was done
+            # even if extraction is interrupted
+            try:
+                for page in pdf.pages[checkpoint.next_page - 1 :]:
+                    with span("extract page", page_number=page.page_number):
+                        if page_needs_ocr(page):
+                            checkpoint.add(page.page_number, "", needs_ocr=True)
+                        else:
+                            layout = {}
+                            if settings.PDF_EXTRACT_WORD_LAYER:
+                                layout = {
+                                    "width": float(page.width),
+                                    "height": float(page.height),
+                                    "words": encode_words(page.extract_words()),
+                                }
+                            checkpoint.add(
+                                page.page_number, page.extract_text() or "", **layout
+                            )
+                    # pdfplumber keeps every page's layout cached otherwise,
+                    # so memory would grow with the page count; scanned pages
+                    # too, as checking for a text layer parses them
+                    page.close()
+                    memory.check()
+            finally:
+                checkpoint.flush()
 
             # Extract metadata
             if pdf.metadata:
@@ -124,46 +632,137 @@ def extract_pdf_content(file_path):
                     "modification_date": str(pdf.metadata.get("ModDate", "")),
                 }
 
+    except SoftTimeLimitExceeded:
+        raise
+
     except Exception as e:
         logger.warning(f"pdfplumber failed, trying PyPDF2: {str(e)}")
+        extracted_data["backend"] = "pypdf2"
 
-        # Fallback: Using PyPDF2
+        # Fallback: Using PyPDF2, continuing after the last extracted page.
+        # It gets the whole budget again, over whatever pdfplumber left
+        # allocated; going over it fails this attempt, and the retry resumes
+        # from the last checkpoint.
+        memory.rebase()
         try:
             with open(file_path, "rb") as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 extracted_data["page_count"] = len(pdf_reader.pages)
 
-                # Extract text from all pages
-                text_parts = []
-                for page_num, page in enumerate(pdf_reader.pages, 1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(f"--- Page {page_num} ---\n{page_text}")
-
-                extracted_data["text"] = "\n\n".join(text_parts)
+                try:
+                    for page_num in range(
+                        checkpoint.next_page, extracted_data["page_count"] + 1
+                    ):
+                        with span("extract page", page_number=page_num):
+                            page = pdf_reader.pages[page_num - 1]
+                            page_text = page.extract_text()
+                            # No text layer but embedded images: likely a scan
+                            needs_ocr = not page_text and pypdf2_page_has_images(page)
+                            checkpoint.add(
+                                page_num, page_text or "", needs_ocr=needs_ocr
+                            )
+                        memory.check()
+                finally:
+                    checkpoint.flush()
 
                 # Extract metadata
-                if pdf_reader.metadata:
-                    extracted_data["metadata"] = {
-                        "title": pdf_reader.metadata.get("/Title", ""),
-                        "author": pdf_reader.metadata.get("/Author", ""),
-                        "subject": pdf_reader.metadata.get("/Subject", ""),
-                        "creator": pdf_reader.metadata.get("/Creator", ""),
-                        "producer": pdf_reader.metadata.get("/Producer", ""),
-                        "creation_date": str(
-                            pdf_reader.metadata.get("/CreationDate", "")
-                        ),
-                        "modification_date": str(
-                            pdf_reader.metadata.get("/ModDate", "")
-                        ),
-                    }
+                extracted_data["metadata"] = pypdf2_metadata(pdf_reader)
         except Exception as e2:
             logger.error(f"Both PDF extraction methods failed: {str(e2)}")
             raise e2
 
+    extracted_data["text"] = join_pages(checkpoint.pages)
+    extracted_data["ocr_pages"] = checkpoint.ocr_pages
     return extracted_data
 
 
+@shared_task
+def dispatch_deferred_documents():
+    """
+    Periodic task that enqueues deferred uploads, oldest first, as long as
+    the processing queue stays below ADMISSION_DEFER_QUEUE_DEPTH
+    """
+    capacity = dispatch_capacity()
+    if not capacity:
+        return "Dispatched 0 deferred documents"
+
+    document_ids = (
+        PDFDocument.objects.filter(processing_status="deferred")
+        .order_by("upload_date")
+        .values_list("id", "page_count")[:capacity]
+    )
+
+    count = 0
+    for document_id, page_count in document_ids:
+        # Claim the document so concurrent dispatchers never enqueue it twice;
+        # small documents join the next batch instead
+        status = "batched" if should_batch(page_count) else "pending"
+        claimed = PDFDocument.objects.filter(
+            id=document_id, processing_status="deferred"
+        ).update(processing_status=status)
+        if claimed and status == "pending":
+            enqueue_processing(document_id, page_count)
+        count += claimed
+
+    logger.info(f"Dispatched {count} deferred documents")
+    return f"Dispatched {count} deferred documents"
+
+
+@shared_task
+def dispatch_document_batches():
+    """
+    Periodic task that groups small documents waiting in "batched" status
+    into process_pdf_batch tasks of up to PDF_BATCH_SIZE documents
+    """
+    # Usually only one dispatcher runs at a time; documents are still claimed
+    # one by one, as cache.add isn't atomic on every backend
+    if not cache.add(BATCH_DISPATCH_LOCK_KEY, True, 60):
+        return "Dispatched 0 batches"
+
+    try:
+        # A batch task killed at its hard time limit, or lost with its
+        # worker, leaves its documents "processing" with no task record
+        # (batches write theirs at the end); send those round again
+        PDFDocument.objects.filter(
+            processing_status="processing",
+            processing_started_at__lt=timezone.now()
+            - timedelta(seconds=settings.PDF_TASK_TIME_LIMIT * 2),
+            tasks__isnull=True,
+        ).update(processing_status="batched")
+
+        document_ids = list(
+            PDFDocument.objects.filter(processing_status="batched")
+            .order_by("upload_date")
+            .values_list("id", flat=True)[: settings.PDF_BATCH_MAX_DOCUMENTS_PER_RUN]
+        )
+        batches = 0
+        for start in range(0, len(document_ids), settings.PDF_BATCH_SIZE):
+            batch = claim_documents(
+                document_ids[start : start + settings.PDF_BATCH_SIZE],
+                "batched",
+                "pending",
+            )
+            if batch:
+                enqueue_batch(batch)
+                batches += 1
+    finally:
+        cache.delete(BATCH_DISPATCH_LOCK_KEY)
+
+    logger.info(f"Dispatched {len(document_ids)} documents in {batches} batches")
+    return f"Dispatched {batches} batches"
+
+
+@shared_task
+def deliver_webhooks():
+    """
+    Periodic task delivering queued webhook events in signed batches
+    """
+    delivered = deliver_due_events()
+    if delivered:
+        logger.info(f"Delivered {delivered} webhook events")
+    return delivered
+
+
 @shared_task
 def cleanup_old_documents():
     """
@@ -179,12 +778,9 @@ def cleanup_old_documents():
 
     count = 0
     for document in old_documents:
-        # Delete the file from filesystem
-        if document.file and os.path.exists(document.file.path):
-            os.remove(document.file.path)
-
-        # Delete the database record
-        document.delete()
+        # Delete the database record, and the stored file unless another
+        # document shares it
+        document.delete_with_file()
         count += 1
 
     logger.info(f"Cleaned up {count} old documents")
@@ -1,3 +1,1348 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from importlib.util import find_spec
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .admission import admission_decision, sample_queue_depth
+from .autoscaling import (
+    LoadSample,
+    LoadSampler,
+    QueueAwareAutoscaler,
+    ScalingPolicy,
+    sample_queue_shares,
+    sample_task_durations,
+)
+from .exports import ExportError, decode_cursor, encode_cursor, export_queryset, iter_export_rows
+from .layout import decode_words, encode_words, words_in_region
+from .memory import MemoryBudget, MemoryBudgetExceeded
+from .models import (
+    PDFDocument,
+    PDFPage,
+    ProcessingTask,
+    VendorTemplate,
+    WebhookEvent,
+    WebhookSubscription,
+)
+from .ocr import pypdf2_page_has_images
+from .previews import enforce_cache_limit, get_thumbnail, thumbnail_cache_path, thumbnail_version
+from .probe import probe_pdf_metadata
+from .replicas import ReplicaPinningMiddleware, ReplicaRouter, read_only
+from .signals import DOCUMENT_FRAGMENTS
+from .similarity import (
+    decode_signature,
+    estimate_similarity,
+    find_similar_documents,
+    minhash_signature,
+    save_lsh_buckets,
+)
+from .storage import ShardedFileSystemStorage
+from .tasks import (
+    PageCheckpoint,
+    dispatch_document_batches,
+    extract_pdf_content,
+    process_pdf_batch,
+    process_pdf_document,
+)
+from .tracing import end_task_span, inject_trace_context, span, start_task_span
+from .vendor_templates import crop_text, match_vendor_template
+from .webhooks import (
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    claim_events,
+    deliver_due_events,
+    record_document_event,
+    retry_delay,
+    sign_payload,
+)
+
+# Keeps tests off the shared file cache, which running workers also use
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def build_pdf(*objects):
+    """
+    Assemble a PDF from the bodies of objects 1, 2, ...; object 1 is the catalog
+    """
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b'%010d 00000 n \n' % offset
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def pdf_stream(data, entries=b''):
+    return b'<< %s /Length %d >>\nstream\n%s\nendstream' % (entries, len(data), data)
+
+
+def text_pdf(texts, count=None):
+    """
+    Build a PDF with one page per text, or per list of (x, y, text) placed
+    from the bottom-left corner; count overrides the page tree's /Count
+    """
+    pages = len(texts)
+    kids = b' '.join(b'%d 0 R' % (4 + 2 * index) for index in range(pages))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 612 792] >>' % (kids, pages if count is None else count),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for index, text in enumerate(texts):
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /Contents %d 0 R /Resources << /Font << /F1 3 0 R >> >> >>' % (5 + 2 * index)
+        )
+        placed = [(72, 720, text)] if isinstance(text, str) else text
+        objects.append(
+            pdf_stream(b'\n'.join(b'BT /F1 12 Tf %d %d Td (%s) Tj ET' % (x, y, line.encode()) for x, y, line in placed))
+        )
+    return build_pdf(*objects)
+
+
+def scanned_pdf(inherit_resources=False):
+    """
+    Build a one-page PDF that is a full-page image with no text layer. Its
+    resources are an indirect object, on the page or inherited from the
+    page tree root.
+    """
+    resources = b'/Resources 5 0 R'
+    return build_pdf(
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 /MediaBox [0 0 612 792] %s >>'
+        % (resources if inherit_resources else b''),
+        b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R %s >>' % (b'' if inherit_resources else resources),
+        pdf_stream(b'q 612 0 0 792 0 0 cm /Im0 Do Q'),
+        b'<< /XObject << /Im0 6 0 R >> >>',
+        pdf_stream(
+            bytes(range(64)),
+            b'/Type /XObject /Subtype /Image /Width 8 /Height 8 /ColorSpace /DeviceGray /BitsPerComponent 8',
+        ),
+    )
+
+
+class TemporaryStorageMixin:
+    """
+    Stores the PDFs documents are created with in a temporary directory
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ShardedFileSystemStorage(location=directory.name)
+        patcher = mock.patch.object(PDFDocument._meta.get_field('file'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_pdf_document(self, content, **fields):
+        return create_document(file=ContentFile(content, name='invoice.pdf'), file_size=len(content), **fields)
+
+
+def create_document(**fields):
+    fields.setdefault('title', 'invoice.pdf')
+    fields.setdefault('file', 'pdfs/invoice.pdf')
+    fields.setdefault('file_size', 1024)
+    return PDFDocument.objects.create(**fields)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportCursorTests(TestCase):
+    def test_cursor_round_trip(self):
+        document = create_document()
+        cursor = encode_cursor(document.upload_date, document.id)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (document.upload_date, document.id))
+
+    def test_invalid_cursor(self):
+        for cursor in ['', 'not-a-cursor', encode_cursor(timezone.now(), 'not-a-uuid')]:
+            with self.assertRaises(ExportError):
+                decode_cursor(cursor)
+
+    def test_cursor_resumes_after_row(self):
+        uploaded = timezone.now()
+        documents = [create_document() for _ in range(4)]
+        # Two rows share an upload date, so the id breaks the tie
+        PDFDocument.objects.filter(id__in=[d.id for d in documents[:2]]).update(upload_date=uploaded)
+        PDFDocument.objects.filter(id=documents[2].id).update(upload_date=uploaded + timedelta(seconds=1))
+        PDFDocument.objects.filter(id=documents[3].id).update(upload_date=uploaded - timedelta(seconds=1))
+
+        rows = list(export_queryset())
+        self.assertEqual(len(rows), 4)
+        for position, row in enumerate(rows):
+            cursor = encode_cursor(row['upload_date'], row['id'])
+            remaining = [r['id'] for r in export_queryset(cursor=cursor)]
+            self.assertEqual(remaining, [r['id'] for r in rows[position + 1:]])
+
+    def test_resuming_export_with_duplicate_timestamps(self):
+        uploaded = timezone.now()
+        documents = [create_document() for _ in range(5)]
+        PDFDocument.objects.filter(id__in=[d.id for d in documents]).update(upload_date=uploaded)
+
+        def export(**params):
+            response = self.client.get(reverse('export_documents'), {'chunk_size': 1, **params})
+            self.assertEqual(response.status_code, 200)
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        rows = export()
+        self.assertEqual([row['document_id'] for row in rows], sorted(str(d.id) for d in documents))
+        # Interrupted after each row, the export resumes without repeats or gaps
+        for position, row in enumerate(rows):
+            resumed = export(cursor=row['cursor'])
+            self.assertEqual(resumed, rows[position + 1:])
+
+    def test_filters(self):
+        create_document(processing_status='completed')
+        create_document(processing_status='failed')
+        statuses = [row['processing_status'] for row in export_queryset(statuses=['completed'])]
+        self.assertEqual(statuses, ['completed'])
+        today = timezone.localdate().isoformat()
+        self.assertEqual(export_queryset(since=today, until=today).count(), 2)
+        with self.assertRaises(ExportError):
+            export_queryset(since='yesterday')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DocumentListTests(TestCase):
+    def test_pages_newest_first_with_duplicate_timestamps(self):
+        uploaded = timezone.now()
+        documents = [create_document() for _ in range(5)]
+        PDFDocument.objects.filter(id__in=[d.id for d in documents[:3]]).update(upload_date=uploaded)
+        PDFDocument.objects.filter(id=documents[3].id).update(upload_date=uploaded + timedelta(seconds=1))
+        PDFDocument.objects.filter(id=documents[4].id).update(upload_date=uploaded - timedelta(seconds=1))
+        expected = [str(d.id) for d in PDFDocument.objects.order_by('-upload_date', '-id')]
+
+        listed, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(reverse('document_list'), params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['documents']), 2)
+            listed += [d['document_id'] for d in page['documents']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(listed, expected)
+
+    @override_settings(DOCUMENT_LIST_PAGE_SIZE=2, DOCUMENT_LIST_MAX_PAGE_SIZE=3)
+    def test_limit_defaults_and_is_capped(self):
+        for _ in range(4):
+            create_document()
+        self.assertEqual(len(self.client.get(reverse('document_list')).json()['documents']), 2)
+        page = self.client.get(reverse('document_list'), {'limit': 100}).json()
+        self.assertEqual(len(page['documents']), 3)
+        self.assertIsNotNone(page['next_cursor'])
+
+    def test_invalid_cursor_or_limit(self):
+        self.assertEqual(self.client.get(reverse('document_list'), {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('document_list'), {'limit': 'all'}).status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FragmentInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.document = create_document(processing_status='completed')
+
+    def cache_fragments(self):
+        for name in DOCUMENT_FRAGMENTS:
+            cache.set(make_template_fragment_key(name, [self.document.id]), '<div></div>')
+
+    def cached_fragments(self):
+        return [
+            name for name in DOCUMENT_FRAGMENTS
+            if cache.get(make_template_fragment_key(name, [self.document.id])) is not None
+        ]
+
+    def test_document_changes_drop_fragments(self):
+        self.cache_fragments()
+        self.document.title = 'renamed.pdf'
+        self.document.save()
+        self.assertEqual(self.cached_fragments(), [])
+
+        self.cache_fragments()
+        self.document.delete()
+        self.assertEqual(self.cached_fragments(), [])
+
+    def test_task_changes_drop_fragments(self):
+        self.cache_fragments()
+        task = ProcessingTask.objects.create(
+            document=self.document, task_id='task-1', task_name='process_pdf_document'
+        )
+        self.assertEqual(self.cached_fragments(), [])
+
+        self.cache_fragments()
+        task.delete()
+        self.assertEqual(self.cached_fragments(), [])
+
+    def test_home_page_serves_cached_card_until_invalidated(self):
+        self.assertContains(self.client.get(reverse('home')), 'invoice')
+        self.document.title = 'renamed.pdf'
+        # A queryset update sends no signal, so the cached card is served
+        PDFDocument.objects.filter(pk=self.document.pk).update(title='renamed.pdf')
+        self.assertNotContains(self.client.get(reverse('home')), 'renamed.pdf')
+        self.document.save()
+        self.assertContains(self.client.get(reverse('home')), 'renamed.pdf')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ContentAddressedStorageTests(TemporaryStorageMixin, TestCase):
+    def test_name_is_sharded_hash(self):
+        content = b'%PDF-1.4 invoice'
+        digest = hashlib.sha256(content).hexdigest()
+        name = self.storage.save('pdfs/Invoice.PDF', ContentFile(content))
+        self.assertEqual(name, f'pdfs/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertTrue(self.storage.exists(name))
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('pdfs/a.pdf', ContentFile(b'%PDF-1.4 same'))
+        second = self.storage.save('pdfs/b.pdf', ContentFile(b'%PDF-1.4 same'))
+        other = self.storage.save('pdfs/a.pdf', ContentFile(b'%PDF-1.4 other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(self.storage.listdir(first.rsplit('/', 1)[0])[1]), 1)
+
+    def test_delete_with_file_keeps_shared_content(self):
+        first = PDFDocument.create_with_file(ContentFile(b'%PDF-1.4 shared', name='a.pdf'), title='a.pdf', file_size=15)
+        second = PDFDocument.create_with_file(ContentFile(b'%PDF-1.4 shared', name='b.pdf'), title='b.pdf', file_size=15)
+        self.assertEqual(first.file.name, second.file.name)
+
+        first.delete_with_file()
+        self.assertTrue(self.storage.exists(second.file.name))
+        self.assertFalse(PDFDocument.objects.filter(pk=first.pk).exists())
+
+        second.delete_with_file()
+        self.assertFalse(self.storage.exists(second.file.name))
+        self.assertFalse(PDFDocument.objects.exists())
+
+    def test_create_with_file_stores_content_again_after_delete(self):
+        first = PDFDocument.create_with_file(ContentFile(b'%PDF-1.4 again', name='a.pdf'), title='a.pdf', file_size=14)
+        first.delete_with_file()
+        self.assertFalse(self.storage.exists(first.file.name))
+
+        second = PDFDocument.create_with_file(ContentFile(b'%PDF-1.4 again', name='b.pdf'), title='b.pdf', file_size=14)
+        self.assertEqual(second.file.name, first.file.name)
+        with self.storage.open(second.file.name) as stored:
+            self.assertEqual(stored.read(), b'%PDF-1.4 again')
+
+    def test_delete_with_file_sees_rows_committed_while_locking(self):
+        first = PDFDocument.create_with_file(ContentFile(b'%PDF-1.4 racing', name='a.pdf'), title='a.pdf', file_size=15)
+        real_select_for_update = PDFDocument.objects.select_for_update
+
+        def select_for_update(*args, **kwargs):
+            # An upload of the same content commits while the delete waits
+            # for the row locks
+            create_document(file=first.file.name, file_size=15)
+            return real_select_for_update(*args, **kwargs)
+
+        with mock.patch.object(PDFDocument.objects, 'select_for_update', side_effect=select_for_update):
+            first.delete_with_file()
+        self.assertTrue(self.storage.exists(first.file.name))
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    ADMISSION_CONTROL_ENABLED=True,
+    ADMISSION_DEFER_QUEUE_DEPTH=10,
+    ADMISSION_REJECT_QUEUE_DEPTH=20,
+    ADMISSION_THROUGHPUT_WINDOW=60,
+    ADMISSION_MIN_RETRY_AFTER=5,
+    ADMISSION_MAX_RETRY_AFTER=300,
+)
+class AdmissionDecisionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def decide(self, depth):
+        with mock.patch('pdf_processing.admission.sample_queue_depth', return_value=depth):
+            return admission_decision()
+
+    def finish_tasks(self, count, task_name='process_pdf_document'):
+        document = create_document(processing_status='completed')
+        for number in range(count):
+            ProcessingTask.objects.create(
+                document=document, task_id=f'task-{task_name}-{number}',
+                task_name=task_name, status='SUCCESS'
+            )
+
+    def test_accepts_when_disabled_or_broker_unreachable(self):
+        with override_settings(ADMISSION_CONTROL_ENABLED=False):
+            self.assertEqual(self.decide(50).action, 'accept')
+        self.assertEqual(self.decide(None), ('accept', None, None, None))
+
+    def test_accepts_below_defer_depth(self):
+        self.finish_tasks(30)
+        for _ in range(3):
+            create_document(processing_status='pending')
+        decision = self.decide(3)
+        self.assertEqual(decision.action, 'accept')
+        self.assertEqual(decision.queue_depth, 3)
+        # 30 documents finished in 60 seconds: 3 wait 6 seconds
+        self.assertEqual(decision.estimated_wait_seconds, 6)
+
+    def test_defers_at_depth_and_behind_deferred_uploads(self):
+        self.assertEqual(self.decide(10).action, 'defer')
+        create_document(processing_status='deferred')
+        self.assertEqual(self.decide(0).action, 'defer')
+
+    def test_counts_batched_documents(self):
+        # Batch records count one per document towards throughput
+        self.finish_tasks(15, 'process_pdf_batch')
+        self.finish_tasks(15)
+        for _ in range(5):
+            create_document(processing_status='pending')
+        for _ in range(20):
+            create_document(processing_status='batched')
+        # One queued batch message holds the 5 pending documents
+        decision = self.decide(1)
+        self.assertEqual(decision.action, 'reject')
+        self.assertEqual(decision.queue_depth, 25)
+        self.assertEqual(decision.estimated_wait_seconds, 50)
+        # 15 documents over the defer depth at 0.5 a second
+        self.assertEqual(decision.retry_after, 30)
+
+    def test_retry_after_bounded_without_throughput(self):
+        decision = self.decide(25)
+        self.assertEqual(decision.action, 'reject')
+        self.assertIsNone(decision.estimated_wait_seconds)
+        self.assertEqual(decision.retry_after, 300)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    ADMISSION_QUEUES=['pdf_processing', 'pdf_processing_large'],
+    ADMISSION_SAMPLE_TTL=5,
+)
+class QueueDepthSampleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_sums_admission_queues(self):
+        with mock.patch('pdf_processing.admission.current_app') as app:
+            channel = app.connection_for_read.return_value.__enter__.return_value.default_channel
+            channel.queue_declare.side_effect = lambda queue, passive: mock.Mock(
+                message_count={'pdf_processing': 3, 'pdf_processing_large': 4}[queue]
+            )
+            self.assertEqual(sample_queue_depth(), 7)
+            self.assertEqual(sample_queue_depth(), 7)
+        self.assertEqual(app.connection_for_read.call_count, 1)
+
+    def test_caches_broker_failures(self):
+        with mock.patch('pdf_processing.admission.current_app') as app:
+            app.connection_for_read.side_effect = ConnectionRefusedError('broker down')
+            with self.assertLogs('pdf_processing.admission', 'WARNING'):
+                self.assertIsNone(sample_queue_depth())
+            self.assertIsNone(sample_queue_depth())
+            self.assertEqual(app.connection_for_read.call_count, 1)
+
+            # The periodic dispatcher samples afresh
+            with self.assertLogs('pdf_processing.admission', 'WARNING'):
+                self.assertIsNone(sample_queue_depth(use_cache=False))
+            self.assertEqual(app.connection_for_read.call_count, 2)
+
+
+class WordLayerTests(TestCase):
+    words = [
+        {'text': 'Invoice', 'x0': 72.0, 'top': 40.5, 'x1': 130.25, 'bottom': 52.5},
+        {'text': 'Total', 'x0': 72.0, 'top': 700.0, 'x1': 101.13, 'bottom': 712.0},
+        {'text': 'Invoice', 'x0': 400.0, 'top': 700.0, 'x1': 458.25, 'bottom': 712.0},
+        {'text': 'Größe', 'x0': 10.0, 'top': 10.0, 'x1': 20.0, 'bottom': 20.0},
+    ]
+
+    def test_round_trip(self):
+        self.assertEqual(decode_words(encode_words(self.words)), self.words)
+
+    def test_repeated_words_stored_once(self):
+        blob = encode_words(self.words)
+        self.assertEqual(blob.count(b'Invoice'), 1)
+        self.assertLess(len(blob), len(repr(self.words)))
+
+    def test_empty_and_nul_text(self):
+        self.assertEqual(decode_words(encode_words([])), [])
+        word = dict(self.words[0], text='In\0voice')
+        self.assertEqual(decode_words(encode_words([word]))[0]['text'], 'Invoice')
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            decode_words(b'%PDF-1.4 not a word layer')
+
+    def test_words_in_region(self):
+        blob = encode_words(self.words)
+        found = words_in_region(blob, 0, 690, 300, 720)
+        self.assertEqual([word['text'] for word in found], ['Total'])
+
+
+@override_settings(
+    CACHES=TEST_CACHES, SIMILARITY_SHINGLE_SIZE=3, SIMILARITY_NUM_PERM=128, SIMILARITY_BANDS=16
+)
+class SimilarityTests(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        vocabulary = [f'word{number}' for number in range(2000)]
+        self.text = ' '.join(rng.choice(vocabulary) for _ in range(300))
+        self.unrelated = ' '.join(rng.choice(vocabulary) for _ in range(300))
+        words = self.text.split()
+        words[150] = 'changed'
+        self.near_duplicate = ' '.join(words)
+
+    def similarity(self, text, other):
+        return estimate_similarity(
+            decode_signature(minhash_signature(text)), decode_signature(minhash_signature(other))
+        )
+
+    def test_signature_is_stable(self):
+        signature = minhash_signature(self.text)
+        self.assertEqual(len(decode_signature(signature)), 128)
+        self.assertEqual(signature, minhash_signature(self.text))
+        self.assertIsNone(minhash_signature(''))
+        self.assertIsNone(minhash_signature('--- Page 1 ---\n'))
+
+    def test_ignores_case_whitespace_and_page_markers(self):
+        paged = f'--- Page 1 ---\n{self.text.upper()}\n\n--- Page 2 ---\n'
+        self.assertEqual(minhash_signature(paged), minhash_signature(self.text))
+
+    def test_estimates_similarity(self):
+        self.assertGreater(self.similarity(self.text, self.near_duplicate), 0.9)
+        self.assertLess(self.similarity(self.text, self.unrelated), 0.1)
+
+    def test_finds_near_duplicates_through_lsh(self):
+        documents = {}
+        for name in ['text', 'near_duplicate', 'unrelated']:
+            documents[name] = create_document(
+                title=name, processing_status='completed',
+                minhash=minhash_signature(getattr(self, name))
+            )
+            save_lsh_buckets(documents[name])
+
+        similar = find_similar_documents(documents['text'], 0.8, 10)
+        self.assertEqual([document.title for document, _ in similar], ['near_duplicate'])
+        self.assertEqual(find_similar_documents(documents['unrelated'], 0.8, 10), [])
+        self.assertEqual(find_similar_documents(create_document(), 0.8, 10), [])
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    WEBHOOK_BATCH_SIZE=2,
+    WEBHOOK_MAX_ATTEMPTS=3,
+    WEBHOOK_RETRY_BACKOFF=30,
+    WEBHOOK_RETRY_BACKOFF_MAX=100,
+)
+class WebhookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.subscription = WebhookSubscription.objects.create(url='https://example.com/hook')
+        self.document = create_document(processing_status='completed')
+
+    def post(self, status_code=200):
+        return mock.patch(
+            'pdf_processing.webhooks.requests.post',
+            return_value=mock.Mock(status_code=status_code),
+        )
+
+    def test_signature(self):
+        body = b'{"events": []}'
+        expected = hmac.new(b'secret', b'1700000000.' + body, hashlib.sha256).hexdigest()
+        self.assertEqual(sign_payload('secret', '1700000000', body), expected)
+
+    def test_backoff_doubles_up_to_max(self):
+        self.assertEqual(
+            [retry_delay(attempts).total_seconds() for attempts in range(1, 5)],
+            [30, 60, 100, 100],
+        )
+
+    def test_records_events_for_interested_subscriptions(self):
+        WebhookSubscription.objects.create(url='https://example.com/failed', events=['document.failed'])
+        WebhookSubscription.objects.create(url='https://example.com/off', is_active=False)
+        record_document_event(self.document, 'document.completed', 'task-1')
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.subscription, self.subscription)
+        self.assertEqual(event.payload['document_id'], str(self.document.id))
+
+    def test_delivers_signed_batches(self):
+        for _ in range(3):
+            record_document_event(self.document, 'document.completed')
+        with self.post() as post:
+            self.assertEqual(deliver_due_events(), 3)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(WebhookEvent.objects.filter(status='delivered').count(), 3)
+
+        headers, body = post.call_args.kwargs['headers'], post.call_args.kwargs['data']
+        self.assertEqual(
+            headers[SIGNATURE_HEADER],
+            'sha256=' + sign_payload(self.subscription.secret, headers[TIMESTAMP_HEADER], body),
+        )
+        self.assertEqual(len(json.loads(body)['events']), 1)
+
+        # Delivered events aren't sent again
+        with self.post() as post:
+            self.assertEqual(deliver_due_events(), 0)
+        post.assert_not_called()
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        record_document_event(self.document, 'document.completed')
+        event = WebhookEvent.objects.get()
+        for attempt in range(1, 4):
+            WebhookEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+            before = timezone.now()
+            with self.post(500), self.assertLogs('pdf_processing.webhooks', 'WARNING'):
+                self.assertEqual(deliver_due_events(), 0)
+            event.refresh_from_db()
+            self.assertEqual(event.attempts, attempt)
+            self.assertEqual(event.last_error, 'HTTP 500')
+            if attempt < 3:
+                self.assertEqual(event.status, 'pending')
+                self.assertGreaterEqual(event.next_attempt_at, before + retry_delay(attempt))
+        self.assertEqual(event.status, 'dead')
+
+    def test_claimed_events_are_not_claimed_again(self):
+        record_document_event(self.document, 'document.completed')
+        events = list(WebhookEvent.objects.all())
+        self.assertEqual(claim_events(events), events)
+        # A concurrent run that selected the same events gets none of them
+        self.assertEqual(claim_events(events), [])
+        with self.post() as post:
+            self.assertEqual(deliver_due_events(), 0)
+        post.assert_not_called()
+
+
+def fake_extract_document(document, file_path, checkpoint, memory):
+    if document.title == 'broken.pdf':
+        raise ValueError('Unreadable PDF')
+    checkpoint.add(1, f'Invoice {document.title}')
+    checkpoint.flush()
+    return {'page_count': 1, 'metadata': {}, 'backend': 'pdfplumber'}
+
+
+@override_settings(CACHES=TEST_CACHES, PDF_BATCH_SIZE=2)
+class DocumentBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for target, fake in [
+            ('extract_document', fake_extract_document),
+            ('enqueue_processing', None),
+            ('enqueue_batch', None),
+        ]:
+            patcher = mock.patch(f'pdf_processing.tasks.{target}', side_effect=fake)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def run_batch(self, documents, task_id='batch-1'):
+        document_ids = [str(document.id) for document in documents]
+        return process_pdf_batch.apply(args=[document_ids], task_id=task_id).result
+
+    def test_processes_claimed_documents_once(self):
+        documents = [create_document(title=f'{n}.pdf', processing_status='pending') for n in range(2)]
+        self.assertEqual(self.run_batch(documents)['processed'], 2)
+        for document in documents:
+            document.refresh_from_db()
+            self.assertEqual(document.processing_status, 'completed')
+            self.assertEqual(document.pages.get().text, f'Invoice {document.title}')
+            task = document.tasks.get()
+            self.assertEqual(task.task_id, f'batch-1:{document.id}')
+            self.assertLessEqual(task.started_at, task.finished_at)
+
+        # A redelivered message finds nothing left to claim
+        self.assertEqual(self.run_batch(documents, 'batch-2')['processed'], 0)
+        self.assertEqual(ProcessingTask.objects.count(), 2)
+        self.assertEqual(PDFPage.objects.count(), 2)
+
+    def test_skips_documents_claimed_elsewhere(self):
+        claimed = create_document(processing_status='processing')
+        pending = create_document(processing_status='pending')
+        self.assertEqual(self.run_batch([claimed, pending])['processed'], 1)
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.processing_status, 'processing')
+        self.extract_document.assert_called_once()
+
+    def test_requeues_failed_documents(self):
+        broken = create_document(title='broken.pdf', processing_status='pending')
+        good = create_document(processing_status='pending')
+        with self.assertLogs('pdf_processing.tasks', 'WARNING'):
+            result = self.run_batch([broken, good])
+        self.assertEqual(result['requeued'], [str(broken.id)])
+        broken.refresh_from_db()
+        self.assertEqual(broken.processing_status, 'pending')
+        self.enqueue_processing.assert_called_once_with(broken.id)
+
+    def test_requeues_everything_when_the_write_times_out(self):
+        documents = [create_document(title=f'{n}.pdf', processing_status='pending') for n in range(2)]
+        with mock.patch(
+            'pdf_processing.tasks.ProcessingTask.objects.bulk_create',
+            side_effect=SoftTimeLimitExceeded(),
+        ), self.assertLogs('pdf_processing.tasks', 'WARNING'):
+            result = self.run_batch(documents)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(PDFPage.objects.count(), 0)
+        for document in documents:
+            document.refresh_from_db()
+            self.assertEqual(document.processing_status, 'pending')
+        self.assertEqual(self.enqueue_processing.call_count, 2)
+
+    def test_dispatch_claims_batches_and_reaps_lost_ones(self):
+        batched = [create_document(processing_status='batched') for _ in range(3)]
+        lost = create_document(processing_status='processing')
+        finished = create_document(processing_status='processing')
+        ProcessingTask.objects.create(document=finished, task_id='done', task_name='process_pdf_batch')
+        PDFDocument.objects.filter(id__in=[lost.id, finished.id]).update(
+            processing_started_at=timezone.now() - timedelta(days=1)
+        )
+
+        self.assertEqual(dispatch_document_batches(), 'Dispatched 2 batches')
+        dispatched = [i for call in self.enqueue_batch.call_args_list for i in call.args[0]]
+        self.assertCountEqual(dispatched, [d.id for d in batched] + [lost.id])
+        self.assertEqual(PDFDocument.objects.filter(processing_status='pending').count(), 4)
+        finished.refresh_from_db()
+        self.assertEqual(finished.processing_status, 'processing')
+
+        # Documents already claimed aren't dispatched again
+        self.assertEqual(dispatch_document_batches(), 'Dispatched 0 batches')
+
+
+class ScalingPolicyTests(TestCase):
+    def policy(self, **options):
+        options.setdefault('target_wait_seconds', 60)
+        options.setdefault('scale_up_cooldown', 10)
+        options.setdefault('scale_down_cooldown', 120)
+        options.setdefault('max_shrink_step', 2)
+        options.setdefault('min_cpu_idle', 0.1)
+        return ScalingPolicy(2, 12, **options)
+
+    def test_target_keeps_up_and_drains_backlog(self):
+        policy = self.policy()
+        # 2 tasks/s of 3s keep 6 busy; 120 waiting drain in 60s with 6 more
+        self.assertEqual(policy.target(120, 0, 2, 3), 12)
+        self.assertEqual(policy.target(0, 5, 0, 3), 5)
+        self.assertEqual(policy.decide(0, 2, 1000, 2, 2, 3, cpu_idle=1.0, cpu_count=32), 12)
+        self.assertEqual(policy.decide(200, 2, 0, 0, 0, 3), 2)
+
+    def test_growth_limited_by_cpu_and_memory(self):
+        policy = self.policy(process_memory_bytes=100)
+        self.assertEqual(policy.decide(0, 4, 1000, 4, 1, 3, cpu_idle=0.35, cpu_count=8), 6)
+        policy = self.policy(process_memory_bytes=100)
+        self.assertEqual(
+            policy.decide(0, 4, 1000, 4, 1, 3, cpu_idle=1.0, cpu_count=8, available_memory_bytes=150),
+            5,
+        )
+        self.assertEqual(policy.decide(20, 4, 1000, 4, 1, 3, cpu_idle=0.05, cpu_count=8), 4)
+
+    def test_cooldowns(self):
+        policy = self.policy()
+        grow = dict(backlog=1000, busy=4, throughput=1, avg_task_seconds=3, cpu_idle=0.35, cpu_count=8)
+        self.assertEqual(policy.decide(0, 4, **grow), 6)
+        self.assertEqual(policy.decide(5, 6, **grow), 6)
+        self.assertEqual(policy.decide(10, 6, **grow), 8)
+
+        idle = dict(backlog=0, busy=0, throughput=0, avg_task_seconds=3)
+        # Shrinking waits for the pool to be stable, then steps down
+        self.assertEqual(policy.decide(100, 8, **idle), 8)
+        self.assertEqual(policy.decide(130, 8, **idle), 6)
+        self.assertEqual(policy.decide(200, 6, **idle), 6)
+        self.assertEqual(policy.decide(250, 6, **idle), 4)
+
+    def test_never_shrinks_below_busy_processes(self):
+        policy = self.policy()
+        self.assertEqual(policy.decide(1000, 8, 0, 7, 0, 3), 7)
+
+    def test_moves_to_changed_bounds_at_once(self):
+        policy = self.policy()
+        policy.decide(0, 4, 1000, 4, 1, 3, cpu_idle=1.0, cpu_count=8)
+        policy.max_processes = 3
+        self.assertEqual(policy.decide(1, 8, 1000, 0, 1, 3), 3)
+        policy.min_processes, policy.max_processes = 5, 12
+        self.assertEqual(policy.decide(2, 3, 0, 0, 0, 3), 5)
+
+
+class QueueAwareAutoscalerTests(TestCase):
+    def test_scales_from_latest_sample_once(self):
+        pool = mock.Mock(num_processes=2)
+        autoscaler = QueueAwareAutoscaler(pool, 12, 2, worker=mock.Mock())
+        autoscaler.sampler = mock.Mock(latest=None)
+        with mock.patch('pdf_processing.autoscaling.sample_queue_shares') as sample_queue_shares:
+            self.assertFalse(autoscaler._maybe_scale())
+            autoscaler.sampler.latest = LoadSample(1.0, 300, 0.5, 3.0, 1.0, None)
+            with mock.patch('pdf_processing.autoscaling.os.cpu_count', return_value=32):
+                self.assertTrue(autoscaler._maybe_scale())
+                # Task messages between samples don't decide again
+                self.assertFalse(autoscaler._maybe_scale())
+        sample_queue_shares.assert_not_called()
+        pool.grow.assert_called_once_with(10)
+
+    def test_samples_this_workers_share_of_the_load(self):
+        declared = {
+            'pdf_processing': mock.Mock(message_count=300, consumer_count=3),
+            'pdf_processing_large': mock.Mock(message_count=10, consumer_count=2),
+        }
+        with mock.patch('celery.current_app') as app:
+            channel = app.connection_for_read.return_value.__enter__.return_value.default_channel
+            channel.queue_declare.side_effect = lambda queue, passive: declared[queue]
+            self.assertEqual(sample_queue_shares(sorted(declared)), (105, 3))
+
+            sampler = LoadSampler(sorted(declared), {'process_pdf_document'})
+            with mock.patch('pdf_processing.autoscaling.sample_task_durations', return_value=(1.5, 2.0)):
+                sample = sampler.sample()
+        self.assertEqual(sample.queue_depth, 105)
+        self.assertEqual(sample.throughput, 0.5)
+        self.assertEqual(sample.avg_task_seconds, 2.0)
+
+    def test_queue_without_consumers_counts_whole(self):
+        with mock.patch('celery.current_app') as app:
+            channel = app.connection_for_read.return_value.__enter__.return_value.default_channel
+            channel.queue_declare.return_value = mock.Mock(message_count=40, consumer_count=0)
+            self.assertEqual(sample_queue_shares(['pdf_processing']), (40, 1))
+
+
+@override_settings(CACHES=TEST_CACHES, AUTOSCALE_SAMPLE_WINDOW=60)
+class TaskDurationSampleTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def record(self, task_id, task_name, started, finished):
+        now = self.now
+        ProcessingTask.objects.create(
+            document=create_document(), task_id=task_id, task_name=task_name, status='SUCCESS',
+            started_at=now - timedelta(seconds=started), finished_at=now - timedelta(seconds=finished),
+        )
+
+    def test_times_batches_as_one_message(self):
+        self.record('batch-1:a', 'process_pdf_batch', 20, 17)
+        self.record('batch-1:b', 'process_pdf_batch', 17, 10)
+        self.record('single', 'process_pdf_document', 5, 3)
+        self.record('other', 'ocr_pdf_pages', 5, 1)
+        self.record('old', 'process_pdf_document', 600, 500)
+
+        throughput, average = sample_task_durations(['process_pdf_batch', 'process_pdf_document'])
+        self.assertEqual(throughput, 2 / 60)
+        self.assertEqual(average, (10 + 2) / 2)
+        self.assertEqual(sample_task_durations(['unknown']), (0.0, None))
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    DATABASE_REPLICAS=['replica'],
+    DATABASE_PIN_COOKIE='db_pin',
+    DATABASE_REPLICA_PIN_SECONDS=15,
+)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def request(self, view, cookie=None, **kwargs):
+        """
+        Run a view through the pinning middleware, returning the response
+        and the database the view read from
+        """
+        used = []
+
+        def get_response(request):
+            used.append(view(request, **kwargs))
+            return HttpResponse()
+
+        request = self.factory.get('/')
+        if cookie is not None:
+            request.COOKIES['db_pin'] = cookie
+        response = ReplicaPinningMiddleware(get_response)(request)
+        return response, used[0]
+
+    def read(self, request, **kwargs):
+        return self.router.db_for_read(PDFDocument)
+
+    def write_then_read(self, request, **kwargs):
+        self.router.db_for_write(PDFDocument)
+        return self.router.db_for_read(PDFDocument)
+
+    def test_only_read_only_views_use_replicas(self):
+        self.assertEqual(self.router.db_for_read(PDFDocument), 'default')
+        self.assertEqual(self.request(self.read)[1], 'default')
+        response, database = self.request(read_only(self.read))
+        self.assertEqual(database, 'replica')
+        self.assertNotIn('db_pin', response.cookies)
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.request(read_only(self.read))[1], 'default')
+
+    def test_writes_pin_client_to_primary(self):
+        response, database = self.request(read_only(self.write_then_read))
+        self.assertEqual(database, 'default')
+        pinned_until = float(response.cookies['db_pin'].value)
+        self.assertAlmostEqual(pinned_until, time.time() + 15, delta=5)
+
+        self.assertEqual(self.request(read_only(self.read), cookie=str(pinned_until))[1], 'default')
+        self.assertEqual(self.request(read_only(self.read), cookie=str(time.time() - 1))[1], 'replica')
+        self.assertEqual(self.request(read_only(self.read), cookie='garbage')[1], 'replica')
+
+    def test_uploaded_documents_pinned_without_cookie(self):
+        document = PDFDocument(title='invoice.pdf', file='pdfs/invoice.pdf', file_size=1)
+        self.request(lambda request: self.router.db_for_write(PDFDocument, instance=document))
+
+        view = read_only(self.read)
+        self.assertEqual(self.request(view, document_id=document.id)[1], 'default')
+        other = PDFDocument(title='other.pdf')
+        self.assertEqual(self.request(view, document_id=other.id)[1], 'replica')
+
+    def test_routing_outside_requests(self):
+        self.assertEqual(read_only(self.read)(None), 'replica')
+        # Workers write without pinning anything
+        document = PDFDocument(title='invoice.pdf')
+        self.assertEqual(self.router.db_for_write(PDFDocument, instance=document), 'default')
+        self.assertEqual(read_only(self.read)(None, document_id=document.id), 'replica')
+        self.assertFalse(self.router.allow_migrate('replica', 'pdf_processing'))
+        self.assertIsNone(self.router.allow_migrate('default', 'pdf_processing'))
+
+
+@override_settings(
+    CACHES=TEST_CACHES, OCR_ENABLED=True, VENDOR_TEMPLATES_ENABLED=False, PREVIEW_PRERENDER_FIRST_PAGE=False
+)
+class ScannedPageTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_pdf_document(scanned_pdf(), processing_status='pending')
+        self.path = self.document.file.path
+
+    def test_pdfplumber_routes_scans_to_ocr(self):
+        extracted = extract_pdf_content(self.path)
+        self.assertEqual(extracted['backend'], 'pdfplumber')
+        self.assertEqual(extracted['ocr_pages'], [1])
+
+    def test_pypdf2_fallback_resolves_inherited_indirect_resources(self):
+        with mock.patch('pdfplumber.open', side_effect=ValueError('Unparseable')), self.assertLogs(
+            'pdf_processing.tasks', 'WARNING'
+        ):
+            extracted = extract_pdf_content(self.path)
+        self.assertEqual(extracted['backend'], 'pypdf2')
+        self.assertEqual(extracted['ocr_pages'], [1])
+
+    def test_pypdf2_scan_detection(self):
+        import PyPDF2
+
+        for content, has_images in [
+            (scanned_pdf(), True),
+            (scanned_pdf(inherit_resources=True), True),
+            (text_pdf(['Invoice']), False),
+        ]:
+            page = PyPDF2.PdfReader(BytesIO(content)).pages[0]
+            self.assertEqual(pypdf2_page_has_images(page), has_images)
+        # A page tree node's resources, when the reader hasn't copied them
+        page = PyPDF2.PdfReader(BytesIO(scanned_pdf(inherit_resources=True))).trailer['/Root']['/Pages']['/Kids'][0]
+        self.assertTrue(pypdf2_page_has_images(page.get_object()))
+
+    def test_text_pages_are_not_sent_to_ocr(self):
+        document = self.create_pdf_document(text_pdf(['Invoice number 42 total amount due 100 EUR']))
+        extracted = extract_pdf_content(document.file.path)
+        self.assertEqual(extracted['ocr_pages'], [])
+        self.assertIn('Invoice number 42', extracted['text'])
+
+    def test_processing_hands_scanned_pages_to_ocr_queue(self):
+        with mock.patch('pdf_processing.tasks.ocr_pdf_pages.delay') as ocr_delay:
+            result = process_pdf_document.apply(args=[str(self.document.id)], task_id='task-1').result
+        self.assertEqual(result['ocr_pages'], [1])
+        ocr_delay.assert_called_once_with(str(self.document.id), [1])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.processing_status, 'processing')
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    PDF_CHECKPOINT_INTERVAL=1,
+    VENDOR_TEMPLATES_ENABLED=False,
+    PREVIEW_PRERENDER_FIRST_PAGE=False,
+)
+class CheckpointTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.texts = ['First page', 'Second page', 'Third page']
+        self.document = self.create_pdf_document(text_pdf(self.texts), processing_status='pending')
+        self.extracted = []
+
+    def extract_text(self, fail_on_page=None, failures=1):
+        """
+        Patch pdfplumber's page text extraction to record the pages it
+        extracts, timing out on fail_on_page the given number of times
+        """
+        from pdfplumber.page import Page
+
+        original = Page.extract_text
+
+        def extract_text(page, *args, **kwargs):
+            nonlocal failures
+            if page.page_number == fail_on_page and failures:
+                failures -= 1
+                raise SoftTimeLimitExceeded()
+            self.extracted.append(page.page_number)
+            return original(page, *args, **kwargs)
+
+        return mock.patch.object(Page, 'extract_text', extract_text)
+
+    def process(self, task_id='task-1'):
+        with self.assertLogs('pdf_processing.tasks') as logs:
+            result = process_pdf_document.apply(args=[str(self.document.id)], task_id=task_id).result
+        self.document.refresh_from_db()
+        return result, logs
+
+    def page_texts(self):
+        return list(self.document.pages.order_by('page_number').values_list('text', flat=True))
+
+    def test_retry_resumes_after_last_checkpoint(self):
+        with self.extract_text(fail_on_page=3):
+            result, _ = self.process()
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(self.extracted, [1, 2, 3])
+        self.assertEqual(self.document.processing_status, 'completed')
+        self.assertEqual(self.page_texts(), self.texts)
+        task = ProcessingTask.objects.get(task_id='task-1')
+        self.assertEqual(task.result['attempts'], 2)
+        self.assertEqual(task.result['resumed_from_page'], 3)
+
+    def test_gives_up_after_max_retries(self):
+        with self.extract_text(fail_on_page=2, failures=100):
+            result, logs = self.process()
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(self.document.processing_status, 'failed')
+        task = ProcessingTask.objects.get(task_id='task-1')
+        self.assertEqual(task.status, 'FAILURE')
+        self.assertEqual(task.result['attempts'], process_pdf_document.max_retries + 1)
+        self.assertEqual(sum('retrying in' in line for line in logs.output), process_pdf_document.max_retries)
+        # Page 1 was checkpointed once and never extracted again
+        self.assertEqual(self.extracted, [1])
+        self.assertEqual(self.page_texts(), ['First page'])
+
+    def test_new_task_starts_over(self):
+        # Pages left from an earlier run, with text the file no longer has
+        for number in [1, 2, 3]:
+            PDFPage.objects.create(document=self.document, page_number=number, text='Stale')
+        with self.extract_text():
+            result, _ = self.process('reprocess-1')
+        self.assertEqual(self.extracted, [1, 2, 3])
+        self.assertEqual(self.page_texts(), self.texts)
+        self.assertNotIn('Stale', self.document.extracted_text)
+        self.assertEqual(ProcessingTask.objects.get().result['resumed_from_page'], 1)
+
+
+class MemoryBudgetTests(TestCase):
+    def rss(self, *values):
+        return mock.patch('pdf_processing.memory.current_rss_bytes', side_effect=[v * 2**20 for v in values])
+
+    def test_budgets_growth_over_start(self):
+        # The process already uses more than the budget when the task starts
+        with self.rss(300, 340, 420, 360, 460):
+            memory = MemoryBudget(100 * 2**20)
+            memory.check()
+            memory.sample()
+            memory.check()
+            with self.assertRaises(MemoryBudgetExceeded):
+                memory.check()
+        self.assertEqual(memory.peak_growth, 160 * 2**20)
+        self.assertEqual(memory.peak, 460 * 2**20)
+
+    def test_unlimited(self):
+        with self.rss(100, 5000):
+            MemoryBudget().check()
+
+    def test_rebase(self):
+        with self.rss(100, 250, 250, 300):
+            memory = MemoryBudget(100 * 2**20)
+            memory.sample()
+            memory.rebase()
+            # 50MiB over the new start, though 200MiB over the task's
+            memory.check()
+        self.assertEqual(memory.peak_growth, 200 * 2**20)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MemoryBudgetExtractionTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.texts = ['First page', 'Second page', 'Third page']
+        self.path = self.create_pdf_document(text_pdf(self.texts)).file.path
+
+    def budget(self, *growth):
+        """
+        A budget of 100MiB whose checks see the given growth in MiB in turn
+        """
+        memory = MemoryBudget(100 * 2**20)
+        rss = iter([memory.start + mib * 2**20 for mib in growth])
+        return memory, mock.patch('pdf_processing.memory.current_rss_bytes', side_effect=lambda: next(rss))
+
+    def test_falls_back_to_pypdf2_over_budget(self):
+        # pdfplumber goes over after page 1; PyPDF2 stays within its budget
+        memory, rss = self.budget(120, 120, 150, 160)
+        with rss, self.assertLogs('pdf_processing.tasks', 'WARNING'):
+            extracted = extract_pdf_content(self.path, memory=memory)
+        self.assertEqual(extracted['backend'], 'pypdf2')
+        self.assertIn('Third page', extracted['text'])
+        self.assertEqual(memory.peak_growth, 160 * 2**20)
+
+    def test_pypdf2_enforces_budget(self):
+        memory, rss = self.budget(120, 120, 230)
+        checkpoint = PageCheckpoint()
+        with rss, self.assertLogs('pdf_processing.tasks', 'WARNING'), self.assertRaises(MemoryBudgetExceeded):
+            extract_pdf_content(self.path, checkpoint=checkpoint, memory=memory)
+        # Page 1 from pdfplumber and page 2 from PyPDF2 were checkpointed
+        self.assertEqual(sorted(checkpoint.pages), [1, 2])
+
+
+@override_settings(CACHES=TEST_CACHES, VENDOR_TEMPLATES_ENABLED=True, PREVIEW_PRERENDER_FIRST_PAGE=False)
+class VendorTemplateTests(TemporaryStorageMixin, TestCase):
+    invoice = [
+        (72, 720, 'ACME Corp'),
+        (400, 720, 'INV-1042'),
+        (72, 400, 'Consulting services for March'),
+        (400, 100, '1,234.00'),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.template = VendorTemplate.objects.create(
+            name='acme',
+            producer='ACME Billing',
+            anchor_text='ACME Corp',
+            anchor_region=[0, 0, 300, 100],
+            fields={
+                'invoice_number': {'page': 1, 'region': [390, 55, 600, 80]},
+                'total': {'page': 1, 'region': [390, 680, 600, 700]},
+            },
+        )
+        self.document = self.create_pdf_document(
+            text_pdf([self.invoice]), processing_status='pending', metadata={'producer': 'ACME Billing'}
+        )
+
+    def test_crop_text(self):
+        import pdfplumber
+
+        with pdfplumber.open(self.document.file.path) as pdf:
+            page = pdf.pages[0]
+            self.assertEqual(crop_text(page, [390, 55, 600, 80]), 'INV-1042')
+            # Clipped to the page, or empty when outside it
+            self.assertEqual(crop_text(page, [390, 55, 10000, 80]), 'INV-1042')
+            self.assertEqual(crop_text(page, [1000, 0, 1100, 100]), '')
+
+    def test_matches_and_extracts_fields(self):
+        template, fields = match_vendor_template(self.document.file.path, self.document.metadata)
+        self.assertEqual(template, self.template)
+        self.assertEqual(fields, {'invoice_number': 'INV-1042', 'total': '1,234.00'})
+
+    def test_no_match(self):
+        path = self.document.file.path
+        self.assertIsNone(match_vendor_template(path, {'producer': 'Other'}))
+        self.template.anchor_text = 'Globex'
+        self.template.save()
+        self.assertIsNone(match_vendor_template(path, self.document.metadata))
+
+    def test_empty_field_gives_no_fields(self):
+        self.template.fields['total']['region'] = [390, 300, 600, 320]
+        self.template.save()
+        with self.assertLogs('pdf_processing.vendor_templates', 'WARNING'):
+            self.assertIsNone(match_vendor_template(self.document.file.path, self.document.metadata))
+
+    def test_processing_keeps_full_text_with_fields(self):
+        with self.assertLogs('pdf_processing.tasks'):
+            process_pdf_document.apply(args=[str(self.document.id)], task_id='task-1')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.processing_status, 'completed')
+        self.assertEqual(self.document.vendor_template, self.template)
+        self.assertEqual(self.document.extracted_fields['invoice_number'], 'INV-1042')
+        self.assertIn('Consulting services for March', self.document.extracted_text)
+        self.assertIn('Consulting services for March', self.document.pages.get().text)
+
+        row = next(iter_export_rows(export_queryset()))
+        self.assertEqual(row['vendor_template'], 'acme')
+        self.assertEqual(row['extracted_fields'], self.document.extracted_fields)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    ADMISSION_CONTROL_ENABLED=False,
+    PDF_BATCH_ENABLED=False,
+    PDF_LARGE_DOCUMENT_PAGES=50,
+    PDF_PROBE_MAX_TRUSTED_PAGES=5000,
+)
+class ProbeTests(TemporaryStorageMixin, TestCase):
+    def probe(self, content):
+        return probe_pdf_metadata(BytesIO(content))
+
+    def upload(self, content):
+        with mock.patch('pdf_processing.views.enqueue_processing', return_value=mock.Mock(id='task-1')) as enqueue:
+            response = self.client.post(
+                reverse('upload_pdf'), {'file': SimpleUploadedFile('invoice.pdf', content)}
+            )
+        return response, enqueue
+
+    def test_reads_declared_page_count(self):
+        probe = self.probe(text_pdf(['One', 'Two', 'Three']))
+        self.assertEqual(probe['page_count'], 3)
+        # Trusted without walking the page tree
+        self.assertEqual(self.probe(text_pdf(['One', 'Two', 'Three'], count=4))['page_count'], 4)
+
+    def test_counts_pages_when_count_is_implausible(self):
+        for count in [10**9, 6000, 1, -1]:
+            with self.subTest(count=count), self.assertLogs('pdf_processing.probe', 'INFO'):
+                self.assertEqual(self.probe(text_pdf(['One', 'Two'], count=count))['page_count'], 2)
+
+    def test_garbage(self):
+        with self.assertLogs('pdf_processing.probe', 'WARNING'):
+            self.assertIsNone(self.probe(b'%PDF-1.4\nnot really a PDF'))
+        response, enqueue = self.upload(b'GIF89a not a PDF at all')
+        self.assertEqual(response.status_code, 400)
+        enqueue.assert_not_called()
+        self.assertFalse(PDFDocument.objects.exists())
+
+    def test_upload_routes_by_probed_page_count(self):
+        response, enqueue = self.upload(text_pdf(['Invoice'] * 3))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['page_count'], 3)
+        enqueue.assert_called_once_with(PDFDocument.objects.get().id, 3)
+
+        # A crafted /Count doesn't reach the large-document queue
+        response, enqueue = self.upload(text_pdf(['Other invoice'] * 2, count=10**6))
+        self.assertEqual(response.json()['page_count'], 2)
+
+
+class ThumbnailTests(TemporaryStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        previews = tempfile.TemporaryDirectory()
+        self.addCleanup(previews.cleanup)
+        self.previews = previews.name
+        patcher = override_settings(
+            CACHES=TEST_CACHES,
+            PREVIEW_CACHE_DIR=self.previews,
+            PREVIEW_CACHE_MAX_BYTES=1000,
+            PREVIEW_CACHE_TRIM_INTERVAL=60,
+            PREVIEW_PRERENDER_FIRST_PAGE=False,
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        cache.clear()
+
+    def thumbnail_url(self, document, page_number):
+        return reverse('document_page_thumbnail', args=[document.id, page_number])
+
+    def test_only_versioned_urls_are_immutable(self):
+        document = self.create_pdf_document(text_pdf(['Invoice 1001']), page_count=1)
+        response = self.client.get(self.thumbnail_url(document, 1), {'width': 160})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        response.close()
+
+        version = thumbnail_version(document.file.name)
+        response = self.client.get(self.thumbnail_url(document, 1), {'width': 160, 'v': version})
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response.close()
+        self.assertContains(
+            self.client.get(reverse('document_detail', args=[document.id])), f'v={version}'
+        )
+
+    def test_missing_pages_and_documents_are_not_found(self):
+        document = self.create_pdf_document(text_pdf(['Invoice 1001']), page_count=1)
+        self.assertEqual(self.client.get(self.thumbnail_url(document, 2)).status_code, 404)
+        missing = reverse('document_page_thumbnail', args=[uuid.uuid4(), 1])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+        # Page count not known yet: the renderer finds the page is missing
+        unprobed = self.create_pdf_document(text_pdf(['Other invoice']), page_count=None)
+        self.assertEqual(self.client.get(self.thumbnail_url(unprobed, 3)).status_code, 404)
+
+        damaged = self.create_pdf_document(b'%PDF-1.4 damaged', page_count=None)
+        self.assertEqual(self.client.get(self.thumbnail_url(damaged, 1)).status_code, 404)
+
+    def test_evicts_least_recently_used(self):
+        paths = []
+        for number in range(4):
+            path = thumbnail_cache_path('pdfs/invoice.pdf', number + 1, 160)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'x' * 300)
+            os.utime(path, (1000 + number, 1000 + number))
+            paths.append(path)
+
+        # A cache hit makes the oldest thumbnail the most recently used
+        field_file = mock.Mock()
+        field_file.name = 'pdfs/invoice.pdf'
+        self.assertEqual(get_thumbnail(field_file, 1, 160), paths[0])
+
+        with self.assertLogs('pdf_processing.previews', 'INFO'):
+            enforce_cache_limit()
+        # 1200 bytes trimmed to at most 900, oldest first
+        self.assertEqual([path.exists() for path in paths], [True, False, True, True])
+
+        # Trimming runs at most once per PREVIEW_CACHE_TRIM_INTERVAL
+        paths[1].write_bytes(b'x' * 300)
+        enforce_cache_limit()
+        self.assertTrue(paths[1].exists())
+
+
+@skipUnless(find_spec('opentelemetry.sdk'), 'opentelemetry-sdk is not installed')
+@override_settings(TRACING_ENABLED=True)
+class TracePropagationTests(TestCase):
+    def setUp(self):
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        patcher = mock.patch.dict(
+            'pdf_processing.tracing._state', {'pid': os.getpid(), 'tracer': provider.get_tracer('tests')}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_worker_continues_the_publishers_trace(self):
+        headers = {}
+        with span('upload_pdf') as upload:
+            inject_trace_context(headers=headers)
+        self.assertIn('traceparent', headers)
+        self.assertIn('published_at', headers)
+
+        # The worker sees the headers as attributes of the task request
+        task = mock.Mock(spec=['name', 'request'])
+        task.name = 'pdf_processing.tasks.process_pdf_document'
+        task.request = mock.Mock(
+            spec=['traceparent', 'published_at', 'delivery_info'],
+            traceparent=headers['traceparent'],
+            published_at=headers['published_at'],
+            delivery_info={'routing_key': 'pdf_processing'},
+        )
+        start_task_span(task_id='task-1', task=task)
+        with span('extract'):
+            pass
+        end_task_span(task_id='task-1', state='SUCCESS')
+
+        spans = {finished.name: finished for finished in self.exporter.get_finished_spans()}
+        upload_context = upload.get_span_context()
+        for name in ['queue wait', task.name]:
+            self.assertEqual(spans[name].context.trace_id, upload_context.trace_id)
+            self.assertEqual(spans[name].parent.span_id, upload_context.span_id)
+        self.assertEqual(spans['extract'].parent.span_id, spans[task.name].context.span_id)
+        self.assertEqual(spans[task.name].attributes['celery.queue'], 'pdf_processing')
+        self.assertEqual(spans[task.name].attributes['celery.state'], 'SUCCESS')
+
+    def test_nothing_is_injected_when_tracing_is_off(self):
+        headers = {}
+        with override_settings(TRACING_ENABLED=False):
+            inject_trace_context(headers=headers)
+        self.assertEqual(headers, {})
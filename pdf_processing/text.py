@@ -0,0 +1,36 @@
+import re
+
+PAGE_MARKER = re.compile(r"^--- Page (\d+) ---\n", re.MULTILINE)
+
+
+def format_page(page_num, page_text):
+    """
+    Format the text of a single page the way it is stored in extracted_text
+    """
+    return f"--- Page {page_num} ---\n{page_text}"
+
+
+def join_pages(pages):
+    """
+    Join a {page_num: text} mapping into extracted_text, skipping empty pages
+    """
+    return "\n\n".join(
+        format_page(page_num, pages[page_num])
+        for page_num in sorted(pages)
+        if pages[page_num]
+    )
+
+
+def split_pages(text):
+    """
+    Split extracted_text back into a {page_num: text} mapping
+    """
+    pages = {}
+    if not text:
+        return pages
+
+    markers = list(PAGE_MARKER.finditer(text))
+    for index, marker in enumerate(markers):
+        end = markers[index + 1].start() if index + 1 < len(markers) else len(text)
+        pages[int(marker.group(1))] = text[marker.end() : end].rstrip("\n")
+    return pages
@@ -0,0 +1,174 @@
+import contextlib
+import functools
+import logging
+import os
+import time
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Message headers carrying the trace context from the publisher to the worker
+TRACE_HEADERS = ["traceparent", "tracestate"]
+PUBLISHED_AT_HEADER = "published_at"
+
+# One tracer per process; a forked worker child sets up its own, since the
+# exporter's background thread doesn't survive fork
+_state = {"pid": None, "tracer": None}
+
+# Spans of the tasks running in this process, by task id
+_task_spans = {}
+
+
+def get_tracer():
+    """
+    Return this process's OpenTelemetry tracer, or None when tracing is off
+    or opentelemetry-sdk isn't installed
+    """
+    if not settings.TRACING_ENABLED:
+        return None
+    if _state["pid"] != os.getpid():
+        _state["pid"] = os.getpid()
+        _state["tracer"] = _configure_tracer()
+    return _state["tracer"]
+
+
+def _configure_tracer():
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("TRACING_ENABLED is set but opentelemetry-sdk is not installed")
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME})
+    )
+    provider.add_span_processor(BatchSpanProcessor(_build_exporter()))
+    return provider.get_tracer("pdf_processing")
+
+
+def _build_exporter():
+    if settings.TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+
+    if settings.TRACING_EXPORTER == "file":
+        return _file_exporter(settings.TRACING_FILE_PATH)
+
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    return ConsoleSpanExporter()
+
+
+def _file_exporter(path):
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class FileSpanExporter(SpanExporter):
+        """Append spans to a file as JSON lines, for offline analysis"""
+
+        def export(self, spans):
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            # One append per batch keeps lines from several processes intact
+            with open(path, "a") as output:
+                output.write(lines)
+            return SpanExportResult.SUCCESS
+
+    return FileSpanExporter()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Trace a block as a span of the current trace; does nothing when
+    tracing is off
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def traced(name):
+    """
+    Decorator tracing every call of a function as a span
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    """
+    Add the current trace context and publish time to outgoing task messages
+    """
+    if headers is None or get_tracer() is None:
+        return
+    from opentelemetry import propagate
+
+    propagate.inject(headers)
+    headers[PUBLISHED_AT_HEADER] = time.time_ns()
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    """
+    Continue the publisher's trace in the worker: record the time the
+    message spent queued, then open a span for the task itself
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return
+    from opentelemetry import context, propagate, trace
+
+    carrier = {
+        key: getattr(task.request, key)
+        for key in TRACE_HEADERS
+        if getattr(task.request, key, None)
+    }
+    parent = propagate.extract(carrier)
+    delivery_info = task.request.delivery_info or {}
+    attributes = {
+        "celery.task_id": task_id,
+        "celery.task_name": task.name,
+        "celery.queue": delivery_info.get("routing_key") or "",
+    }
+
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at:
+        tracer.start_span(
+            "queue wait", context=parent, start_time=published_at, attributes=attributes
+        ).end()
+
+    task_span = tracer.start_span(
+        task.name, context=parent, kind=trace.SpanKind.CONSUMER, attributes=attributes
+    )
+    token = context.attach(trace.set_span_in_context(task_span, parent))
+    _task_spans[task_id] = (task_span, token)
+
+
+@task_postrun.connect
+def end_task_span(task_id=None, state=None, **kwargs):
+    if task_id not in _task_spans:
+        return
+    from opentelemetry import context
+
+    task_span, token = _task_spans.pop(task_id)
+    task_span.set_attribute("celery.state", state or "")
+    task_span.end()
+    context.detach(token)
@@ -18,10 +18,39 @@ urlpatterns = [
         views.document_content,
         name="document_content",
     ),
+    path(
+        "api/pdf/documents/<uuid:document_id>/pages/<int:page_number>/",
+        views.document_page,
+        name="document_page",
+    ),
+    path(
+        "api/pdf/documents/<uuid:document_id>/pages/<int:page_number>/words/",
+        views.document_page_words,
+        name="document_page_words",
+    ),
+    path(
+        "api/pdf/documents/<uuid:document_id>/pages/<int:page_number>/thumbnail/",
+        views.document_page_thumbnail,
+        name="document_page_thumbnail",
+    ),
+    path(
+        "api/pdf/documents/<uuid:document_id>/similar/",
+        views.similar_documents,
+        name="similar_documents",
+    ),
     path(
         "api/pdf/documents/<uuid:document_id>/delete/",
         views.delete_document,
         name="delete_document",
     ),
+    path("api/pdf/export/", views.export_documents, name="export_documents"),
+    path(
+        "api/pdf/webhooks/", views.webhook_subscriptions, name="webhook_subscriptions"
+    ),
+    path(
+        "api/pdf/webhooks/<uuid:subscription_id>/delete/",
+        views.delete_webhook_subscription,
+        name="delete_webhook_subscription",
+    ),
     path("api/pdf/tasks/<str:task_id>/status/", views.task_status, name="task_status"),
 ]
@@ -0,0 +1,116 @@
+import logging
+import uuid
+
+from django.core.cache import cache
+
+from .models import VendorTemplate
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a template changes; workers reload their copy when it moves
+VERSION_CACHE_KEY = "vendor_templates:version"
+
+_loaded = {"version": None, "templates": []}
+
+
+def invalidate_vendor_templates():
+    """
+    Make every worker reload vendor templates before its next document
+    """
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def get_vendor_templates():
+    """
+    Return the active vendor templates, cached in this process until a
+    template is saved or deleted
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+
+    if _loaded["version"] != version:
+        _loaded["templates"] = list(VendorTemplate.objects.filter(is_active=True))
+        _loaded["version"] = version
+    return _loaded["templates"]
+
+
+def crop_text(page, region):
+    """
+    Extract the text inside a region of a pdfplumber page, clipped to the page
+    """
+    x0, top, x1, bottom = region
+    page_x0, page_top, page_x1, page_bottom = page.bbox
+    bbox = (
+        max(x0, page_x0),
+        max(top, page_top),
+        min(x1, page_x1),
+        min(bottom, page_bottom),
+    )
+    if bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        return ""
+    return (page.crop(bbox).extract_text() or "").strip()
+
+
+def anchor_matches(pdf, template):
+    """
+    Check whether a template's anchor text is on the first page
+    """
+    page = pdf.pages[0]
+    if template.anchor_region:
+        text = crop_text(page, template.anchor_region)
+    else:
+        text = page.extract_text() or ""
+    return template.anchor_text in text
+
+
+def extract_template_fields(pdf, template):
+    """
+    Extract a template's fields from their regions. Returns None when a
+    field comes out empty, which usually means the vendor changed layout.
+    """
+    fields = {}
+    for name, field in template.fields.items():
+        if field["page"] > len(pdf.pages):
+            return None
+        value = crop_text(pdf.pages[field["page"] - 1], field["region"])
+        if not value:
+            return None
+        fields[name] = value
+    return fields
+
+
+def match_vendor_template(file_path, metadata):
+    """
+    Find the first vendor template that matches a document and extract its
+    fields, returning (template, fields) or None.
+
+    Templates are first filtered on the producer and creator metadata read
+    at upload, so most documents never open the PDF here.
+    """
+    candidates = [
+        template
+        for template in get_vendor_templates()
+        if template.matches_metadata(metadata)
+    ]
+    if not candidates:
+        return None
+
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        if not pdf.pages:
+            return None
+        for template in candidates:
+            if not anchor_matches(pdf, template):
+                continue
+            fields = extract_template_fields(pdf, template)
+            if fields is None:
+                logger.warning(
+                    f"Vendor template {template.name} matched but a field was "
+                    f"empty; leaving the document without fields"
+                )
+                continue
+            return template, fields
+    return None
@@ -1,20 +1,47 @@
 import os
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import PDFDocument, ProcessingTask
-from .tasks import process_pdf_document
+from django.db.models import OuterRef, Q, Subquery
+from .models import PDFDocument, PDFPage, ProcessingTask, WebhookSubscription
+from .exports import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    ExportError,
+    decode_cursor,
+    encode_cursor,
+    export_queryset,
+    iter_export_rows,
+)
+from .queueing import enqueue_processing, should_batch
+from .admission import admission_decision
+from .text import split_pages
+from .layout import decode_words, words_in_region
+from .previews import PreviewError, get_thumbnail, snap_width, thumbnail_version
+from .probe import has_pdf_header, probe_pdf_metadata
+from .similarity import find_similar_documents
+from .replicas import read_only
+from .tracing import span, traced
 import json
 
 
+# Columns needed to list documents; excludes the large extracted_text
+DOCUMENT_SUMMARY_FIELDS = [
+    'id', 'title', 'processing_status', 'upload_date',
+    'file_size', 'page_count', 'error_message',
+]
+
+
 @api_view(['POST'])
+@traced('upload_pdf')
 def upload_pdf(request):
     """
     Upload a PDF file and trigger processing
@@ -42,22 +69,63 @@ def upload_pdf(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    try:
-        # Create PDF document record
-        document = PDFDocument.objects.create(
-            title=title,
-            file=file,
-            file_size=file.size
+    if not has_pdf_header(file):
+        return Response(
+            {'error': 'File is not a PDF'}, 
+            status=status.HTTP_400_BAD_REQUEST
         )
+    
+    # Refuse uploads outright when the processing backlog is saturated
+    with span('admission'):
+        admission = admission_decision()
+    if admission.action == 'reject':
+        response = Response({
+            'error': 'Processing backlog is full, please retry later',
+            'queue_depth': admission.queue_depth,
+            'estimated_wait_seconds': admission.estimated_wait_seconds,
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(admission.retry_after)
+        return response
+    
+    try:
+        # Read page count and metadata up front; full extraction comes later
+        with span('probe metadata'):
+            probe = probe_pdf_metadata(file) or {}
         
-        # Trigger Celery task
-        task = process_pdf_document.delay(str(document.id))
+        # Small documents wait to be grouped into a batch by the dispatcher
+        if admission.action == 'defer':
+            initial_status = 'deferred'
+        elif should_batch(probe.get('page_count')):
+            initial_status = 'batched'
+        else:
+            initial_status = 'pending'
+        
+        # Create PDF document record, writing the file to storage
+        with span('storage write', file_size=file.size):
+            document = PDFDocument.create_with_file(
+                file,
+                title=title,
+                file_size=file.size,
+                page_count=probe.get('page_count'),
+                metadata=probe.get('metadata', {}),
+                processing_status=initial_status
+            )
+        
+        # Trigger Celery task, unless a dispatcher will enqueue it later
+        task_id = None
+        if initial_status == 'pending':
+            with span('enqueue', document_id=str(document.id)):
+                task_id = enqueue_processing(document.id, document.page_count).id
         
         return Response({
             'message': 'PDF uploaded successfully',
             'document_id': str(document.id),
-            'task_id': task.id,
-            'status': 'pending'
+            'task_id': task_id,
+            'status': document.processing_status,
+            'page_count': document.page_count,
+            'metadata': document.metadata,
+            'queue_depth': admission.queue_depth,
+            'estimated_wait_seconds': admission.estimated_wait_seconds,
         }, status=status.HTTP_201_CREATED)
         
     except Exception as e:
@@ -68,6 +136,7 @@ def upload_pdf(request):
 
 
 @api_view(['GET'])
+@read_only
 def document_status(request, document_id):
     """
     Get the processing status of a document
@@ -106,12 +175,15 @@ def document_status(request, document_id):
 
 
 @api_view(['GET'])
+@read_only
 def document_content(request, document_id):
     """
     Get the extracted content of a processed document
     """
     try:
-        document = get_object_or_404(PDFDocument, id=document_id)
+        document = get_object_or_404(
+            PDFDocument.objects.select_related('vendor_template'), id=document_id
+        )
         
         if document.processing_status != 'completed':
             return Response(
@@ -125,6 +197,8 @@ def document_content(request, document_id):
             'extracted_text': document.extracted_text,
             'page_count': document.page_count,
             'metadata': document.metadata,
+            'vendor_template': document.vendor_template.name if document.vendor_template else None,
+            'extracted_fields': document.extracted_fields,
             'processing_completed_at': document.processing_completed_at
         })
         
@@ -136,17 +210,195 @@ def document_content(request, document_id):
 
 
 @api_view(['GET'])
+@read_only
+def document_page(request, document_id, page_number):
+    """
+    Get the extracted text of a single page, for lazy loading in the UI
+    """
+    try:
+        page = PDFPage.objects.filter(
+            document_id=document_id, page_number=page_number
+        ).values('text', 'needs_ocr').first()
+        
+        if page is None:
+            # Documents processed before per-page storage only have the full text
+            document = get_object_or_404(
+                PDFDocument.objects.only('extracted_text', 'page_count'), id=document_id
+            )
+            if not 1 <= page_number <= (document.page_count or 0):
+                return Response(
+                    {'error': 'Page not found'}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            page = {
+                'text': split_pages(document.extracted_text).get(page_number, ''),
+                'needs_ocr': False,
+            }
+        
+        return Response({
+            'document_id': str(document_id),
+            'page_number': page_number,
+            'text': page['text'],
+            'needs_ocr': page['needs_ocr'],
+        })
+        
+    except Http404:
+        raise
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to get document page: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@read_only
+def document_page_words(request, document_id, page_number):
+    """
+    Get the words of a page with their bounding boxes, optionally limited
+    to those overlapping ?region=x0,top,x1,bottom (PDF points)
+    """
+    try:
+        page = get_object_or_404(
+            PDFPage.objects.only('width', 'height', 'words'),
+            document_id=document_id,
+            page_number=page_number
+        )
+        
+        if page.words is None:
+            return Response(
+                {'error': 'No word layer stored for this page'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        region = request.query_params.get('region')
+        if region:
+            try:
+                x0, top, x1, bottom = (float(value) for value in region.split(','))
+            except ValueError:
+                return Response(
+                    {'error': 'region must be x0,top,x1,bottom'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            words = words_in_region(bytes(page.words), x0, top, x1, bottom)
+        else:
+            words = decode_words(bytes(page.words))
+        
+        return Response({
+            'document_id': str(document_id),
+            'page_number': page_number,
+            'width': page.width,
+            'height': page.height,
+            'words': words,
+        })
+        
+    except Http404:
+        raise
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to get page words: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@read_only
+def similar_documents(request, document_id):
+    """
+    Find near-duplicates of a document with their estimated similarity,
+    optionally with ?threshold= (0 to 1) and ?limit=
+    """
+    try:
+        document = get_object_or_404(
+            PDFDocument.objects.only('processing_status', 'minhash'), id=document_id
+        )
+        
+        if document.processing_status != 'completed':
+            return Response(
+                {'error': 'Document processing not completed'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            threshold = float(request.query_params.get('threshold', settings.SIMILARITY_THRESHOLD))
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response(
+                {'error': 'threshold must be a number and limit an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= threshold <= 1 or not 1 <= limit <= 100:
+            return Response(
+                {'error': 'threshold must be between 0 and 1 and limit between 1 and 100'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        similar = find_similar_documents(document, threshold, limit)
+        return Response({
+            'document_id': str(document_id),
+            'threshold': threshold,
+            'similar': [
+                {
+                    'document_id': str(other.id),
+                    'title': other.title,
+                    'upload_date': other.upload_date,
+                    'similarity': round(similarity, 3),
+                }
+                for other, similarity in similar
+            ],
+        })
+        
+    except Http404:
+        raise
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to find similar documents: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@read_only
 def document_list(request):
     """
-    List all documents with their status
+    List documents with their status, newest first, a page at a time.
+
+    Returns up to ?limit= documents; pass next_cursor back as ?cursor= for
+    the following page. next_cursor is null on the last page.
     """
     try:
-        documents = PDFDocument.objects.all()
+        limit = int(request.GET.get('limit', settings.DOCUMENT_LIST_PAGE_SIZE))
+        limit = min(max(limit, 1), settings.DOCUMENT_LIST_MAX_PAGE_SIZE)
+        cursor = request.GET.get('cursor')
+        position = decode_cursor(cursor) if cursor else None
+    except (ExportError, ValueError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # Skip the large text columns and fetch each document's latest task
+        # in the same query instead of one query per document
+        latest_tasks = ProcessingTask.objects.filter(
+            document=OuterRef('pk')
+        ).order_by('-created_at')
+        documents = PDFDocument.objects.only(*DOCUMENT_SUMMARY_FIELDS).annotate(
+            latest_task_id=Subquery(latest_tasks.values('task_id')[:1]),
+            latest_task_status=Subquery(latest_tasks.values('status')[:1]),
+        ).order_by('-upload_date', '-id')
+        if position:
+            # Keyset pagination, walking the export index backwards
+            upload_date, document_id = position
+            documents = documents.filter(
+                Q(upload_date__lt=upload_date) | Q(upload_date=upload_date, id__lt=document_id)
+            )
+        # One extra row tells whether there is a next page
+        documents = list(documents[:limit + 1])
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1].upload_date, documents[-1].id)
         
         document_list = []
         for doc in documents:
-            latest_task = doc.tasks.order_by('-created_at').first()
-            
             document_data = {
                 'document_id': str(doc.id),
                 'title': doc.title,
@@ -157,15 +409,16 @@ def document_list(request):
                 'error_message': doc.error_message,
             }
             
-            if latest_task:
-                document_data['task_id'] = latest_task.task_id
-                document_data['task_status'] = latest_task.status
+            if doc.latest_task_id:
+                document_data['task_id'] = doc.latest_task_id
+                document_data['task_status'] = doc.latest_task_status
             
             document_list.append(document_data)
         
         return Response({
             'documents': document_list,
-            'total_count': len(document_list)
+            'total_count': len(document_list),
+            'next_cursor': next_cursor,
         })
         
     except Exception as e:
@@ -183,12 +436,9 @@ def delete_document(request, document_id):
     try:
         document = get_object_or_404(PDFDocument, id=document_id)
         
-        # Delete the file from filesystem
-        if document.file and os.path.exists(document.file.path):
-            os.remove(document.file.path)
-        
-        # Delete the database record
-        document.delete()
+        # Delete the database record, and the stored file unless another
+        # document shares it
+        document.delete_with_file()
         
         return Response({
             'message': 'Document deleted successfully'
@@ -201,7 +451,88 @@ def delete_document(request, document_id):
         )
 
 
+def subscription_data(subscription):
+    return {
+        'subscription_id': str(subscription.id),
+        'url': subscription.url,
+        'events': subscription.events,
+        'is_active': subscription.is_active,
+        'created_at': subscription.created_at,
+    }
+
+
+@api_view(['GET', 'POST'])
+def webhook_subscriptions(request):
+    """
+    List webhook subscriptions, or subscribe a URL to document events.
+    The signing secret is only returned when the subscription is created.
+    """
+    try:
+        if request.method == 'GET':
+            subscriptions = WebhookSubscription.objects.all()
+            return Response({
+                'subscriptions': [subscription_data(subscription) for subscription in subscriptions]
+            })
+        
+        url = request.data.get('url')
+        events = request.data.get('events') or []
+        if isinstance(events, str):
+            events = [events]
+        valid_events = dict(WebhookSubscription.EVENT_CHOICES)
+        unknown = [event for event in events if event not in valid_events]
+        if unknown:
+            return Response(
+                {'error': f'Unknown events: {", ".join(unknown)}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        subscription = WebhookSubscription(url=url, events=events)
+        try:
+            subscription.full_clean()
+        except ValidationError as e:
+            return Response(
+                {'error': e.message_dict}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        subscription.save()
+        
+        return Response(
+            {**subscription_data(subscription), 'secret': subscription.secret},
+            status=status.HTTP_201_CREATED
+        )
+        
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to manage webhook subscriptions: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['DELETE'])
+def delete_webhook_subscription(request, subscription_id):
+    """
+    Delete a webhook subscription and its queued events
+    """
+    try:
+        subscription = get_object_or_404(WebhookSubscription, id=subscription_id)
+        subscription.delete()
+        
+        return Response(
+            {'message': 'Webhook subscription deleted successfully'}, 
+            status=status.HTTP_200_OK
+        )
+        
+    except Http404:
+        raise
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to delete webhook subscription: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['GET'])
+@read_only
 def task_status(request, task_id):
     """
     Get the status of a specific Celery task
@@ -228,27 +559,123 @@ def task_status(request, task_id):
         )
 
 
+@require_http_methods(['GET'])
+def export_documents(request):
+    """
+    Stream documents as NDJSON or CSV, filtered by status and upload date.
+
+    Every row carries a cursor; pass the last one received back as
+    ?cursor= to resume an interrupted export.
+    """
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse(
+            {'error': f'Unsupported format: {export_format}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    statuses = [s for s in request.GET.get('status', '').split(',') if s]
+
+    try:
+        chunk_size = int(request.GET.get('chunk_size', DEFAULT_CHUNK_SIZE))
+        queryset = export_queryset(
+            statuses=statuses,
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            cursor=request.GET.get('cursor'),
+        )
+    except (ExportError, ValueError) as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    serialize, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        serialize(iter_export_rows(queryset, chunk_size=max(chunk_size, 1))),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="documents.{export_format}"'
+    return response
+
+
+@require_http_methods(['GET'])
+@read_only
+def document_page_thumbnail(request, document_id, page_number):
+    """
+    Serve a JPEG thumbnail of a page, rendered on first request and cached.
+
+    ?width= is snapped to one of PREVIEW_WIDTHS. With ?v= set to the
+    stored file's thumbnail_version() the URL names the content, so the
+    response is cacheable by browsers and proxies for a year; without it,
+    only for PREVIEW_UNVERSIONED_MAX_AGE seconds.
+    """
+    document = get_object_or_404(PDFDocument.objects.only('file', 'page_count'), id=document_id)
+    
+    if document.page_count and not 1 <= page_number <= document.page_count:
+        raise Http404('Page not found')
+    
+    try:
+        width = snap_width(int(request.GET.get('width', settings.PREVIEW_DEFAULT_WIDTH)))
+    except ValueError:
+        return JsonResponse(
+            {'error': 'width must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # The cache may evict a thumbnail before it is opened; render it again once
+    for attempt in range(2):
+        try:
+            thumbnail = open(get_thumbnail(document.file, page_number, width), 'rb')
+            break
+        except FileNotFoundError:
+            continue
+        except IndexError:
+            raise Http404('Page not found')
+        except PreviewError:
+            raise Http404('Page could not be rendered')
+    else:
+        raise Http404('Preview not available')
+    
+    response = FileResponse(thumbnail, content_type='image/jpeg')
+    if request.GET.get('v') == thumbnail_version(document.file.name):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.PREVIEW_UNVERSIONED_MAX_AGE}'
+    return response
+
+
 # Template views for UI
+@read_only
 def home(request):
     """
     Home page view - displays upload form and document list
     """
-    documents = PDFDocument.objects.all().order_by('-upload_date')[:50]  # Latest 50 documents
+    # The first page of the document list API, which Refresh reloads
+    documents = PDFDocument.objects.only(*DOCUMENT_SUMMARY_FIELDS).order_by('-upload_date', '-id')
+    documents = documents[:settings.DOCUMENT_LIST_PAGE_SIZE]
     context = {
         'documents': documents,
-        'max_upload_size_mb': settings.MAX_UPLOAD_SIZE / (1024 * 1024)
+        'max_upload_size_mb': settings.MAX_UPLOAD_SIZE / (1024 * 1024),
+        'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
     }
     return render(request, 'pdf_processing/home.html', context)
 
 
+@read_only
 def document_detail(request, document_id):
     """
     Document detail page view
     """
-    document = get_object_or_404(PDFDocument, id=document_id)
+    # Page text is loaded lazily by the page, so skip the full text here
+    document = get_object_or_404(PDFDocument.objects.defer('extracted_text'), id=document_id)
     latest_task = document.tasks.order_by('-created_at').first()
     context = {
         'document': document,
         'latest_task': latest_task,
+        'page_numbers': range(1, (document.page_count or 0) + 1),
+        'preview_width': settings.PREVIEW_DETAIL_WIDTH,
+        'preview_version': thumbnail_version(document.file.name),
+        'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
     }
     return render(request, 'pdf_processing/document_detail.html', context)
@@ -0,0 +1,217 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import WebhookEvent, WebhookSubscription
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_LOCK_KEY = "webhooks:dispatching"
+SIGNATURE_HEADER = "X-Webhook-Signature"
+TIMESTAMP_HEADER = "X-Webhook-Timestamp"
+
+
+def document_event_payload(document, task_id=None):
+    return {
+        "document_id": str(document.id),
+        "title": document.title,
+        "status": document.processing_status,
+        "page_count": document.page_count,
+        "error_message": document.error_message,
+        "processing_completed_at": (
+            document.processing_completed_at.isoformat()
+            if document.processing_completed_at
+            else None
+        ),
+        "task_id": task_id,
+    }
+
+
+def document_events(document, event_type, task_id, subscriptions):
+    """
+    Build (unsaved) events for the given subscriptions that want this type
+    """
+    payload = document_event_payload(document, task_id)
+    return [
+        WebhookEvent(subscription=subscription, event_type=event_type, payload=payload)
+        for subscription in subscriptions
+        if subscription.wants(event_type)
+    ]
+
+
+def record_document_event(document, event_type, task_id=None):
+    """
+    Queue an event for every active subscription that wants it. Call this in
+    the transaction that changes the document, so an event is only queued
+    if the change is committed.
+    """
+    WebhookEvent.objects.bulk_create(
+        document_events(
+            document,
+            event_type,
+            task_id,
+            WebhookSubscription.objects.filter(is_active=True),
+        )
+    )
+
+
+def sign_payload(secret, timestamp, body):
+    """
+    Sign a delivery as HMAC-SHA256 over "<timestamp>.<body>"; receivers
+    should recompute it and reject stale timestamps to prevent replays
+    """
+    message = f"{timestamp}.".encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def deliver_batch(subscription, events):
+    """
+    POST a batch of events to a subscription in one signed request.
+    Returns None on success or an error message.
+    """
+    body = json.dumps(
+        {
+            "events": [
+                {
+                    "id": str(event.id),
+                    "type": event.event_type,
+                    "created_at": event.created_at,
+                    "data": event.payload,
+                }
+                for event in events
+            ]
+        },
+        cls=DjangoJSONEncoder,
+    ).encode()
+    timestamp = str(int(time.time()))
+    try:
+        response = requests.post(
+            subscription.url,
+            data=body,
+            headers={
+                "Content-Type": "application/json",
+                TIMESTAMP_HEADER: timestamp,
+                SIGNATURE_HEADER: "sha256="
+                + sign_payload(subscription.secret, timestamp, body),
+            },
+            timeout=settings.WEBHOOK_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        return str(e)
+    if not 200 <= response.status_code < 300:
+        return f"HTTP {response.status_code}"
+    return None
+
+
+def retry_delay(attempts):
+    return timedelta(
+        seconds=min(
+            settings.WEBHOOK_RETRY_BACKOFF * 2 ** (attempts - 1),
+            settings.WEBHOOK_RETRY_BACKOFF_MAX,
+        )
+    )
+
+
+def claim_events(events):
+    """
+    Lease events to this dispatcher by moving their next attempt past the
+    time a run may take, and return the ones it got. A dispatcher running
+    at the same time finds them leased and skips them; if this one dies
+    mid-delivery, they are retried once the lease runs out.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.WEBHOOK_DISPATCH_LOCK_TIMEOUT)
+    ids = [event.id for event in events]
+    WebhookEvent.objects.filter(
+        id__in=ids, status="pending", next_attempt_at__lte=now
+    ).update(next_attempt_at=lease_until)
+    claimed = set(
+        WebhookEvent.objects.filter(
+            id__in=ids, status="pending", next_attempt_at=lease_until
+        ).values_list("id", flat=True)
+    )
+    return [event for event in events if event.id in claimed]
+
+
+def deliver_due_events():
+    """
+    Deliver pending events whose next attempt is due, coalesced into one
+    request per subscription of up to WEBHOOK_BATCH_SIZE events. Failed
+    batches are retried with exponential backoff; after WEBHOOK_MAX_ATTEMPTS
+    their events are marked dead. No new batch is started after
+    WEBHOOK_DISPATCH_TIME_BUDGET seconds. Returns the number of events
+    delivered.
+    """
+    # Usually only one dispatcher runs at a time; events are still claimed
+    # before sending, as cache.add isn't atomic on every backend
+    if not cache.add(DISPATCH_LOCK_KEY, True, settings.WEBHOOK_DISPATCH_LOCK_TIMEOUT):
+        return 0
+
+    deadline = time.monotonic() + settings.WEBHOOK_DISPATCH_TIME_BUDGET
+    delivered = 0
+    try:
+        due = (
+            WebhookEvent.objects.filter(
+                status="pending",
+                next_attempt_at__lte=timezone.now(),
+                subscription__is_active=True,
+            )
+            .select_related("subscription")
+            .order_by("created_at")[: settings.WEBHOOK_MAX_EVENTS_PER_RUN]
+        )
+        batches = {}
+        for event in due:
+            batches.setdefault(event.subscription_id, []).append(event)
+
+        for events in batches.values():
+            subscription = events[0].subscription
+            for start in range(0, len(events), settings.WEBHOOK_BATCH_SIZE):
+                if time.monotonic() > deadline:
+                    # Leave the rest for the next run, before the lock expires
+                    return delivered
+                batch = claim_events(
+                    events[start : start + settings.WEBHOOK_BATCH_SIZE]
+                )
+                if not batch:
+                    continue
+                error = deliver_batch(subscription, batch)
+                ids = [event.id for event in batch]
+                if error is None:
+                    WebhookEvent.objects.filter(id__in=ids).update(
+                        status="delivered",
+                        delivered_at=timezone.now(),
+                        last_error=None,
+                    )
+                    delivered += len(batch)
+                    continue
+
+                logger.warning(
+                    f"Webhook delivery to {subscription.url} failed: {error}"
+                )
+                for event in batch:
+                    event.attempts += 1
+                    event.last_error = error
+                    if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                        event.status = "dead"
+                    else:
+                        event.next_attempt_at = timezone.now() + retry_delay(
+                            event.attempts
+                        )
+                WebhookEvent.objects.bulk_update(
+                    batch, ["attempts", "last_error", "status", "next_attempt_at"]
+                )
+                # The endpoint is failing; leave its other batches for later
+                break
+    finally:
+        cache.delete(DISPATCH_LOCK_KEY)
+
+    return delivered
@@ -12,6 +12,14 @@ source venv/bin/activate
 echo "Starting Celery worker..."
 python start_celery_worker.py &
 
+# Start dispatch worker for the periodic dispatch tasks in background
+echo "Starting Celery dispatch worker..."
+python start_celery_dispatch_worker.py &
+
+# Start OCR worker for scanned pages in background
+echo "Starting Celery OCR worker..."
+python start_celery_ocr_worker.py &
+
 # Start Celery beat scheduler in background
 echo "Starting Celery beat scheduler..."
 python start_celery_beat.py &
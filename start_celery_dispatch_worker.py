@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+Script to start Celery worker for the periodic dispatch tasks
+"""
+import os
+import sys
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'invoice_processor.settings')
+django.setup()
+
+from celery import current_app
+
+if __name__ == '__main__':
+    # Start Celery dispatch worker with a small fixed pool: its tasks are
+    # short and periodic, so they neither need nor should drive autoscaling
+    current_app.worker_main([
+        'worker',
+        '--loglevel=info',
+        '--concurrency=2',
+        '--queues=pdf_dispatch',
+        # Its own node name, so it can share a host with the main worker
+        '--hostname=dispatch@%h'
+    ])
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+Script to start Celery worker for OCR of scanned PDF pages
+"""
+import os
+import sys
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'invoice_processor.settings')
+django.setup()
+
+from celery import current_app
+
+if __name__ == '__main__':
+    # Start Celery OCR worker with 1 to 4 processes
+    current_app.worker_main([
+        'worker',
+        '--loglevel=info',
+        '--autoscale=4,1',
+        '--queues=pdf_ocr',
+        # Its own node name, so it can share a host with the main worker
+        '--hostname=ocr@%h'
+    ])
+
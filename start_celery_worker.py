@@ -18,11 +18,11 @@ django.setup()
 from celery import current_app
 
 if __name__ == '__main__':
-    # Start Celery worker
+    # Start Celery worker; QueueAwareAutoscaler sizes the pool between 2 and 12
     current_app.worker_main([
         'worker',
         '--loglevel=info',
-        '--concurrency=4',
-        '--queues=pdf_processing'
+        '--autoscale=12,2',
+        '--queues=pdf_processing,pdf_processing_large'
     ])
 